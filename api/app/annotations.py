@@ -36,3 +36,24 @@ class RelationGroup(BaseModel):
 class PdfAnnotation(BaseModel):
     annotations: List[Annotation]
     relations: List[RelationGroup]
+
+
+class AnnotationDelta(BaseModel):
+    added: List[Annotation] = []
+    updated: List[Annotation] = []
+    deleted: List[str] = []
+
+
+class RelationDelta(BaseModel):
+    added: List[RelationGroup] = []
+    deleted: List[RelationGroup] = []
+
+
+class PdfAnnotationDelta(BaseModel):
+    """
+    The changes to a user's annotations of a pdf since their last save.
+    Annotations are identified by their id, and relations by their value.
+    """
+
+    annotations: AnnotationDelta = AnnotationDelta()
+    relations: RelationDelta = RelationDelta()
@@ -0,0 +1,112 @@
+from typing import Dict, Any, Optional, Tuple
+import os
+import json
+import threading
+import time
+
+from app.utils import logger
+
+# Written by `pawls catalog`, and kept current by `pawls add` and `pawls preprocess`.
+# See cli/pawls/commands/catalog.py for the fields of each document.
+CATALOG_NAME = "pdf_catalog.json"
+
+
+def describe_pdf(output_directory: str, sha: str) -> Optional[Dict[str, Any]]:
+    """
+    Create a catalog entry for a pdf which isn't in the catalog file yet.
+    The page count is left out, because it would require parsing the pdf.
+
+    Returns None if there is no pdf for the sha.
+    """
+    pdf_directory = os.path.join(output_directory, sha)
+    try:
+        size = os.path.getsize(os.path.join(pdf_directory, f"{sha}.pdf"))
+    except OSError:
+        return None
+
+    return {
+        "sha": sha,
+        "name": sha,
+        "pages": None,
+        "structure": os.path.exists(os.path.join(pdf_directory, "pdf_structure.json")),
+        "size": size,
+    }
+
+
+class DocumentCatalog:
+    """
+    Keeps the catalog of the pdfs in the output directory in memory.
+
+    The catalog file is reconciled with a listing of the output directory, so pdfs
+    which were copied in without running `pawls add` are still served. It is
+    re-loaded when either the catalog file or the output directory changes, which
+    is checked at most once every `check_interval` seconds. Adding or removing a
+    pdf directory updates the modification time of the output directory, so this
+    acts as a watcher without scanning every pdf directory.
+
+    output_directory: str
+        The directory containing one sub-directory per pdf.
+    check_interval: float (default = 1.0)
+        The minimum number of seconds between two checks for changes.
+    """
+
+    def __init__(self, output_directory: str, check_interval: float = 1.0):
+        self.output_directory = output_directory
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._mtimes: Optional[Tuple[Optional[float], Optional[float]]] = None
+        self._checked_at: Optional[float] = None
+
+    def _stat(self) -> Tuple[Optional[float], Optional[float]]:
+        mtimes = []
+        for path in [
+            os.path.join(self.output_directory, CATALOG_NAME),
+            self.output_directory,
+        ]:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        catalog_path = os.path.join(self.output_directory, CATALOG_NAME)
+        catalog = {}
+        if os.path.exists(catalog_path):
+            with open(catalog_path) as f:
+                catalog = json.load(f)
+        else:
+            logger.warning("document catalog not found: %s", catalog_path)
+
+        if not os.path.isdir(self.output_directory):
+            return {}
+
+        directories = sorted(
+            entry.name for entry in os.scandir(self.output_directory) if entry.is_dir()
+        )
+        documents = {}
+        for sha in directories:
+            document = catalog.get(sha) or describe_pdf(self.output_directory, sha)
+            if document is not None:
+                documents[sha] = document
+
+        return documents
+
+    def get(self) -> Dict[str, Dict[str, Any]]:
+        """
+        The catalog entry of every pdf, keyed by sha, in sha order.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._documents
+
+        with self._lock:
+            mtimes = self._stat()
+            if self._checked_at is None or mtimes != self._mtimes:
+                self._documents = self._load()
+                self._mtimes = mtimes
+            self._checked_at = now
+
+        return self._documents
@@ -0,0 +1,203 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import defaultdict, OrderedDict
+import os
+import json
+import threading
+
+# Journals larger than this are folded back into the annotation file
+# in the background after a save.
+COMPACTION_THRESHOLD_BYTES = 64 * 1024
+
+_locks = defaultdict(threading.Lock)
+_locks_lock = threading.Lock()
+
+# The annotation ids and relations of recently changed annotation files, so
+# that appending a change can tell how it changes their counts without reading
+# the annotations again. An entry is only used while the files are exactly as
+# they were when it was cached, and is guarded by the lock of its file.
+MAX_CACHED_SKELETONS = 256
+_skeletons: "OrderedDict[str, Tuple[Tuple, Dict[str, List]]]" = OrderedDict()
+
+
+def _lock(annotations_path: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks[annotations_path]
+
+
+def journal_path(annotations_path: str) -> str:
+    """
+    The journal of `<user>_annotations.json` is `<user>_annotations.journal`,
+    a file with one json encoded change to the annotations per line.
+    """
+    return os.path.splitext(annotations_path)[0] + ".journal"
+
+
+def apply_delta(pdf_annotations: Dict[str, List], delta: Dict[str, Any]) -> None:
+    """
+    Apply a change, as described by `PdfAnnotationDelta`, to a dictionary
+    of annotations and relations in place.
+
+    The cli replays journals with its own copy of this function
+    (`_apply_annotation_delta` in cli/pawls/commands/utils.py), which must
+    be kept in sync. Both are tested against cli/test/fixtures/journal.
+    """
+    annotations = pdf_annotations["annotations"]
+    annotation_changes = delta.get("annotations", {})
+    positions = {annotation["id"]: i for i, annotation in enumerate(annotations)}
+    for annotation in annotation_changes.get("added", []) + annotation_changes.get(
+        "updated", []
+    ):
+        position = positions.get(annotation["id"])
+        if position is None:
+            positions[annotation["id"]] = len(annotations)
+            annotations.append(annotation)
+        else:
+            annotations[position] = annotation
+
+    deleted = set(annotation_changes.get("deleted", []))
+    if deleted:
+        annotations[:] = [a for a in annotations if a["id"] not in deleted]
+
+    relations = pdf_annotations["relations"]
+    relation_changes = delta.get("relations", {})
+    relations.extend(relation_changes.get("added", []))
+    for relation in relation_changes.get("deleted", []):
+        if relation in relations:
+            relations.remove(relation)
+
+
+def load_annotations(annotations_path: str) -> Dict[str, List]:
+    """
+    Load the annotations in an annotation file, with the changes
+    in its journal applied.
+    """
+    with _lock(annotations_path):
+        return _load_annotations(annotations_path)
+
+
+def _load_annotations(annotations_path: str) -> Dict[str, List]:
+    pdf_annotations = {"annotations": [], "relations": []}
+    if os.path.exists(annotations_path):
+        with open(annotations_path) as f:
+            pdf_annotations = json.load(f)
+
+    path = journal_path(annotations_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                # A line without its newline is an append which hasn't finished yet.
+                if not line.endswith("\n"):
+                    break
+                apply_delta(pdf_annotations, json.loads(line))
+
+    return pdf_annotations
+
+
+def save_annotations(annotations_path: str, pdf_annotations: Dict[str, List]) -> None:
+    """
+    Replace the annotations in an annotation file, discarding its journal.
+    """
+    with _lock(annotations_path):
+        _write_annotations(annotations_path, pdf_annotations)
+
+
+def _write_annotations(annotations_path: str, pdf_annotations: Dict[str, List]):
+    tmp_path = f"{annotations_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(pdf_annotations, f)
+    os.replace(tmp_path, annotations_path)
+
+    path = journal_path(annotations_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _skeleton_annotations(annotations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{"id": annotation["id"]} for annotation in annotations]
+
+
+def _skeleton(pdf_annotations: Dict[str, List]) -> Dict[str, List]:
+    """
+    The annotations reduced to what `apply_delta` needs to tell how many
+    annotations and relations a change leaves.
+    """
+    return {
+        "annotations": _skeleton_annotations(pdf_annotations["annotations"]),
+        "relations": list(pdf_annotations["relations"]),
+    }
+
+
+def _file_state(annotations_path: str) -> Optional[Tuple]:
+    try:
+        stat = os.stat(annotations_path)
+    except FileNotFoundError:
+        return None
+    try:
+        journal_size = os.path.getsize(journal_path(annotations_path))
+    except FileNotFoundError:
+        journal_size = -1
+    return stat.st_mtime_ns, stat.st_size, journal_size
+
+
+def append_delta(
+    annotations_path: str, delta: Dict[str, Any]
+) -> Tuple[Dict[str, int], bool]:
+    """
+    Append a change to the journal of an annotation file. This costs
+    O(size of the change), however many annotations the file has, unless the
+    file was changed by something else since the last change appended to it,
+    in which case it is read once.
+
+    Returns how many annotations and relations the change added (or, if
+    negative, removed), as applied to the current annotations; and True if the
+    journal has grown large enough to be compacted.
+    """
+    line = json.dumps(delta) + "\n"
+    path = journal_path(annotations_path)
+    with _lock(annotations_path):
+        if not os.path.exists(annotations_path):
+            # Other tools look for annotation files, not journals.
+            _write_annotations(annotations_path, {"annotations": [], "relations": []})
+
+        state, skeleton = _skeletons.pop(annotations_path, (None, None))
+        if skeleton is None or state != _file_state(annotations_path):
+            skeleton = _skeleton(_load_annotations(annotations_path))
+        before = {field: len(items) for field, items in skeleton.items()}
+        annotation_changes = delta.get("annotations", {})
+        apply_delta(
+            skeleton,
+            {
+                "annotations": {
+                    "added": _skeleton_annotations(annotation_changes.get("added", [])),
+                    "updated": _skeleton_annotations(
+                        annotation_changes.get("updated", [])
+                    ),
+                    "deleted": annotation_changes.get("deleted", []),
+                },
+                "relations": delta.get("relations", {}),
+            },
+        )
+        counts = {field: len(skeleton[field]) - before[field] for field in before}
+
+        with open(path, "a") as f:
+            f.write(line)
+            size = f.tell()
+
+        _skeletons[annotations_path] = (_file_state(annotations_path), skeleton)
+        if len(_skeletons) > MAX_CACHED_SKELETONS:
+            _skeletons.popitem(last=False)
+
+    return counts, size > COMPACTION_THRESHOLD_BYTES
+
+
+def compact(annotations_path: str) -> Dict[str, List]:
+    """
+    Fold the journal of an annotation file back into the file.
+
+    Returns the compacted annotations.
+    """
+    with _lock(annotations_path):
+        pdf_annotations = _load_annotations(annotations_path)
+        _write_annotations(annotations_path, pdf_annotations)
+
+    return pdf_annotations
@@ -1,4 +1,5 @@
-from typing import Optional, List
+from typing import Optional, List, Dict
+import json
 
 from pydantic import BaseModel
 
@@ -30,3 +31,31 @@ class PaperStatus(BaseModel):
 class Allocation(BaseModel):
     papers: List[PaperStatus]
     hasAllocatedPapers: bool
+    # The number of papers matching the request's filters,
+    # of which `papers` may only be a page.
+    total: int
+
+
+class AllocationSummary(BaseModel):
+    hasAllocatedPapers: bool
+    total: int
+    finished: int
+    junk: int
+    annotated: int
+
+
+def load_pdf_titles(metadata_file: str) -> Dict[str, str]:
+    """
+    Load the titles in a pdf_metadata.json file, which maps each pdf sha either
+    to its title, or to an object with a "title" field.
+    """
+    with open(metadata_file) as f:
+        metadata = json.load(f)
+
+    titles = {}
+    for sha, data in metadata.items():
+        title = data.get("title") if isinstance(data, dict) else data
+        if title is not None:
+            titles[sha] = title
+
+    return titles
@@ -15,12 +15,18 @@ class Configuration(NamedTuple):
         The relations in use for annotation.
     users_file: Name str, required
         Filename where list of allowed users is specified.
+    status_backend: str, optional (default = "json")
+        Where the annotation status of each user's papers is stored.
+        "json" uses the status/<user>.json files written by `pawls assign`,
+        "sqlite" uses a status.db SQLite database in the output_directory,
+        which can be created from the json files with `pawls migrate-status`.
     """
 
     output_directory: str
     labels: List[Dict[str, str]]
     relations: List[Dict[str, str]]
     users_file: str
+    status_backend: str = "json"
 
 
 def load_configuration(filepath: str) -> Configuration:
@@ -0,0 +1,419 @@
+from typing import Callable, Dict, Any, Optional, Iterable, List, NamedTuple, Tuple
+from collections import defaultdict
+from abc import ABC, abstractmethod
+import os
+import json
+import sqlite3
+import threading
+
+from app.utils import FileCache
+
+# The fields of a paper's status, as in app.metadata.PaperStatus.
+STATUS_FIELDS = [
+    "sha",
+    "name",
+    "annotations",
+    "relations",
+    "finished",
+    "junk",
+    "comments",
+    "completedAt",
+]
+
+# Must match STATUS_DB_SCHEMA in cli/pawls/commands/utils.py, which creates the same database
+# (test_status_db_schema_matches_cli checks that they do).
+STATUS_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS status (
+    user TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    name TEXT NOT NULL,
+    annotations INTEGER NOT NULL DEFAULT 0,
+    relations INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    junk INTEGER NOT NULL DEFAULT 0,
+    comments TEXT NOT NULL DEFAULT '',
+    completedAt TEXT,
+    PRIMARY KEY (user, sha)
+)
+"""
+
+# The fields of a paper's status which count its annotations.
+COUNT_FIELDS = ["annotations", "relations"]
+
+# The fields which allocated papers can be sorted by.
+SORTABLE_STATUS_FIELDS = ["sha", "name", "annotations", "relations", "completedAt"]
+
+
+class StatusQuery(NamedTuple):
+    """
+    Selects a page of a user's allocated papers.
+
+    finished, junk, has_annotations:
+        Only include papers with these values, if they are not None.
+    sort:
+        A field of SORTABLE_STATUS_FIELDS, prefixed with "-" for descending order.
+        If None, papers are in the order they are stored in.
+    offset, limit:
+        The page of matching papers to return. A limit of None returns them all.
+    """
+
+    finished: Optional[bool] = None
+    junk: Optional[bool] = None
+    has_annotations: Optional[bool] = None
+    sort: Optional[str] = None
+    offset: int = 0
+    limit: Optional[int] = None
+
+
+def parse_sort(sort: str) -> Tuple[str, bool]:
+    """
+    Returns the field to sort by, and whether the order is descending.
+    Raises a ValueError for fields which can't be sorted by.
+    """
+    descending = sort.startswith("-")
+    field = sort[1:] if descending else sort
+    if field not in SORTABLE_STATUS_FIELDS:
+        raise ValueError(f"Can't sort papers by {field}.")
+    return field, descending
+
+
+def filter_statuses(
+    statuses: Iterable[Dict[str, Any]], query: StatusQuery
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Apply a query to statuses held in memory.
+
+    Returns the number of statuses matching the query's filters,
+    and the requested page of them.
+    """
+    matching = [
+        status
+        for status in statuses
+        if (query.finished is None or status["finished"] == query.finished)
+        and (query.junk is None or status["junk"] == query.junk)
+        and (
+            query.has_annotations is None
+            or (status["annotations"] > 0) == query.has_annotations
+        )
+    ]
+    if query.sort is not None:
+        field, descending = parse_sort(query.sort)
+        # Missing values come first, as they do in SQLite.
+        matching.sort(
+            key=lambda status: (status[field] is not None, status[field], status["sha"]),
+            reverse=descending,
+        )
+
+    end = None if query.limit is None else query.offset + query.limit
+    return len(matching), matching[query.offset : end]
+
+
+def count_statuses(statuses: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Count the papers in statuses held in memory, as returned by
+    `StatusStore.count_statuses`.
+    """
+    counts = {"total": 0, "finished": 0, "junk": 0, "annotated": 0}
+    for status in statuses:
+        counts["total"] += 1
+        counts["finished"] += bool(status["finished"])
+        counts["junk"] += bool(status["junk"])
+        counts["annotated"] += status["annotations"] > 0
+    return counts
+
+
+class StatusStore(ABC):
+    """
+    Storage for the annotation status of the papers assigned to each user.
+
+    A user is "allocated" if they have been assigned papers using `pawls assign`.
+    The status of a paper is a dictionary with the fields of `PaperStatus`.
+    """
+
+    @abstractmethod
+    def has_user(self, user: str) -> bool:
+        """
+        Return True if the user has been allocated papers.
+        """
+
+    @abstractmethod
+    def get_statuses(self, user: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the status of every paper allocated to the user, keyed by sha.
+        """
+
+    @abstractmethod
+    def get_status(self, user: str, sha: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the status of a single paper, or None if it isn't allocated to the user.
+        """
+
+    @abstractmethod
+    def update_status(self, user: str, sha: str, data: Dict[str, Any]) -> None:
+        """
+        Atomically merge data into the status of a paper allocated to the user.
+        Papers which aren't allocated to the user are ignored.
+        """
+
+    @abstractmethod
+    def increment_counts(self, user: str, sha: str, changes: Dict[str, int]) -> None:
+        """
+        Atomically add changes to the COUNT_FIELDS of a paper allocated to the user,
+        without letting them go below zero. Papers which aren't allocated to the
+        user are ignored.
+        """
+
+    def query_statuses(
+        self, user: str, query: StatusQuery
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Return the number of papers allocated to the user which match the query,
+        and the statuses of the requested page of them.
+        """
+        return filter_statuses(self.get_statuses(user).values(), query)
+
+    def count_statuses(self, user: str) -> Dict[str, int]:
+        """
+        Return the number of papers allocated to the user ("total"), and how many
+        of them are "finished", "junk" and "annotated" (have any annotations).
+        """
+        return count_statuses(self.get_statuses(user).values())
+
+
+class JsonStatusStore(StatusStore):
+    """
+    Stores the statuses of each user in `<output_directory>/status/<user>.json`,
+    as written by `pawls assign`.
+
+    Updates rewrite the whole file, so they are serialized per user to avoid losing
+    concurrent updates, and the file is replaced atomically. Reads are served from
+    memory, until the file is modified.
+    """
+
+    def __init__(self, status_directory: str):
+        self.status_directory = status_directory
+        self._locks = defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+        self._caches: Dict[str, FileCache[Dict[str, Dict[str, Any]]]] = {}
+
+    def _path(self, user: str) -> str:
+        return os.path.join(self.status_directory, f"{user}.json")
+
+    def _lock(self, user: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks[user]
+
+    def has_user(self, user: str) -> bool:
+        return os.path.exists(self._path(user))
+
+    @staticmethod
+    def _load(path: str) -> Dict[str, Dict[str, Any]]:
+        with open(path) as f:
+            return json.load(f)
+
+    def _cache(self, user: str) -> FileCache[Dict[str, Dict[str, Any]]]:
+        with self._locks_lock:
+            cache = self._caches.get(user)
+            if cache is None:
+                # The modification time is checked on every read, because the
+                # status of a paper is read back right after it is updated.
+                cache = FileCache(self._path(user), self._load, {}, check_interval=0)
+                self._caches[user] = cache
+            return cache
+
+    def get_statuses(self, user: str) -> Dict[str, Dict[str, Any]]:
+        if not self.has_user(user):
+            return {}
+        # Copied, so that callers can't modify the cached statuses.
+        return {sha: dict(status) for sha, status in self._cache(user).get().items()}
+
+    def query_statuses(
+        self, user: str, query: StatusQuery
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        if not self.has_user(user):
+            return 0, []
+        total, statuses = filter_statuses(self._cache(user).get().values(), query)
+        return total, [dict(status) for status in statuses]
+
+    def count_statuses(self, user: str) -> Dict[str, int]:
+        if not self.has_user(user):
+            return count_statuses([])
+        return count_statuses(self._cache(user).get().values())
+
+    def get_status(self, user: str, sha: str) -> Optional[Dict[str, Any]]:
+        return self.get_statuses(user).get(sha)
+
+    def update_status(self, user: str, sha: str, data: Dict[str, Any]) -> None:
+        self._modify_status(user, sha, lambda status: {**status, **data})
+
+    def increment_counts(self, user: str, sha: str, changes: Dict[str, int]) -> None:
+        def increment(status: Dict[str, Any]) -> Dict[str, Any]:
+            counts = {
+                field: max(0, status[field] + change)
+                for field, change in changes.items()
+                if field in COUNT_FIELDS
+            }
+            return {**status, **counts}
+
+        self._modify_status(user, sha, increment)
+
+    def _modify_status(
+        self,
+        user: str,
+        sha: str,
+        modify: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> None:
+        path = self._path(user)
+        with self._lock(user):
+            if not self.has_user(user):
+                return
+            # Read from disk, rather than from the cache, in case the file was
+            # modified within the resolution of its modification time.
+            statuses = self._load(path)
+            if sha not in statuses:
+                return
+            statuses[sha] = modify(statuses[sha])
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(statuses, f)
+            os.replace(tmp_path, path)
+            self._cache(user).invalidate()
+
+
+class SqliteStatusStore(StatusStore):
+    """
+    Stores the statuses of all users in a single SQLite database, with one row per
+    (user, paper). Updates touch a single row, and the database is opened in WAL
+    mode so that reads are not blocked by concurrent writes.
+
+    Existing status/<user>.json files can be imported with `pawls migrate-status`.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(STATUS_DB_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads,
+        # so each thread of the server gets its own.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _to_status(row: sqlite3.Row) -> Dict[str, Any]:
+        status = {field: row[field] for field in STATUS_FIELDS}
+        status["finished"] = bool(status["finished"])
+        status["junk"] = bool(status["junk"])
+        return status
+
+    def has_user(self, user: str) -> bool:
+        row = (
+            self._connection()
+            .execute("SELECT 1 FROM status WHERE user = ? LIMIT 1", (user,))
+            .fetchone()
+        )
+        return row is not None
+
+    def get_statuses(self, user: str) -> Dict[str, Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT * FROM status WHERE user = ? ORDER BY sha", (user,)
+        )
+        return {row["sha"]: self._to_status(row) for row in rows}
+
+    def get_status(self, user: str, sha: str) -> Optional[Dict[str, Any]]:
+        row = (
+            self._connection()
+            .execute("SELECT * FROM status WHERE user = ? AND sha = ?", (user, sha))
+            .fetchone()
+        )
+        return None if row is None else self._to_status(row)
+
+    def query_statuses(
+        self, user: str, query: StatusQuery
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        conditions = ["user = ?"]
+        parameters: List[Any] = [user]
+        for field in ["finished", "junk"]:
+            value = getattr(query, field)
+            if value is not None:
+                conditions.append(f"{field} = ?")
+                parameters.append(int(value))
+        if query.has_annotations is not None:
+            conditions.append("annotations > 0" if query.has_annotations else "annotations = 0")
+        where = " AND ".join(conditions)
+
+        order = "sha"
+        if query.sort is not None:
+            field, descending = parse_sort(query.sort)
+            direction = "DESC" if descending else "ASC"
+            order = f"{field} {direction}, sha {direction}"
+
+        connection = self._connection()
+        (total,) = connection.execute(
+            f"SELECT COUNT(*) FROM status WHERE {where}", parameters
+        ).fetchone()
+        rows = connection.execute(
+            f"SELECT * FROM status WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            parameters + [-1 if query.limit is None else query.limit, query.offset],
+        )
+        return total, [self._to_status(row) for row in rows]
+
+    def count_statuses(self, user: str) -> Dict[str, int]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) AS total, "
+                "COALESCE(SUM(finished), 0) AS finished, "
+                "COALESCE(SUM(junk), 0) AS junk, "
+                "COALESCE(SUM(annotations > 0), 0) AS annotated "
+                "FROM status WHERE user = ?",
+                (user,),
+            )
+            .fetchone()
+        )
+        return {field: row[field] for field in ["total", "finished", "junk", "annotated"]}
+
+    def update_status(self, user: str, sha: str, data: Dict[str, Any]) -> None:
+        fields = [field for field in data if field in STATUS_FIELDS and field != "sha"]
+        if not fields:
+            return
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self._connection() as connection:
+            connection.execute(
+                f"UPDATE status SET {assignments} WHERE user = ? AND sha = ?",
+                [data[field] for field in fields] + [user, sha],
+            )
+
+    def increment_counts(self, user: str, sha: str, changes: Dict[str, int]) -> None:
+        fields = [field for field in changes if field in COUNT_FIELDS]
+        if not fields:
+            return
+        # Computed by SQLite from the current row, so concurrent increments add up.
+        assignments = ", ".join(f"{field} = max(0, {field} + ?)" for field in fields)
+        with self._connection() as connection:
+            connection.execute(
+                f"UPDATE status SET {assignments} WHERE user = ? AND sha = ?",
+                [changes[field] for field in fields] + [user, sha],
+            )
+
+
+def load_status_store(output_directory: str, backend: str) -> StatusStore:
+    """
+    Create the status store for the `status_backend` configuration option,
+    which is either "json" or "sqlite".
+    """
+    if backend == "json":
+        return JsonStatusStore(os.path.join(output_directory, "status"))
+    elif backend == "sqlite":
+        return SqliteStatusStore(os.path.join(output_directory, "status.db"))
+    else:
+        raise ValueError(f"Unknown status backend {backend}.")
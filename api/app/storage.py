@@ -0,0 +1,39 @@
+from typing import Callable, Dict, TypeVar
+import functools
+import os
+
+from anyio import to_thread, CapacityLimiter
+
+T = TypeVar("T")
+
+# The maximum number of blocking file operations which may run at the same time
+# against each storage path. Requests beyond this wait for a free slot, rather
+# than all competing for the server's shared threadpool.
+IO_CONCURRENCY = int(os.getenv("PAWLS_IO_CONCURRENCY", "32"))
+
+_limiters: Dict[str, CapacityLimiter] = {}
+
+
+def get_limiter(storage_path: str) -> CapacityLimiter:
+    """
+    Get the limiter bounding the concurrent file operations on a storage path.
+    Must be called from within the event loop.
+    """
+    limiter = _limiters.get(storage_path)
+    if limiter is None:
+        limiter = CapacityLimiter(IO_CONCURRENCY)
+        _limiters[storage_path] = limiter
+    return limiter
+
+
+async def run_io(storage_path: str, func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a blocking function which reads or writes files under storage_path in a
+    worker thread, without blocking the event loop.
+
+    Each storage path gets its own pool of IO_CONCURRENCY worker slots, so that a
+    slow volume can't starve requests which use another one.
+    """
+    return await to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=get_limiter(storage_path)
+    )
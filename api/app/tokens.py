@@ -0,0 +1,121 @@
+from typing import Optional, List, Tuple, Dict, Any
+import os
+import json
+
+PDF_STRUCTURE_NAME = "pdf_structure.json"
+PDF_STRUCTURE_METADATA_NAME = "pdf_structure.meta.json"
+
+# Content-Encodings of pdf_structure.json which `pawls preprocess` writes
+# to disk, in order of preference.
+PREENCODED_PDF_STRUCTURES = [
+    ("br", "pdf_structure.json.br"),
+    ("gzip", "pdf_structure.json.gz"),
+]
+
+
+def load_metadata(pdf_directory: str) -> Dict[str, Any]:
+    """
+    Load the pdf_structure.meta.json file written by `pawls preprocess`.
+
+    Returns an empty dictionary if the pdf was preprocessed before
+    the metadata file existed.
+    """
+    metadata_path = os.path.join(pdf_directory, PDF_STRUCTURE_METADATA_NAME)
+    if not os.path.exists(metadata_path):
+        return {}
+
+    with open(metadata_path) as f:
+        return json.load(f)
+
+
+def load_page_offsets(pdf_directory: str) -> Optional[List[Tuple[int, int]]]:
+    """
+    Load the (offset, length) of each page inside pdf_structure.json, as
+    recorded by `pawls preprocess` in pdf_structure.meta.json.
+
+    Returns None if the pdf was preprocessed before page offsets were recorded,
+    or if pdf_structure.json was replaced since, without updating them.
+    """
+    page_offsets = load_metadata(pdf_directory).get("pages")
+    if page_offsets is None:
+        return None
+
+    # Never trust the offsets of a file which was replaced since, as
+    # `PdfStructure` in the cli doesn't either.
+    end = page_offsets[-1][0] + page_offsets[-1][1] if page_offsets else 1
+    if os.path.getsize(os.path.join(pdf_directory, PDF_STRUCTURE_NAME)) != end + 1:
+        return None
+    return page_offsets
+
+
+def find_preencoded_structure(
+    pdf_directory: str, accept_encoding: Optional[str]
+) -> Tuple[str, Optional[str]]:
+    """
+    Find the best pre-encoded pdf_structure.json file for a request's
+    Accept-Encoding header.
+
+    Returns the path of the file to send, and its Content-Encoding,
+    which is None if the plain json file should be sent.
+    """
+    accepted = set()
+    if accept_encoding is not None:
+        for encoding in accept_encoding.split(","):
+            name, _, params = encoding.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            accepted.add(name.strip().lower())
+
+    for encoding, filename in PREENCODED_PDF_STRUCTURES:
+        path = os.path.join(pdf_directory, filename)
+        if encoding in accepted and os.path.exists(path):
+            return path, encoding
+
+    return os.path.join(pdf_directory, PDF_STRUCTURE_NAME), None
+
+
+def read_page_range(pdf_directory: str, start: int, end: int) -> Optional[bytes]:
+    """
+    Read pages start (inclusive) to end (exclusive) of a pdf_structure.json file
+    as a serialized json list.
+
+    When the page offsets are known, only the bytes of the requested pages are
+    read from disk. Otherwise, the whole file is parsed.
+
+    Returns None if the page range is empty or out of bounds.
+    """
+    structure_path = os.path.join(pdf_directory, PDF_STRUCTURE_NAME)
+    page_offsets = load_page_offsets(pdf_directory)
+
+    if page_offsets is None:
+        with open(structure_path) as f:
+            pages = json.load(f)
+        if not 0 <= start < end <= len(pages):
+            return None
+        return json.dumps(pages[start:end]).encode("utf-8")
+
+    if not 0 <= start < end <= len(page_offsets):
+        return None
+
+    # Pages are stored contiguously, separated by ", ", so the requested
+    # pages are a single slice of the file.
+    first_offset, _ = page_offsets[start]
+    last_offset, last_length = page_offsets[end - 1]
+    with open(structure_path, "rb") as f:
+        f.seek(first_offset)
+        data = f.read(last_offset + last_length - first_offset)
+
+    return b"[" + data + b"]"
+
+
+def read_page(pdf_directory: str, page: int) -> Optional[bytes]:
+    """
+    Read a single page of a pdf_structure.json file as a serialized json object.
+
+    Returns None if the page is out of bounds.
+    """
+    data = read_page_range(pdf_directory, page, page + 1)
+    if data is None:
+        return None
+
+    return data[1:-1]
@@ -0,0 +1,40 @@
+from typing import NamedTuple, Set
+
+
+class AllowedUsers(NamedTuple):
+    """
+    The users which are granted access to the annotation tool.
+
+    emails: Set[str]
+        Emails of individual users, e.g "markn@allenai.org".
+    domains: Set[str]
+        Entries like "@allenai.org", which grant access to anyone in that domain.
+    """
+
+    emails: Set[str]
+    domains: Set[str]
+
+    def is_allowed(self, user_email: str) -> bool:
+        if user_email in self.emails:
+            return True
+        _, at, domain = user_email.rpartition("@")
+        return bool(at) and f"@{domain}" in self.domains
+
+
+def load_allowed_users(users_file: str) -> AllowedUsers:
+    """
+    Parse a users file, which lists one email or "@domain" entry per line.
+    """
+    emails = set()
+    domains = set()
+    with open(users_file) as file:
+        for line in file:
+            entry = line.strip()
+            if not entry:
+                continue
+            if entry.startswith("@"):
+                domains.add(entry)
+            else:
+                emails.add(entry)
+
+    return AllowedUsers(emails=emails, domains=domains)
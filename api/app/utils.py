@@ -1,5 +1,15 @@
+from typing import Callable, Generic, Optional, TypeVar
+import logging
+import os
+import threading
+import time
+
 from pythonjsonlogger import jsonlogger
 
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
 
 class StackdriverJsonFormatter(jsonlogger.JsonFormatter):
     """
@@ -18,3 +28,68 @@ class StackdriverJsonFormatter(jsonlogger.JsonFormatter):
             log_record, record, message_dict
         )
         log_record["severity"] = record.levelname
+
+
+class FileCache(Generic[T]):
+    """
+    Keeps the parsed contents of a file in memory, so that it isn't read from
+    disk on every request. The file is re-loaded when its modification time
+    changes, which is checked at most once every `check_interval` seconds.
+
+    path: str
+        The file to load.
+    load: Callable[[str], T]
+        A function parsing the file at the given path.
+    default: T
+        The value to use while the file doesn't exist.
+    check_interval: float (default = 1.0)
+        The minimum number of seconds between two checks of the file's
+        modification time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        load: Callable[[str], T],
+        default: T,
+        check_interval: float = 1.0,
+    ):
+        self.path = path
+        self.load = load
+        self.default = default
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._value = default
+        self._mtime: Optional[float] = None
+        self._checked_at: Optional[float] = None
+
+    def invalidate(self) -> None:
+        """
+        Check the file for changes on the next call to get.
+        """
+        with self._lock:
+            self._checked_at = None
+            self._mtime = None
+
+    def get(self) -> T:
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._value
+
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+
+            if self._checked_at is None or mtime != self._mtime:
+                if mtime is None:
+                    logger.warning("file not found: %s", self.path)
+                    self._value = self.default
+                else:
+                    self._value = self.load(self.path)
+                self._mtime = mtime
+            self._checked_at = now
+
+        return self._value
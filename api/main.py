@@ -1,17 +1,38 @@
 from typing import List, Optional, Dict, Any
 import logging
 import os
-import json
-import glob
 
-from fastapi import FastAPI, HTTPException, Header, Response, Body
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Header,
+    Response,
+    Body,
+    BackgroundTasks,
+    Query,
+)
 from fastapi.responses import FileResponse
 from fastapi.encoders import jsonable_encoder
 
-from app.metadata import PaperStatus, Allocation
-from app.annotations import Annotation, RelationGroup, PdfAnnotation
-from app.utils import StackdriverJsonFormatter
-from app import pre_serve
+from app.metadata import PaperStatus, Allocation, AllocationSummary, load_pdf_titles
+from app.annotations import (
+    Annotation,
+    RelationGroup,
+    PdfAnnotation,
+    PdfAnnotationDelta,
+)
+from app.utils import StackdriverJsonFormatter, FileCache
+from app.users import AllowedUsers, load_allowed_users
+from app import pre_serve, tokens, journal
+from app.status import (
+    load_status_store,
+    StatusQuery,
+    parse_sort,
+    filter_statuses,
+    count_statuses,
+)
+from app.storage import run_io
+from app.catalog import DocumentCatalog
 
 IN_PRODUCTION = os.getenv("IN_PRODUCTION", "dev")
 
@@ -40,6 +61,34 @@ logging.getLogger("s3transfer").setLevel(logging.CRITICAL)
 # The annotation app requires a bit of set up.
 configuration = pre_serve.load_configuration(CONFIGURATION_FILE)
 
+TOKEN_STORE_MEDIA_TYPE = "application/octet-stream"
+
+allowed_users = FileCache(
+    configuration.users_file,
+    load_allowed_users,
+    default=AllowedUsers(emails=set(), domains=set()),
+)
+
+status_store = load_status_store(
+    configuration.output_directory, configuration.status_backend
+)
+
+document_catalog = DocumentCatalog(configuration.output_directory)
+
+# The titles in pdf_metadata.json, as written by scripts/ai2-internal/fetch_pdfs.py.
+pdf_titles = FileCache(
+    os.path.join(configuration.output_directory, "pdf_metadata.json"),
+    load_pdf_titles,
+    default={},
+)
+
+# Blocking file operations are run in worker threads, with their concurrency
+# bounded separately for the pdf/annotation files, for the status store, and
+# for the users file, which every authenticated request reads.
+DOCUMENT_STORAGE = configuration.output_directory
+STATUS_STORAGE = os.path.join(configuration.output_directory, "status")
+USERS_STORAGE = configuration.users_file
+
 app = FastAPI()
 
 
@@ -63,39 +112,27 @@ def get_user_from_header(user_email: Optional[str]) -> Optional[str]:
     return user_email
 
 
-def user_is_allowed(user_email: str) -> bool:
+async def authenticate(user_email: Optional[str]) -> Optional[str]:
     """
-    Return True if the user_email is in the users file, False otherwise.
+    get_user_from_header, for async handlers. The users file may be re-loaded
+    from disk, so the check is run in a worker thread. It has its own slots, so
+    that authenticating doesn't wait for the document reads of other requests.
     """
-    try:
-        with open(configuration.users_file) as file:
-            for line in file:
-                entry = line.strip()
-                if user_email == entry:
-                    return True
-                # entries like "@allenai.org" mean anyone in that domain @allenai.org is granted access
-                if entry.startswith("@") and user_email.endswith(entry):
-                    return True
-    except FileNotFoundError:
-        logger.warning("file not found: %s", configuration.users_file)
-        pass
-
-    return False
+    return await run_io(USERS_STORAGE, get_user_from_header, user_email)
 
 
-def all_pdf_shas() -> List[str]:
-    pdfs = glob.glob(f"{configuration.output_directory}/*/*.pdf")
-    return [p.split("/")[-2] for p in pdfs]
+def user_is_allowed(user_email: str) -> bool:
+    """
+    Return True if the user_email is in the users file, False otherwise.
 
+    The users file is kept in memory and re-loaded when it changes on disk,
+    so that users can be added without restarting the server.
+    """
+    return allowed_users.get().is_allowed(user_email)
 
-def update_status_json(status_path: str, sha: str, data: Dict[str, Any]):
 
-    with open(status_path, "r+") as st:
-        status_json = json.load(st)
-        status_json[sha] = {**status_json[sha], **data}
-        st.seek(0)
-        json.dump(status_json, st)
-        st.truncate()
+def all_pdf_shas() -> List[str]:
+    return list(document_catalog.get())
 
 
 @app.get("/", status_code=204)
@@ -132,87 +169,80 @@ async def get_pdf_title(sha: str) -> Optional[str]:
     sha: str
         The sha of the pdf title to return.
     """
-    pdf_info = os.path.join(configuration.output_directory, "pdf_metadata.json")
+    titles = await run_io(DOCUMENT_STORAGE, pdf_titles.get)
+    return titles.get(sha)
 
-    with open(pdf_info, "r") as f:
-        info = json.load(f)
 
-    data = info.get("sha", None)
+@app.post("/api/doc/titles")
+async def get_pdf_titles(shas: List[str] = Body(...)) -> Dict[str, Optional[str]]:
+    """
+    Fetches the titles of many PDFs at once.
 
-    if data is None:
-        return None
+    shas: List[str]
+        The shas of the pdfs, as a json list in the request body.
+
+    Returns a mapping of each sha to its title, which is null
+    for pdfs without a title.
+    """
+    titles = await run_io(DOCUMENT_STORAGE, pdf_titles.get)
+    return {sha: titles.get(sha) for sha in shas}
 
-    return data.get("title", None)
+
+def update_allocated_status(user: str, sha: str, data: Dict[str, Any]):
+    if not status_store.has_user(user):
+        # Not an allocated user. Do nothing.
+        return
+
+    status_store.update_status(user, sha, data)
 
 
 @app.post("/api/doc/{sha}/comments")
-def set_pdf_comments(
+async def set_pdf_comments(
     sha: str, comments: str = Body(...), x_auth_request_email: str = Header(None)
 ):
-    user = get_user_from_header(x_auth_request_email)
-    status_path = os.path.join(configuration.output_directory, "status", f"{user}.json")
-    exists = os.path.exists(status_path)
-
-    if not exists:
-        # Not an allocated user. Do nothing.
-        return {}
-
-    update_status_json(status_path, sha, {"comments": comments})
+    user = await authenticate(x_auth_request_email)
+    await run_io(
+        STATUS_STORAGE, update_allocated_status, user, sha, {"comments": comments}
+    )
     return {}
 
 
 @app.post("/api/doc/{sha}/junk")
-def set_pdf_junk(
+async def set_pdf_junk(
     sha: str, junk: bool = Body(...), x_auth_request_email: str = Header(None)
 ):
-    user = get_user_from_header(x_auth_request_email)
-    status_path = os.path.join(configuration.output_directory, "status", f"{user}.json")
-    exists = os.path.exists(status_path)
-    if not exists:
-        # Not an allocated user. Do nothing.
-        return {}
-
-    update_status_json(status_path, sha, {"junk": junk})
+    user = await authenticate(x_auth_request_email)
+    await run_io(
+        STATUS_STORAGE, update_allocated_status, user, sha, {"junk": junk}
+    )
     return {}
 
 
 @app.post("/api/doc/{sha}/finished")
-def set_pdf_finished(
+async def set_pdf_finished(
     sha: str, finished: bool = Body(...), x_auth_request_email: str = Header(None)
 ):
-    user = get_user_from_header(x_auth_request_email)
-    status_path = os.path.join(configuration.output_directory, "status", f"{user}.json")
-    exists = os.path.exists(status_path)
-    if not exists:
-        # Not an allocated user. Do nothing.
-        return {}
-
-    update_status_json(status_path, sha, {"finished": finished})
+    user = await authenticate(x_auth_request_email)
+    await run_io(
+        STATUS_STORAGE, update_allocated_status, user, sha, {"finished": finished}
+    )
     return {}
 
 
 @app.get("/api/doc/{sha}/annotations")
-def get_annotations(
+async def get_annotations(
     sha: str, x_auth_request_email: str = Header(None)
 ) -> PdfAnnotation:
-    user = get_user_from_header(x_auth_request_email)
+    user = await authenticate(x_auth_request_email)
     annotations = os.path.join(
         configuration.output_directory, sha, f"{user}_annotations.json"
     )
-    exists = os.path.exists(annotations)
 
-    if exists:
-        with open(annotations) as f:
-            blob = json.load(f)
-
-        return blob
-
-    else:
-        return {"annotations": [], "relations": []}
+    return await run_io(DOCUMENT_STORAGE, journal.load_annotations, annotations)
 
 
 @app.post("/api/doc/{sha}/annotations")
-def save_annotations(
+async def save_annotations(
     sha: str,
     annotations: List[Annotation],
     relations: List[RelationGroup],
@@ -231,43 +261,262 @@ def save_annotations(
         is controlled by the Skiff Kubernetes cluster.
     """
     # Update the annotations in the annotation json file.
-    user = get_user_from_header(x_auth_request_email)
+    user = await authenticate(x_auth_request_email)
     annotations_path = os.path.join(
         configuration.output_directory, sha, f"{user}_annotations.json"
     )
     json_annotations = [jsonable_encoder(a) for a in annotations]
     json_relations = [jsonable_encoder(r) for r in relations]
 
-    # Update the annotation counts in the status file.
-    status_path = os.path.join(configuration.output_directory, "status", f"{user}.json")
-    exists = os.path.exists(status_path)
-    if not exists:
+    if not await run_io(STATUS_STORAGE, status_store.has_user, user):
         # Not an allocated user. Do nothing.
         return {}
 
-    with open(annotations_path, "w+") as f:
-        json.dump({"annotations": json_annotations, "relations": json_relations}, f)
+    await run_io(
+        DOCUMENT_STORAGE,
+        journal.save_annotations,
+        annotations_path,
+        {"annotations": json_annotations, "relations": json_relations},
+    )
 
-    update_status_json(
-        status_path, sha, {"annotations": len(annotations), "relations": len(relations)}
+    # Update the annotation counts in the status store.
+    await run_io(
+        STATUS_STORAGE,
+        status_store.update_status,
+        user,
+        sha,
+        {"annotations": len(annotations), "relations": len(relations)},
     )
 
     return {}
 
 
+def compact_annotations(user: str, sha: str, annotations_path: str):
+    pdf_annotations = journal.compact(annotations_path)
+    # Deltas only adjust the counts, so re-sync them with the compacted annotations.
+    status_store.update_status(
+        user,
+        sha,
+        {
+            "annotations": len(pdf_annotations["annotations"]),
+            "relations": len(pdf_annotations["relations"]),
+        },
+    )
+
+
+@app.patch("/api/doc/{sha}/annotations")
+async def update_annotations(
+    sha: str,
+    delta: PdfAnnotationDelta,
+    background_tasks: BackgroundTasks,
+    x_auth_request_email: str = Header(None),
+):
+    """
+    sha: str
+        PDF sha to save annotations for.
+    delta: PdfAnnotationDelta
+        The annotations and relations which were added, updated or deleted
+        since the last save.
+    x_auth_request_email: str
+        This is a header sent with the requests which specifies the user login.
+
+    The changes are appended to a journal next to the annotation file, so a save
+    costs O(changes) rather than O(annotations). The journal is folded back into
+    the annotation file in the background once it grows large.
+    """
+    user = await authenticate(x_auth_request_email)
+    annotations_path = os.path.join(
+        configuration.output_directory, sha, f"{user}_annotations.json"
+    )
+
+    # Only used to check that the paper is allocated to the user; the counts
+    # are changed atomically below, so concurrent saves don't lose updates.
+    status = await run_io(STATUS_STORAGE, status_store.get_status, user, sha)
+    if status is None:
+        # Not an allocated user. Do nothing.
+        return {}
+
+    # The counts change by what the delta did to the stored annotations, which
+    # isn't the number of ids in it, e.g. if an added annotation already exists.
+    counts, should_compact = await run_io(
+        DOCUMENT_STORAGE,
+        journal.append_delta,
+        annotations_path,
+        jsonable_encoder(delta),
+    )
+
+    await run_io(STATUS_STORAGE, status_store.increment_counts, user, sha, counts)
+
+    if should_compact:
+        background_tasks.add_task(compact_annotations, user, sha, annotations_path)
+
+    return {}
+
+
+def token_cache_headers(etag: Optional[str]) -> Dict[str, str]:
+    """
+    Token files are re-written when a pdf is preprocessed again, at the same
+    url, so clients may cache the token responses which carry a content hash,
+    but must revalidate them. Unchanged tokens are answered with a 304.
+    """
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if etag is not None:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+    return headers
+
+
+def is_not_modified(etag: Optional[str], if_none_match: Optional[str]) -> bool:
+    if etag is None or if_none_match is None:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
 @app.get("/api/doc/{sha}/tokens")
-def get_tokens(sha: str):
+async def get_tokens(
+    sha: str,
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+):
     """
     sha: str
         PDF sha to retrieve tokens for.
+    accept: str
+        The Accept header of the request. Clients which send
+        `application/octet-stream` receive the columnar token store
+        written by `pawls preprocess`, rather than the json.
+    accept_encoding: str
+        The Accept-Encoding header of the request. If the client accepts
+        it, the brotli or gzip encoded json written by `pawls preprocess`
+        is sent instead of the plain json.
+    if_none_match: str
+        The If-None-Match header of the request, for conditional requests.
+
+    The token files are sent as they are on disk, without being parsed
+    and re-encoded.
     """
-    pdf_tokens = os.path.join(configuration.output_directory, sha, "pdf_structure.json")
+    return await run_io(
+        DOCUMENT_STORAGE, tokens_response, sha, accept, accept_encoding, if_none_match
+    )
+
+
+def tokens_response(
+    sha: str,
+    accept: Optional[str],
+    accept_encoding: Optional[str],
+    if_none_match: Optional[str],
+) -> Response:
+    pdf_directory = os.path.join(configuration.output_directory, sha)
+    pdf_tokens = os.path.join(pdf_directory, "pdf_structure.json")
     if not os.path.exists(pdf_tokens):
         raise HTTPException(status_code=404, detail="No tokens for pdf.")
-    with open(pdf_tokens, "r") as f:
-        response = json.load(f)
 
-    return response
+    content_hash = tokens.load_metadata(pdf_directory).get("sha256")
+
+    if accept is not None and TOKEN_STORE_MEDIA_TYPE in accept:
+        token_store = os.path.join(pdf_directory, "pdf_structure.tokens")
+        if not os.path.exists(token_store):
+            raise HTTPException(status_code=404, detail="No token store for pdf.")
+        etag = None if content_hash is None else f'"{content_hash}-tokens"'
+        headers = token_cache_headers(etag)
+        if is_not_modified(etag, if_none_match):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(
+            token_store, media_type=TOKEN_STORE_MEDIA_TYPE, headers=headers
+        )
+
+    path, encoding = tokens.find_preencoded_structure(pdf_directory, accept_encoding)
+    # Each encoding is a different representation, so it needs its own etag.
+    if content_hash is None:
+        etag = None
+    elif encoding is None:
+        etag = f'"{content_hash}"'
+    else:
+        etag = f'"{content_hash}-{encoding}"'
+    headers = token_cache_headers(etag)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if is_not_modified(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type="application/json", headers=headers)
+
+
+def page_tokens_response(
+    sha: str, start: int, end: int, if_none_match: Optional[str], single_page: bool
+) -> Response:
+    pdf_directory = os.path.join(configuration.output_directory, sha)
+    if not os.path.exists(os.path.join(pdf_directory, "pdf_structure.json")):
+        raise HTTPException(status_code=404, detail="No tokens for pdf.")
+
+    content_hash = tokens.load_metadata(pdf_directory).get("sha256")
+    if content_hash is None:
+        etag = None
+    elif single_page:
+        etag = f'"{content_hash}-{start}"'
+    else:
+        etag = f'"{content_hash}-{start}-{end}"'
+    headers = token_cache_headers(etag)
+    if is_not_modified(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    if single_page:
+        data = tokens.read_page(pdf_directory, start)
+    else:
+        data = tokens.read_page_range(pdf_directory, start, end)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Pages not found in pdf.")
+
+    return Response(content=data, media_type="application/json", headers=headers)
+
+
+@app.get("/api/doc/{sha}/tokens/{page}")
+async def get_page_tokens(sha: str, page: int, if_none_match: str = Header(None)):
+    """
+    sha: str
+        PDF sha to retrieve tokens for.
+    page: int
+        The index of the page to retrieve tokens for.
+    if_none_match: str
+        The If-None-Match header of the request, for conditional requests.
+    """
+    return await run_io(
+        DOCUMENT_STORAGE,
+        page_tokens_response,
+        sha,
+        page,
+        page + 1,
+        if_none_match,
+        single_page=True,
+    )
+
+
+@app.get("/api/doc/{sha}/tokens/{start}/{end}")
+async def get_page_range_tokens(
+    sha: str, start: int, end: int, if_none_match: str = Header(None)
+):
+    """
+    sha: str
+        PDF sha to retrieve tokens for.
+    start: int
+        The index of the first page to retrieve tokens for.
+    end: int
+        The index after the last page to retrieve tokens for,
+        i.e the pages in range(start, end) are returned.
+    if_none_match: str
+        The If-None-Match header of the request, for conditional requests.
+    """
+    return await run_io(
+        DOCUMENT_STORAGE,
+        page_tokens_response,
+        sha,
+        start,
+        end,
+        if_none_match,
+        single_page=False,
+    )
 
 
 @app.get("/api/annotation/labels")
@@ -286,36 +535,109 @@ def get_relations() -> List[Dict[str, str]]:
     return configuration.relations
 
 
+def unallocated_statuses() -> List[Dict[str, Any]]:
+    # If the user doesn't have allocated papers, they can see all the
+    # pdfs but they can't save anything.
+    return [
+        {
+            "sha": sha,
+            "name": document["name"],
+            "annotations": 0,
+            "relations": 0,
+            "finished": False,
+            "junk": False,
+            "comments": "",
+            "completedAt": None,
+        }
+        for sha, document in document_catalog.get().items()
+    ]
+
+
 @app.get("/api/annotation/allocation/info")
-def get_allocation_info(x_auth_request_email: str = Header(None)) -> Allocation:
+async def get_allocation_info(
+    x_auth_request_email: str = Header(None),
+    finished: Optional[bool] = None,
+    junk: Optional[bool] = None,
+    has_annotations: Optional[bool] = None,
+    sort: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+) -> Allocation:
+    """
+    finished: bool (optional)
+        Only return papers which are (or aren't) finished.
+    junk: bool (optional)
+        Only return papers which are (or aren't) marked as junk.
+    has_annotations: bool (optional)
+        Only return papers which have (or don't have) annotations.
+    sort: str (optional)
+        The field to sort papers by, one of sha, name, annotations, relations
+        and completedAt, prefixed with "-" for descending order.
+    offset: int (default = 0)
+        The number of matching papers to skip.
+    limit: int (optional)
+        The maximum number of papers to return. By default, all
+        matching papers are returned.
+
+    `total` is the number of papers matching the filters, so that
+    clients can paginate through them.
+    """
 
     # In development, the app isn't passed the x_auth_request_email header,
     # meaning this would always fail. Instead, to smooth local development,
     # we always return all pdfs, essentially short-circuiting the allocation
     # mechanism.
-    user = get_user_from_header(x_auth_request_email)
-
-    status_dir = os.path.join(configuration.output_directory, "status")
-    status_path = os.path.join(status_dir, f"{user}.json")
-    exists = os.path.exists(status_path)
-
-    if not exists:
-        # If the user doesn't have allocated papers, they can see all the
-        # pdfs but they can't save anything.
-        papers = [PaperStatus.empty(sha, sha) for sha in all_pdf_shas()]
-        response = Allocation(
-            papers=papers,
-            hasAllocatedPapers=False
-        )
+    user = await authenticate(x_auth_request_email)
+
+    if sort is not None:
+        try:
+            parse_sort(sort)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    query = StatusQuery(
+        finished=finished,
+        junk=junk,
+        has_annotations=has_annotations,
+        sort=sort,
+        offset=offset,
+        limit=limit,
+    )
+    return await run_io(STATUS_STORAGE, load_allocation, user, query)
 
+
+def load_allocation(user: str, query: StatusQuery) -> Allocation:
+    has_allocated_papers = status_store.has_user(user)
+    if has_allocated_papers:
+        total, statuses = status_store.query_statuses(user, query)
     else:
-        with open(status_path) as f:
-            status_json = json.load(f)
+        total, statuses = filter_statuses(unallocated_statuses(), query)
+
+    # Only the requested page of papers is turned into models.
+    return Allocation(
+        papers=[PaperStatus(**status) for status in statuses],
+        hasAllocatedPapers=has_allocated_papers,
+        total=total,
+    )
+
+
+@app.get("/api/annotation/allocation/summary")
+async def get_allocation_summary(
+    x_auth_request_email: str = Header(None),
+) -> AllocationSummary:
+    """
+    Count the papers allocated to the user, without listing them.
+    """
+    user = await authenticate(x_auth_request_email)
 
-        papers = []
-        for sha, status in status_json.items():
-            papers.append(PaperStatus(**status))
+    return await run_io(STATUS_STORAGE, load_allocation_summary, user)
 
-        response = Allocation(papers=papers, hasAllocatedPapers=True)
 
-    return response
+def load_allocation_summary(user: str) -> AllocationSummary:
+    has_allocated_papers = status_store.has_user(user)
+    if has_allocated_papers:
+        counts = status_store.count_statuses(user)
+    else:
+        counts = count_statuses(unallocated_statuses())
+
+    return AllocationSummary(hasAllocatedPapers=has_allocated_papers, **counts)
@@ -1,10 +1,34 @@
+import ast
 import os
+import json
 import shutil
+import threading
+import time
+import unittest
+import unittest.mock
 from unittest import TestCase
 
+import anyio
+
 from fastapi.testclient import TestClient
 
+import main
 from main import app
+from app import journal, storage
+from app.catalog import DocumentCatalog
+from app.status import STATUS_DB_SCHEMA, JsonStatusStore, SqliteStatusStore
+from app.users import AllowedUsers, load_allowed_users
+from app.utils import FileCache
+
+
+# A journal written by the API, which the cli's tests replay.
+CLI_JOURNAL_FIXTURES = os.path.join(
+    os.path.dirname(__file__), "..", "..", "cli", "test", "fixtures", "journal"
+)
+# The cli module which creates status databases with its own copy of the schema.
+CLI_COMMAND_UTILS = os.path.join(
+    os.path.dirname(__file__), "..", "..", "cli", "pawls", "commands", "utils.py"
+)
 
 
 def copy_and_overwrite(from_path: str, to_path: str):
@@ -110,7 +134,8 @@ class TestApp(TestCase):
                     "completedAt": None,
                 }
             ],
-            "hasAllocatedPapers": True
+            "hasAllocatedPapers": True,
+            "total": 1,
         }
         assert response.json() == gold
 
@@ -135,6 +160,116 @@ class TestApp(TestCase):
         response = self.client.get(f"/api/doc/not_a_pdf_sha/tokens")
         assert response.status_code == 404
 
+    def test_get_tokens_cache_headers(self):
+
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        # The tokens change when the pdf is preprocessed again.
+        assert response.headers["cache-control"] == "no-cache"
+        assert len(response.json()) == 11
+        gzip_etag = response.headers["etag"]
+
+        # Clients which don't accept gzip get the plain json, with its own etag.
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens", headers={"Accept-Encoding": "identity"}
+        )
+        assert "content-encoding" not in response.headers
+        etag = response.headers["etag"]
+        assert etag != gzip_etag
+        assert len(response.json()) == 11
+
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag},
+        )
+        assert response.status_code == 304
+        assert response.headers["content-encoding"] == "gzip"
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+        )
+        assert response.status_code == 200
+
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept-Encoding": "identity", "If-None-Match": etag},
+        )
+        assert response.status_code == 304
+
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens/3", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens/3",
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+
+        # Pdfs preprocessed without a content hash are not cached.
+        os.remove(os.path.join(self.TEST_DIR, self.pdf_sha, "pdf_structure.meta.json"))
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept-Encoding": "identity", "If-None-Match": etag},
+        )
+        assert response.status_code == 200
+        assert "cache-control" not in response.headers
+
+    def test_get_page_tokens(self):
+
+        with open(os.path.join(self.TEST_DIR, self.pdf_sha, "pdf_structure.json")) as f:
+            pages = json.load(f)
+
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/3")
+        assert response.json() == pages[3]
+
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/2/5")
+        assert response.json() == pages[2:5]
+
+        # Out of range pages should return 404
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/11")
+        assert response.status_code == 404
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/5/12")
+        assert response.status_code == 404
+        response = self.client.get("/api/doc/not_a_pdf_sha/tokens/0")
+        assert response.status_code == 404
+
+        # The offsets of a pdf_structure.json which was replaced since are ignored.
+        structure_path = os.path.join(self.TEST_DIR, self.pdf_sha, "pdf_structure.json")
+        with open(structure_path, "w") as f:
+            json.dump(pages, f, indent=2)
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/3")
+        assert response.json() == pages[3]
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/2/5")
+        assert response.json() == pages[2:5]
+
+        # Without the page offsets, the pages are read from the full json.
+        os.remove(os.path.join(self.TEST_DIR, self.pdf_sha, "pdf_structure.meta.json"))
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/3")
+        assert response.json() == pages[3]
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/tokens/2/5")
+        assert response.json() == pages[2:5]
+
+    def test_get_token_store(self):
+
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept": "application/octet-stream"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.content.startswith(b"PAWLSTK1")
+
+        os.remove(os.path.join(self.TEST_DIR, self.pdf_sha, "pdf_structure.tokens"))
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/tokens",
+            headers={"Accept": "application/octet-stream"},
+        )
+        assert response.status_code == 404
+
     def test_get_annotations(self):
         # All requests in this test are authenticated as this user.
         headers = {"X-Auth-Request-Email": "example@gmail.com"}
@@ -172,3 +307,455 @@ class TestApp(TestCase):
         )
 
         assert response.json()["papers"][0]["annotations"] == 1
+
+    def test_sqlite_status_store(self):
+        store = SqliteStatusStore(os.path.join(self.TEST_DIR, "status.db"))
+        with store._connection() as connection:
+            connection.execute(
+                "INSERT INTO status (user, sha, name) VALUES (?, ?, ?)",
+                ("example@gmail.com", self.pdf_sha, "A paper"),
+            )
+
+        original_store = main.status_store
+        main.status_store = store
+        try:
+            headers = {"X-Auth-Request-Email": "example@gmail.com"}
+            self.client.post(
+                f"/api/doc/{self.pdf_sha}/finished", json=True, headers=headers
+            )
+            self.client.post(
+                f"/api/doc/{self.pdf_sha}/comments", json="a comment", headers=headers
+            )
+            response = self.client.get(
+                "/api/annotation/allocation/info", headers=headers
+            )
+            assert response.json() == {
+                "papers": [
+                    {
+                        "sha": self.pdf_sha,
+                        "name": "A paper",
+                        "annotations": 0,
+                        "relations": 0,
+                        "finished": True,
+                        "junk": False,
+                        "comments": "a comment",
+                        "completedAt": None,
+                    }
+                ],
+                "hasAllocatedPapers": True,
+                "total": 1,
+            }
+
+            response = self.client.get(
+                "/api/annotation/allocation/info",
+                headers={"X-Auth-Request-Email": "example2@gmail.com"},
+            )
+            assert response.json()["hasAllocatedPapers"] is False
+        finally:
+            main.status_store = original_store
+
+    def test_increment_counts_concurrently(self):
+        sqlite_store = SqliteStatusStore(os.path.join(self.TEST_DIR, "status.db"))
+        with sqlite_store._connection() as connection:
+            connection.execute(
+                "INSERT INTO status (user, sha, name) VALUES (?, ?, ?)",
+                ("example@gmail.com", self.pdf_sha, "A paper"),
+            )
+        json_store = JsonStatusStore(os.path.join(self.TEST_DIR, "status"))
+
+        for store in [sqlite_store, json_store]:
+            store.update_status(
+                "example@gmail.com", self.pdf_sha, {"annotations": 0, "relations": 0}
+            )
+            threads = [
+                threading.Thread(
+                    target=store.increment_counts,
+                    args=("example@gmail.com", self.pdf_sha, {"annotations": 1}),
+                )
+                for _ in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            status = store.get_status("example@gmail.com", self.pdf_sha)
+            assert (status["annotations"], status["relations"]) == (20, 0)
+
+            # The counts never go below zero.
+            store.increment_counts(
+                "example@gmail.com", self.pdf_sha, {"annotations": -30, "relations": 2}
+            )
+            status = store.get_status("example@gmail.com", self.pdf_sha)
+            assert (status["annotations"], status["relations"]) == (0, 2)
+
+            # Papers which aren't allocated are ignored.
+            store.increment_counts("example@gmail.com", "not_a_sha", {"annotations": 1})
+            assert store.get_status("example@gmail.com", "not_a_sha") is None
+
+    def test_allowed_users_reload(self):
+        users_file = os.path.join(self.TEST_DIR, "allowed.txt")
+        allowed_users = FileCache(
+            users_file,
+            load_allowed_users,
+            default=AllowedUsers(emails=set(), domains=set()),
+            check_interval=0,
+        )
+        # Missing users files allow nobody.
+        assert not allowed_users.get().is_allowed("example@gmail.com")
+
+        with open(users_file, "w") as f:
+            f.write("example@gmail.com\n@allenai.org\n")
+        assert allowed_users.get().is_allowed("example@gmail.com")
+        assert allowed_users.get().is_allowed("someone@allenai.org")
+        assert not allowed_users.get().is_allowed("someone@gmail.com")
+        assert not allowed_users.get().is_allowed("someone@notallenai.org")
+
+        with open(users_file, "w") as f:
+            f.write("someone@gmail.com\n")
+        # Make sure the modification time changes, whatever the file system resolution.
+        os.utime(users_file, (0, 0))
+        assert allowed_users.get().is_allowed("someone@gmail.com")
+        assert not allowed_users.get().is_allowed("example@gmail.com")
+
+    def test_forbidden_user(self):
+        response = self.client.get(
+            "/api/annotation/allocation/info",
+            headers={"X-Auth-Request-Email": "not_allowed@gmail.com"},
+        )
+        assert response.status_code == 403
+
+    def test_update_annotations(self):
+        headers = {"X-Auth-Request-Email": "example@gmail.com"}
+        annotation = {
+            "id": "this-is-an-id",
+            "page": 1,
+            "label": {"text": "label1", "color": "red"},
+            "bounds": {"left": 1.0, "top": 4.3, "right": 5.1, "bottom": 2.5},
+            "tokens": None,
+        }
+        other_annotation = {**annotation, "id": "this-is-another-id"}
+        relation = {
+            "sourceIds": ["this-is-an-id"],
+            "targetIds": ["this-is-another-id"],
+            "label": {"text": "relation1", "color": "blue"},
+        }
+
+        self.client.patch(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={
+                "annotations": {"added": [annotation, other_annotation]},
+                "relations": {"added": [relation]},
+            },
+            headers=headers,
+        )
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/annotations", headers=headers
+        )
+        assert response.json() == {
+            "annotations": [annotation, other_annotation],
+            "relations": [relation],
+        }
+
+        updated_annotation = {**annotation, "page": 2}
+        self.client.patch(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={
+                "annotations": {
+                    "updated": [updated_annotation],
+                    "deleted": ["this-is-another-id"],
+                },
+                "relations": {"deleted": [relation]},
+            },
+            headers=headers,
+        )
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/annotations", headers=headers
+        )
+        assert response.json() == {
+            "annotations": [updated_annotation],
+            "relations": [],
+        }
+
+        response = self.client.get(
+            "/api/annotation/allocation/info", headers=headers
+        )
+        assert response.json()["papers"][0]["annotations"] == 1
+        assert response.json()["papers"][0]["relations"] == 0
+
+        # The counts follow the stored annotations, rather than the number of ids
+        # in a change: re-adding an annotation, deleting an unknown one, and
+        # updating one which doesn't exist yet (which adds it).
+        self.client.patch(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={
+                "annotations": {
+                    "added": [updated_annotation],
+                    "updated": [other_annotation],
+                    "deleted": ["not-an-id"],
+                },
+                "relations": {"deleted": [relation]},
+            },
+            headers=headers,
+        )
+        response = self.client.get(
+            "/api/annotation/allocation/info", headers=headers
+        )
+        assert response.json()["papers"][0]["annotations"] == 2
+        assert response.json()["papers"][0]["relations"] == 0
+
+        # Changes made to the annotation file by something else are accounted for.
+        annotations_path = os.path.join(
+            self.TEST_DIR, self.pdf_sha, "example@gmail.com_annotations.json"
+        )
+        journal.save_annotations(
+            annotations_path, {"annotations": [annotation], "relations": []}
+        )
+        self.client.patch(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={"annotations": {"deleted": ["this-is-another-id"]}},
+            headers=headers,
+        )
+        response = self.client.get(
+            "/api/annotation/allocation/info", headers=headers
+        )
+        assert response.json()["papers"][0]["annotations"] == 2
+
+        # A full save replaces the journaled changes.
+        self.client.post(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={"annotations": [other_annotation], "relations": []},
+            headers=headers,
+        )
+        response = self.client.get(
+            f"/api/doc/{self.pdf_sha}/annotations", headers=headers
+        )
+        assert response.json() == {"annotations": [other_annotation], "relations": []}
+
+    @unittest.skipUnless(
+        os.path.exists(CLI_COMMAND_UTILS), "the cli is not checked out alongside"
+    )
+    def test_status_db_schema_matches_cli(self):
+        with open(CLI_COMMAND_UTILS) as f:
+            module = ast.parse(f.read())
+        schemas = [
+            ast.literal_eval(node.value)
+            for node in module.body
+            if isinstance(node, ast.Assign)
+            and any(getattr(t, "id", None) == "STATUS_DB_SCHEMA" for t in node.targets)
+        ]
+        assert schemas == [STATUS_DB_SCHEMA]
+
+    @unittest.skipUnless(
+        os.path.exists(CLI_JOURNAL_FIXTURES), "the cli is not checked out alongside"
+    )
+    def test_load_annotations_journal_fixture(self):
+        # The cli replays journals with its own copy of apply_delta, and is
+        # tested against the same fixture.
+        annotations = journal.load_annotations(
+            os.path.join(CLI_JOURNAL_FIXTURES, "markn@example.com_annotations.json")
+        )
+        with open(os.path.join(CLI_JOURNAL_FIXTURES, "expected_annotations.json")) as f:
+            assert annotations == json.load(f)
+
+    def test_update_annotations_compaction(self):
+        headers = {"X-Auth-Request-Email": "example@gmail.com"}
+        annotation = {
+            "id": "this-is-an-id",
+            "page": 1,
+            "label": {"text": "label1", "color": "red"},
+            "bounds": {"left": 1.0, "top": 4.3, "right": 5.1, "bottom": 2.5},
+            "tokens": None,
+        }
+        annotations_path = os.path.join(
+            self.TEST_DIR, self.pdf_sha, "example@gmail.com_annotations.json"
+        )
+
+        threshold = journal.COMPACTION_THRESHOLD_BYTES
+        journal.COMPACTION_THRESHOLD_BYTES = 0
+        try:
+            self.client.patch(
+                f"/api/doc/{self.pdf_sha}/annotations",
+                json={"annotations": {"added": [annotation]}},
+                headers=headers,
+            )
+        finally:
+            journal.COMPACTION_THRESHOLD_BYTES = threshold
+
+        assert not os.path.exists(journal.journal_path(annotations_path))
+        with open(annotations_path) as f:
+            assert json.load(f) == {"annotations": [annotation], "relations": []}
+
+        # Unallocated users can't save anything.
+        self.client.patch(
+            f"/api/doc/{self.pdf_sha}/annotations",
+            json={"annotations": {"added": [annotation]}},
+            headers={"X-Auth-Request-Email": "example2@gmail.com"},
+        )
+        assert not os.path.exists(
+            os.path.join(self.TEST_DIR, self.pdf_sha, "example2@gmail.com_annotations.json")
+        )
+
+    def test_run_io_bounds_concurrency(self):
+        running = 0
+        max_running = 0
+        lock = threading.Lock()
+
+        def blocking_read():
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+
+        async def read_concurrently(storage_path: str):
+            async with anyio.create_task_group() as tasks:
+                for _ in range(8):
+                    tasks.start_soon(storage.run_io, storage_path, blocking_read)
+
+        io_concurrency = storage.IO_CONCURRENCY
+        storage.IO_CONCURRENCY = 2
+        try:
+            anyio.run(read_concurrently, "test/fixtures/tmp/bounded")
+        finally:
+            storage.IO_CONCURRENCY = io_concurrency
+            storage._limiters.clear()
+
+        assert max_running == 2
+
+    def test_document_catalog(self):
+        catalog = DocumentCatalog(self.TEST_DIR, check_interval=0)
+        assert list(catalog.get()) == [self.pdf_sha]
+        assert catalog.get()[self.pdf_sha]["name"] == self.pdf_sha
+
+        with open(os.path.join(self.TEST_DIR, "pdf_catalog.json"), "w") as f:
+            json.dump({self.pdf_sha: {"sha": self.pdf_sha, "name": "Paper"}}, f)
+        assert catalog.get()[self.pdf_sha]["name"] == "Paper"
+
+        # Pdfs added without updating the catalog are picked up too.
+        new_sha = "a" * 40
+        os.makedirs(os.path.join(self.TEST_DIR, new_sha))
+        shutil.copy(
+            os.path.join(self.TEST_DIR, self.pdf_sha, f"{self.pdf_sha}.pdf"),
+            os.path.join(self.TEST_DIR, new_sha, f"{new_sha}.pdf"),
+        )
+        assert list(catalog.get()) == sorted([self.pdf_sha, new_sha])
+        assert not catalog.get()[new_sha]["structure"]
+
+        with unittest.mock.patch.object(main, "document_catalog", catalog):
+            response = self.client.get(
+                "/api/annotation/allocation/info",
+                headers={"X-Auth-Request-Email": "example2@gmail.com"},
+            )
+        papers = response.json()["papers"]
+        assert [paper["name"] for paper in papers] == ["Paper", new_sha]
+
+    def test_paginated_allocation_info(self):
+        statuses = {
+            sha: {
+                "sha": sha,
+                "name": name,
+                "annotations": annotations,
+                "relations": 0,
+                "finished": finished,
+                "junk": junk,
+                "comments": "",
+                "completedAt": None,
+            }
+            for sha, name, annotations, finished, junk in [
+                ("a", "Paper C", 3, True, False),
+                ("b", "Paper A", 0, False, False),
+                ("c", "Paper B", 5, False, True),
+                ("d", "Paper D", 1, True, False),
+            ]
+        }
+        user = "example@gmail.com"
+        headers = {"X-Auth-Request-Email": user}
+
+        json_store = JsonStatusStore(os.path.join(self.TEST_DIR, "status"))
+        with open(os.path.join(self.TEST_DIR, "status", f"{user}.json"), "w") as f:
+            json.dump(statuses, f)
+
+        sqlite_store = SqliteStatusStore(os.path.join(self.TEST_DIR, "status.db"))
+        with sqlite_store._connection() as connection:
+            connection.executemany(
+                "INSERT INTO status (user, sha, name, annotations, finished, junk) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (user, s["sha"], s["name"], s["annotations"], s["finished"], s["junk"])
+                    for s in statuses.values()
+                ],
+            )
+
+        def get_shas(**params):
+            response = self.client.get(
+                "/api/annotation/allocation/info", params=params, headers=headers
+            )
+            allocation = response.json()
+            return allocation["total"], [paper["sha"] for paper in allocation["papers"]]
+
+        for store in [json_store, sqlite_store]:
+            with unittest.mock.patch.object(main, "status_store", store):
+                assert get_shas() == (4, ["a", "b", "c", "d"])
+                assert get_shas(limit=2, offset=1) == (4, ["b", "c"])
+                assert get_shas(finished=True) == (2, ["a", "d"])
+                assert get_shas(junk=False, has_annotations=True) == (2, ["a", "d"])
+                assert get_shas(has_annotations=False) == (1, ["b"])
+                assert get_shas(sort="name") == (4, ["b", "c", "a", "d"])
+                assert get_shas(sort="-annotations", limit=2) == (4, ["c", "a"])
+
+                response = self.client.get(
+                    "/api/annotation/allocation/info",
+                    params={"sort": "comments"},
+                    headers=headers,
+                )
+                assert response.status_code == 400
+
+                response = self.client.get(
+                    "/api/annotation/allocation/summary", headers=headers
+                )
+                assert response.json() == {
+                    "hasAllocatedPapers": True,
+                    "total": 4,
+                    "finished": 2,
+                    "junk": 1,
+                    "annotated": 3,
+                }
+
+        # Users without allocated papers can see every pdf.
+        response = self.client.get(
+            "/api/annotation/allocation/summary",
+            headers={"X-Auth-Request-Email": "example2@gmail.com"},
+        )
+        assert response.json() == {
+            "hasAllocatedPapers": False,
+            "total": 1,
+            "finished": 0,
+            "junk": 0,
+            "annotated": 0,
+        }
+
+    def test_get_pdf_titles(self):
+        with open(os.path.join(self.TEST_DIR, "pdf_metadata.json"), "w") as f:
+            json.dump({self.pdf_sha: "A title", "other": {"title": "Another title"}}, f)
+        main.pdf_titles.invalidate()
+
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/title")
+        assert response.json() == "A title"
+
+        response = self.client.post(
+            "/api/doc/titles", json=[self.pdf_sha, "other", "missing"]
+        )
+        assert response.json() == {
+            self.pdf_sha: "A title",
+            "other": "Another title",
+            "missing": None,
+        }
+
+        os.remove(os.path.join(self.TEST_DIR, "pdf_metadata.json"))
+        main.pdf_titles.invalidate()
+        response = self.client.get(f"/api/doc/{self.pdf_sha}/title")
+        assert response.status_code == 200
+        assert response.json() is None
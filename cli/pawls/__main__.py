@@ -21,7 +21,10 @@ subcommands = [
     commands.status,
     commands.preannotate,
     commands.metric,
-    commands.add
+    commands.add,
+    commands.migrate_status,
+    commands.catalog,
+    commands.bench,
 ]
 
 for subcommand in subcommands:
@@ -5,3 +5,6 @@ from pawls.commands.export import export
 from pawls.commands.status import status
 from pawls.commands.metric import metric
 from pawls.commands.dataset import add
+from pawls.commands.migrate import migrate_status
+from pawls.commands.catalog import catalog
+from pawls.commands.bench import bench
@@ -1,12 +1,13 @@
-import os
 from typing import Tuple
 
 import click
 from click import UsageError, BadArgumentUsage
 import json
-import glob
 import re
 
+from pawls.commands.utils import load_annotator_status, add_annotator_status
+from pawls.commands.catalog import load_catalog
+
 
 @click.command(context_settings={"help_option_names": ["--help", "-h"]})
 @click.argument("path", type=click.Path(exists=True, file_okay=False))
@@ -59,8 +60,8 @@ def assign(
     """
     shas = set(shas)
 
-    pdfs = glob.glob(os.path.join(path, "*/*.pdf"))
-    project_shas = {p.split("/")[-2] for p in pdfs}
+    catalog = load_catalog(path)
+    project_shas = set(catalog)
     if all:
         # If --all flag, we use all pdfs in the current project.
         shas.update(project_shas)
@@ -93,21 +94,18 @@ def assign(
     if not result or result.group(0) != annotator:
         raise BadArgumentUsage("Provided annotator was not a valid email.")
 
-    status_dir = os.path.join(path, "status")
-    os.makedirs(status_dir, exist_ok=True)
-
-    status_path = os.path.join(status_dir, f"{annotator}.json")
-
-    pdf_status = {}
-    if os.path.exists(status_path):
-        pdf_status = json.load(open(status_path))
+    pdf_status = load_annotator_status(path, annotator) or {}
 
     name_mapping = {}
     if name_file is not None:
         name_mapping = json.load(open(name_file))
     else:
-        print("Warning: --name-file was not provided, using shas as pdf names.")
+        print(
+            "Warning: --name-file was not provided, using the names "
+            "recorded by `pawls add` (or shas) as pdf names."
+        )
 
+    new_pdf_status = {}
     for sha in sorted(shas):
         if sha in pdf_status:
             continue
@@ -115,9 +113,9 @@ def assign(
 
             name = name_mapping.get(sha, None)
             if name is None:
-                name = sha
+                name = catalog[sha]["name"]
 
-            pdf_status[sha] = {
+            new_pdf_status[sha] = {
                 "sha": sha,
                 "name": name,
                 "annotations": 0,
@@ -128,5 +126,4 @@ def assign(
                 "completedAt": None,
             }
 
-    with open(status_path, "w+") as out:
-        json.dump(pdf_status, out)
+    add_annotator_status(path, annotator, new_pdf_status)
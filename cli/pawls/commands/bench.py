@@ -0,0 +1,412 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Set
+
+import click
+from tabulate import tabulate
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory isn't reported.
+    resource = None
+
+from pawls.commands.preprocess import PREPROCESSORS, PREPROCESSOR_PARAMS, process_chunk
+from pawls.preprocessors.storage import TOKEN_STORE_NAME, TokenStore
+
+# Synthetic pages are US letter sized, with one inch margins.
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 72
+
+# The resolution which scanned pages are rendered at.
+SCAN_DPI = 150
+
+# Helvetica is about this wide per character, relative to its size. It is only
+# used to wrap lines, so it doesn't need to be exact.
+CHARACTER_WIDTH = 0.6
+LINE_SPACING = 1.2
+
+WORD_CHARACTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def random_words(rng: random.Random, num_words: int) -> List[str]:
+    return [
+        "".join(rng.choice(WORD_CHARACTERS) for _ in range(rng.randint(2, 10)))
+        for _ in range(num_words)
+    ]
+
+
+def layout_words(words: List[str]) -> List[Dict[str, Any]]:
+    """Lay words out in lines which fill the text area of a page, choosing
+    the largest font size (up to 10pt) at which all of them fit.
+
+    Returns the lines, each with the font size, the position of its baseline
+    (in pdf coordinates, from the bottom left) and its text.
+    """
+    text_width = PAGE_WIDTH - 2 * MARGIN
+    text_height = PAGE_HEIGHT - 2 * MARGIN
+
+    def wrap(size: float) -> List[List[str]]:
+        lines = [[]]
+        line_width = 0.0
+        for word in words:
+            word_width = (len(word) + 1) * CHARACTER_WIDTH * size
+            if lines[-1] and line_width + word_width > text_width:
+                lines.append([])
+                line_width = 0.0
+            lines[-1].append(word)
+            line_width += word_width
+        return lines
+
+    size = 10.0
+    lines = wrap(size)
+    while len(lines) * size * LINE_SPACING > text_height:
+        size *= 0.9
+        lines = wrap(size)
+
+    return [
+        {
+            "size": size,
+            "x": MARGIN,
+            "y": PAGE_HEIGHT - MARGIN - (i + 1) * size * LINE_SPACING,
+            "text": " ".join(line),
+        }
+        for i, line in enumerate(lines)
+    ]
+
+
+def text_content(lines: List[Dict[str, Any]]) -> bytes:
+    """A content stream which draws the lines with a real text layer."""
+    commands = ["BT"]
+    for line in lines:
+        commands.append(
+            f"/F1 {line['size']:.2f} Tf 1 0 0 1 {line['x']:.2f} {line['y']:.2f} Tm "
+            f"({line['text']}) Tj"
+        )
+    commands.append("ET")
+    return "\n".join(commands).encode("latin-1")
+
+
+def scanned_image(lines: List[Dict[str, Any]]) -> bytes:
+    """Render the lines into a grayscale JPEG, like a page from a scanner."""
+    scale = SCAN_DPI / 72
+    image = Image.new("L", (round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    fonts = {}
+    for line in lines:
+        size = max(1, round(line["size"] * scale))
+        if size not in fonts:
+            try:
+                fonts[size] = ImageFont.load_default(size=size)
+            except TypeError:
+                # Pillow < 10.1 only has a bitmap font, of a fixed size.
+                fonts[size] = ImageFont.load_default()
+        # Images are drawn from the top left.
+        top = (PAGE_HEIGHT - line["y"] - line["size"]) * scale
+        draw.text((line["x"] * scale, top), line["text"], fill=0, font=fonts[size])
+
+    data = io.BytesIO()
+    image.save(data, format="JPEG", quality=75)
+    return data.getvalue()
+
+
+def write_synthetic_pdf(
+    filename: str,
+    num_pages: int,
+    tokens_per_page: int,
+    scanned_pages: Set[int],
+    rng: random.Random,
+) -> None:
+    """Write a pdf of random words.
+
+    Born-digital pages have a text layer of `tokens_per_page` words. Scanned pages
+    are an image of as many words, without a text layer, so that only OCR can
+    extract their tokens.
+    """
+    objects = []
+
+    def add_object(data: bytes) -> int:
+        objects.append(data)
+        return len(objects)
+
+    def stream(dictionary: str, data: bytes) -> bytes:
+        return (
+            f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode("latin-1")
+            + data
+            + b"\nendstream"
+        )
+
+    catalog_id = add_object(b"")
+    pages_id = add_object(b"")
+    font_id = add_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for page_index in range(num_pages):
+        lines = layout_words(random_words(rng, tokens_per_page))
+        if page_index in scanned_pages:
+            jpeg = scanned_image(lines)
+            width, height = Image.open(io.BytesIO(jpeg)).size
+            image_id = add_object(
+                stream(
+                    f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                    "/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode",
+                    jpeg,
+                )
+            )
+            resources = f"/XObject << /Im0 {image_id} 0 R >>"
+            content = f"q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im0 Do Q".encode()
+        else:
+            resources = f"/Font << /F1 {font_id} 0 R >>"
+            content = text_content(lines)
+
+        content_id = add_object(stream("/Filter /FlateDecode", zlib.compress(content)))
+        page_ids.append(
+            add_object(
+                f"<< /Type /Page /Parent {pages_id} 0 R "
+                f"/MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << {resources} >> /Contents {content_id} 0 R >>".encode()
+            )
+        )
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[catalog_id - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode()
+    objects[pages_id - 1] = (
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+    )
+
+    pdf = io.BytesIO()
+    pdf.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for object_id, data in enumerate(objects, start=1):
+        offsets.append(pdf.tell())
+        pdf.write(f"{object_id} 0 obj\n".encode() + data + b"\nendobj\n")
+
+    xref_offset = pdf.tell()
+    pdf.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        pdf.write(f"{offset:010d} 00000 n \n".encode())
+    pdf.write(
+        f"trailer\n<< /Size {len(objects) + 1} /Root {catalog_id} 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n".encode()
+    )
+
+    with open(filename, "wb") as fp:
+        fp.write(pdf.getvalue())
+
+
+def create_corpus(
+    directory: str,
+    num_pdfs: int,
+    num_pages: int,
+    tokens_per_page: int,
+    scanned: float,
+    seed: int,
+) -> List[str]:
+    """Create a labeling folder of synthetic pdfs, in which a `scanned` fraction
+    of the pages of each pdf are scanned, and the rest are born-digital."""
+    pdfs = []
+    num_scanned = round(scanned * num_pages)
+    for i in range(num_pdfs):
+        rng = random.Random(seed + i)
+        sha = f"synthetic{i:05d}"
+        os.makedirs(os.path.join(directory, sha), exist_ok=True)
+        pdf = os.path.join(directory, sha, f"{sha}.pdf")
+        scanned_pages = set(rng.sample(range(num_pages), num_scanned))
+        write_synthetic_pdf(pdf, num_pages, tokens_per_page, scanned_pages, rng)
+        pdfs.append(pdf)
+    return pdfs
+
+
+def peak_rss_mb() -> Optional[float]:
+    """The peak resident memory of this process so far, in megabytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_preprocessor(
+    preprocessor: str, pdfs: List[str], params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Preprocess the pdfs, in a process of its own, and measure it."""
+    start = time.perf_counter()
+    results = process_chunk(preprocessor, pdfs, 1, params)
+    seconds = time.perf_counter() - start
+
+    processed = [pdf for pdf, error in results if error is None]
+    pages = tokens = 0
+    for pdf in processed:
+        store = TokenStore(os.path.join(os.path.dirname(pdf), TOKEN_STORE_NAME))
+        pages += len(store)
+        tokens += len(store.coordinates)
+
+    return {
+        "preprocessor": preprocessor,
+        "pdfs": len(processed),
+        "failed": len(pdfs) - len(processed),
+        "pages": pages,
+        "tokens": tokens,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "tokens_per_second": tokens / seconds if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": [error for _, error in results if error is not None][:1],
+    }
+
+
+def measure(preprocessor: str, pdfs: List[str], params: Dict[str, Any]) -> Dict[str, Any]:
+    # A fresh interpreter for each preprocessor, so that its peak memory
+    # isn't inflated by the preprocessors which ran before it.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_preprocessor, preprocessor, pdfs, params).result()
+
+
+@click.group(context_settings={"help_option_names": ["--help", "-h"]})
+def bench():
+    """
+    Benchmark pawls.
+    """
+
+
+@bench.command(
+    name="preprocess", context_settings={"help_option_names": ["--help", "-h"]}
+)
+@click.option(
+    "--preprocessor",
+    "-p",
+    "preprocessors",
+    type=click.Choice(list(PREPROCESSORS)),
+    multiple=True,
+    default=["pdfplumber"],
+    show_default=True,
+    help="The preprocessors to benchmark. Can be given several times.",
+)
+@click.option("--pdfs", type=click.IntRange(min=1), default=4, show_default=True)
+@click.option(
+    "--pages",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="The number of pages of each pdf.",
+)
+@click.option(
+    "--tokens",
+    type=click.IntRange(min=1),
+    default=300,
+    show_default=True,
+    help="The number of words on each page.",
+)
+@click.option(
+    "--scanned",
+    type=click.FloatRange(min=0, max=1),
+    default=0.0,
+    show_default=True,
+    help="The fraction of the pages of each pdf which are scanned, without a text layer.",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--corpus",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="A directory to write the synthetic pdfs to and keep them in. "
+    "By default, they are written to a temporary directory.",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="A file to write the results to, as json.",
+)
+def bench_preprocess(
+    preprocessors: List[str],
+    pdfs: int,
+    pages: int,
+    tokens: int,
+    scanned: float,
+    seed: int,
+    corpus: Optional[str],
+    output: Optional[str],
+):
+    """
+    Measure the throughput of preprocessors on a corpus of synthetic pdfs.
+
+    The pdfs are generated offline, with a controllable number of pages, words
+    per page and fraction of scanned pages. Each preprocessor runs in a fresh
+    process, and its pages/sec, tokens/sec and peak memory are reported:
+
+        `pawls bench preprocess -p pdfplumber -p auto --scanned 0.2 -o bench.json`
+
+    The grobid preprocessor needs grobid to be running (see `pawls preprocess`).
+    """
+    with tempfile.TemporaryDirectory() as tempdir:
+        directory = corpus or tempdir
+        print(f"Generating {pdfs} pdfs of {pages} pages in {directory}...")
+        pdf_paths = create_corpus(directory, pdfs, pages, tokens, scanned, seed)
+
+        results = []
+        for preprocessor in preprocessors:
+            print(f"Running the {preprocessor} preprocessor...")
+            params = dict(PREPROCESSOR_PARAMS[preprocessor])
+            result = measure(preprocessor, pdf_paths, params)
+            for error in result.pop("errors"):
+                print(f"The {preprocessor} preprocessor failed:\n{error}")
+            results.append(result)
+
+    print(
+        tabulate(
+            [
+                [
+                    result["preprocessor"],
+                    result["pdfs"],
+                    result["failed"],
+                    result["pages_per_second"],
+                    result["tokens_per_second"],
+                    result["peak_rss_mb"],
+                ]
+                for result in results
+            ],
+            headers=[
+                "preprocessor",
+                "pdfs",
+                "failed",
+                "pages/s",
+                "tokens/s",
+                "peak RSS (MB)",
+            ],
+            tablefmt="psql",
+            floatfmt=".1f",
+        )
+    )
+
+    if output is not None:
+        report = {
+            "corpus": {
+                "pdfs": pdfs,
+                "pages": pages,
+                "tokens": tokens,
+                "scanned": scanned,
+                "seed": seed,
+            },
+            "machine": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "results": results,
+        }
+        with open(output, "w") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"Saved the results to {output}")
@@ -0,0 +1,169 @@
+import os
+import json
+from typing import Dict, Any, Iterable, Optional
+
+import click
+from tqdm import tqdm
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import resolve1
+
+from pawls.preprocessors.storage import PDF_STRUCTURE_NAME, load_pdf_structure_metadata
+
+# The document catalog records every pdf in a labeling folder, so that listing
+# the pdfs doesn't need to scan one sub-directory per pdf. It maps each pdf sha to:
+#
+#   sha        the sha of the pdf, i.e. the name of its sub-directory
+#   name       a human readable name, e.g. the original file name passed to `pawls add`
+#   pages      the number of pages of the pdf, or None if it couldn't be read, or
+#              the pdf was only found by listing the labeling folder
+#   structure  whether the pdf has been preprocessed, i.e. has a pdf_structure.json
+#   size       the size of the pdf file in bytes
+#
+# It is written by `pawls catalog`, and kept current by `pawls add` and
+# `pawls preprocess`. The API reads the same file.
+CATALOG_NAME = "pdf_catalog.json"
+
+
+def get_catalog_path(labeling_folder: str) -> str:
+    return os.path.join(labeling_folder, CATALOG_NAME)
+
+
+def get_pdf_page_count(pdf_path: str) -> Optional[int]:
+    """Read the page count of a pdf. Unlike `get_pdf_pages_and_sizes`,
+    this doesn't parse every page."""
+    try:
+        with open(pdf_path, "rb") as fp:
+            document = PDFDocument(PDFParser(fp))
+            return int(resolve1(document.catalog["Pages"])["Count"])
+    except Exception:
+        return None
+
+
+def describe_pdf(
+    labeling_folder: str,
+    sha: str,
+    name: Optional[str] = None,
+    count_pages: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """Create the catalog entry of a pdf in a labeling folder. The page count
+    is left out unless `count_pages`, because it may require parsing the pdf.
+
+    Returns None if the folder doesn't contain the pdf.
+    """
+    pdf_directory = os.path.join(labeling_folder, sha)
+    pdf_path = os.path.join(pdf_directory, f"{sha}.pdf")
+    if not os.path.isfile(pdf_path):
+        return None
+
+    has_structure = os.path.exists(os.path.join(pdf_directory, PDF_STRUCTURE_NAME))
+    num_pages = None
+    if count_pages:
+        # Preprocessed pdfs record their pages, which is cheaper than parsing the pdf.
+        pages = load_pdf_structure_metadata(pdf_directory).get("pages")
+        num_pages = len(pages) if pages is not None else get_pdf_page_count(pdf_path)
+
+    return {
+        "sha": sha,
+        "name": name or sha,
+        "pages": num_pages,
+        "structure": has_structure,
+        "size": os.path.getsize(pdf_path),
+    }
+
+
+def load_catalog_file(labeling_folder: str) -> Dict[str, Dict[str, Any]]:
+    """Load the catalog file of a labeling folder as it is on disk,
+    or an empty catalog if it hasn't been built."""
+    catalog_path = get_catalog_path(labeling_folder)
+    if not os.path.exists(catalog_path):
+        return {}
+    with open(catalog_path, "r") as fp:
+        return json.load(fp)
+
+
+def save_catalog(labeling_folder: str, catalog: Dict[str, Dict[str, Any]]) -> None:
+    catalog_path = get_catalog_path(labeling_folder)
+    # Readers, including the API, may load the catalog at any time,
+    # so it is replaced atomically.
+    tmp_path = f"{catalog_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump({sha: catalog[sha] for sha in sorted(catalog)}, fp)
+    os.replace(tmp_path, catalog_path)
+
+
+def load_catalog(labeling_folder: str) -> Dict[str, Dict[str, Any]]:
+    """Load the catalog of the pdfs in a labeling folder, sorted by sha.
+
+    The catalog file is reconciled with a single listing of the labeling folder,
+    so pdfs which were added or removed without updating the catalog are still
+    accounted for. Only the sub-directories which aren't in the catalog file
+    are inspected, and their pdfs aren't parsed, so their page count is None.
+    The catalog file itself is not modified.
+    """
+    catalog = load_catalog_file(labeling_folder)
+    if not os.path.isdir(labeling_folder):
+        return {}
+
+    directories = {entry.name for entry in os.scandir(labeling_folder) if entry.is_dir()}
+    documents = {}
+    for sha in sorted(directories):
+        document = catalog.get(sha) or describe_pdf(
+            labeling_folder, sha, count_pages=False
+        )
+        if document is not None:
+            documents[sha] = document
+
+    return documents
+
+
+def update_catalog(
+    labeling_folder: str,
+    shas: Iterable[str],
+    names: Optional[Dict[str, str]] = None,
+) -> None:
+    """Refresh the catalog entries of some pdfs in a labeling folder,
+    creating the catalog file if it doesn't exist yet.
+
+    Args:
+        labeling_folder (str): The labeling folder.
+        shas (Iterable[str]): The shas of the pdfs which were added or modified.
+        names (Dict[str, str], optional):
+            Names for the pdfs. The existing name of a pdf is kept otherwise.
+    """
+    names = names or {}
+    catalog = load_catalog(labeling_folder)
+    for sha in shas:
+        name = names.get(sha) or catalog.get(sha, {}).get("name")
+        document = describe_pdf(labeling_folder, sha, name)
+        if document is None:
+            catalog.pop(sha, None)
+        else:
+            catalog[sha] = document
+
+    save_catalog(labeling_folder, catalog)
+
+
+@click.command(context_settings={"help_option_names": ["--help", "-h"]})
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+def catalog(path: click.Path):
+    """
+    Build the document catalog of a labeling folder.
+
+    The catalog lists every pdf with its name, page count, size and whether
+    it has been preprocessed, so that the API and the other pawls commands
+    don't need to scan the folder. `pawls add` and `pawls preprocess` keep it
+    up to date afterwards.
+
+        `pawls catalog skiff_files/apps/pawls/papers`
+    """
+    existing = load_catalog_file(path)
+    documents = {}
+    for sha in tqdm(sorted(os.listdir(path))):
+        name = existing.get(sha, {}).get("name")
+        document = describe_pdf(path, sha, name)
+        if document is not None:
+            documents[sha] = document
+
+    save_catalog(path, documents)
+    print(f"Catalogued {len(documents)} pdfs in {get_catalog_path(path)}.")
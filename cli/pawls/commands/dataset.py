@@ -9,6 +9,8 @@ from tqdm import tqdm
 from pathlib import Path
 from typing import Union
 
+from pawls.commands.catalog import update_catalog
+
 
 def hash_pdf(file: Union[str, Path]) -> str:
     block_size = 65536
@@ -44,6 +46,7 @@ def add(directory: click.Path, no_hash: bool) -> None:
 
     logging.info(f"Found {len(pdfs)} total PDFs to add.")
 
+    names = {}
     for pdf in tqdm(pdfs):
         pdf_name = Path(pdf).stem
 
@@ -62,3 +65,6 @@ def add(directory: click.Path, no_hash: bool) -> None:
         output_dir.mkdir(exist_ok=True)
 
         copy(pdf, output_dir / (pdf_name + '.pdf'))
+        names[pdf_name] = Path(pdf).stem
+
+    update_catalog(str(base_dir), names, names)
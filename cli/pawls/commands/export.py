@@ -1,14 +1,16 @@
 import os
 import json
-from typing import List, NamedTuple, Union, Dict, Any
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, NamedTuple, Union, Dict, Any, Sequence, Tuple
 
 import click
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from pdf2image import convert_from_path
 
 from pawls.commands.utils import (
-    load_json,
+    load_annotations,
     get_pdf_sha,
     get_pdf_pages_and_sizes,
     LabelingConfiguration,
@@ -25,8 +27,34 @@ def _convert_bounds_to_coco_bbox(bounds: Dict[str, Union[int, float]]):
     return x1, y1, x2 - x1, y2 - y1
 
 
+# A page to render: its index, the size of its image, and the image file.
+PageImage = Tuple[int, Tuple[int, int], str]
+
+
+def render_page_images(pdf_path: str, page_images: List[PageImage]) -> None:
+    """Render pages of a pdf into JPEG files, one page at a time, directly at
+    the size of the images, so that only a single page image is ever in memory.
+
+    Each file is written atomically, so that an interrupted export never leaves
+    behind a truncated image, which a later export would skip.
+    """
+    for page_id, (width, height), filename in page_images:
+        # Pages are numbered from 1 by pdf2image.
+        (image,) = convert_from_path(
+            pdf_path, first_page=page_id + 1, last_page=page_id + 1, size=(width, height)
+        )
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        try:
+            image.save(tmp_filename, format="JPEG")
+            os.replace(tmp_filename, filename)
+        finally:
+            image.close()
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+
 def find_tokens_in_anno_block(
-    anno: Dict, page_token_data: List[Page]
+    anno: Dict, page_token_data: Sequence[Page]
 ) -> List[Tuple[int, int]]:
     """Given the annotated block, and page tokens, search for tokens within that block.
     Used for searching text from free-form annotations.
@@ -118,18 +146,22 @@ class COCOBuilder:
         ]
 
     def create_paper_data(
-        self, annotation_folder: AnnotationFolder, save_images: bool = True
+        self,
+        annotation_folder: AnnotationFolder,
+        save_images: bool = True,
+        workers: int = 1,
     ):
 
         _papers = []
         _images = []
+        # The pages whose image is missing, for each pdf.
+        missing_images = {}
         pbar = tqdm(annotation_folder.all_pdf_paths)
         for pdf_path in pbar:
             paper_sha = get_pdf_sha(pdf_path)
             pbar.set_description(f"Working on {paper_sha[:10]}...")
 
             num_pages, page_sizes = get_pdf_pages_and_sizes(pdf_path)
-            pdf_page_images = convert_from_path(pdf_path)
 
             # Add paper information
             paper_id = len(_papers)  # Start from zero
@@ -157,11 +189,10 @@ class COCOBuilder:
                         page_number=page_id,
                     )._asdict()
                 )
-                if save_images and not os.path.exists(
-                    f"{self.save_path_image}/{image_filename}"
-                ):
-                    pdf_page_images[page_id].resize((width, height)).save(
-                        f"{self.save_path_image}/{image_filename}"
+                image_path = f"{self.save_path_image}/{image_filename}"
+                if save_images and not os.path.exists(image_path):
+                    missing_images.setdefault(pdf_path, []).append(
+                        (page_id, (width, height), image_path)
                     )
 
             _papers.append(paper_info._asdict())
@@ -170,6 +201,32 @@ class COCOBuilder:
         self._papers = _papers
         self._images = _images
 
+        self.render_images(missing_images, workers)
+
+    def render_images(
+        self, missing_images: Dict[str, List[PageImage]], workers: int = 1
+    ) -> None:
+        """Render the missing page images of each pdf, with a process per pdf
+        when there are several workers."""
+        if len(missing_images) == 0:
+            return
+
+        pbar = tqdm(total=len(missing_images), desc="Rendering images")
+        if workers == 1:
+            for pdf_path, page_images in missing_images.items():
+                render_page_images(pdf_path, page_images)
+                pbar.update()
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(render_page_images, pdf_path, page_images)
+                    for pdf_path, page_images in missing_images.items()
+                ]
+                for future in as_completed(futures):
+                    future.result()
+                    pbar.update()
+        pbar.close()
+
     def create_annotation_for_annotator(self, anno_files: AnnotationFiles) -> None:
         """Create the annotations for the given annotation files"""
 
@@ -181,7 +238,7 @@ class COCOBuilder:
             paper_sha = anno_file["paper_sha"]
 
             pbar.set_description(f"Working on {paper_sha[:10]}...")
-            pawls_annotations = load_json(anno_file["annotation_path"])["annotations"]
+            pawls_annotations = load_annotations(anno_file["annotation_path"])["annotations"]
 
             for anno in pawls_annotations:
                 page_id = anno["page"]
@@ -245,16 +302,21 @@ class TokenTableBuilder:
         all_page_token_data = {}
 
         for pdf in annotation_folder.all_pdfs:
+            # The pages are loaded lazily: only the page being converted is held
+            # in memory here, and the pages of free-form annotations are loaded
+            # again when they are looked up.
             all_page_tokens = annotation_folder.get_pdf_tokens(pdf)
             # Get page token data
             page_token_dfs = []
             for page_tokens in all_page_tokens:
-                token_data = [
-                    (page_tokens.page.index, idx, token.text, *token.coordinates)
-                    for idx, token in enumerate(page_tokens.tokens)
-                ]
-                df = pd.DataFrame(token_data, columns=["page_index", "index", "text", "x1", "y1", "x2", "y2"])
-                df = df.set_index(["page_index", "index"])
+                # The tokens are array-backed, so the columns are built at once.
+                tokens = page_tokens.tokens
+                df = pd.DataFrame(tokens.bounds, columns=["x1", "y1", "x2", "y2"])
+                df.insert(0, "text", tokens.texts)
+                df.index = pd.MultiIndex.from_arrays(
+                    [np.full(len(tokens), page_tokens.page.index), np.arange(len(tokens))],
+                    names=["page_index", "index"],
+                )
                 page_token_dfs.append(df)
 
             page_token_dfs = pd.concat(page_token_dfs)
@@ -279,7 +341,7 @@ class TokenTableBuilder:
             df = self.all_page_token_df[paper_sha]
             page_token_data = self.all_page_token_data[paper_sha]
 
-            pawls_annotations = load_json(anno_file["annotation_path"])["annotations"]
+            pawls_annotations = load_annotations(anno_file["annotation_path"])["annotations"]
             for anno in pawls_annotations:
 
                 # Skip if current category is not in the specified categories
@@ -352,6 +414,13 @@ class TokenTableBuilder:
     default=True,
     help="A flag to not to export images of PDFs",
 )
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes to render the images of pdfs with (coco only).",
+)
 def export(
     path: click.Path,
     config: click.File,
@@ -362,6 +431,7 @@ def export(
     pdf_shas: List,
     include_unfinished: bool = False,
     export_images: bool = True,
+    workers: int = 1,
 ):
     """
     Export the COCO annotations for an annotation project.
@@ -374,6 +444,10 @@ def export(
 
     To export all annotations of from a given annotator, use:
         `pawls export <labeling_folder> <labeling_config> <output_path> -u markn --include-unfinished`.
+
+    Page images are only rendered when they don't already exist in the output path. To
+    render the images of several pdfs at once, e.g. with 8 processes, use:
+        `pawls export <labeling_folder> <labeling_config> <output_path> coco --workers 8`.
     """
 
     assert (
@@ -405,7 +479,9 @@ def export(
 
         coco_builder = COCOBuilder(categories, output)
         print(f"Creating paper data for annotation folder {annotation_folder.path}")
-        coco_builder.create_paper_data(annotation_folder, save_images=export_images)
+        coco_builder.create_paper_data(
+            annotation_folder, save_images=export_images, workers=workers
+        )
 
         for annotator in all_annotators:
             print(f"Export annotations from annotators {annotator}")
@@ -0,0 +1,78 @@
+import os
+from glob import glob
+from typing import Dict, Any
+
+import click
+
+from pawls.commands.utils import (
+    STATUS_DB_NAME,
+    STATUS_FIELDS,
+    load_json,
+    connect_status_db,
+    has_status_db,
+)
+
+
+def _default_status(sha: str) -> Dict[str, Any]:
+    return {
+        "sha": sha,
+        "name": sha,
+        "annotations": 0,
+        "relations": 0,
+        "finished": False,
+        "junk": False,
+        "comments": "",
+        "completedAt": None,
+    }
+
+
+@click.command(context_settings={"help_option_names": ["--help", "-h"]})
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    help="Overwrite statuses which are already present in the database.",
+)
+def migrate_status(path: click.Path, overwrite: bool = False):
+    """
+    Import the status/<annotator>.json files of a pawls project into
+    a SQLite status database, `<path>/status.db`.
+
+    To serve the project using the database, set `"status_backend": "sqlite"`
+    in the API configuration file. Once the database exists, the other pawls
+    commands read and write the annotation status from it as well.
+
+        `pawls migrate-status <labeling_folder>`
+    """
+    if has_status_db(path) and not overwrite:
+        print(
+            f"{STATUS_DB_NAME} already exists in {path}, "
+            "only statuses missing from it will be imported."
+        )
+
+    status_files = sorted(glob(os.path.join(path, "status", "*.json")))
+    insert = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+    query = (
+        f"{insert} INTO status (user, {', '.join(STATUS_FIELDS)}) "
+        f"VALUES (?, {', '.join('?' * len(STATUS_FIELDS))})"
+    )
+
+    connection = connect_status_db(path)
+    total = 0
+    with connection:
+        for status_file in status_files:
+            annotator = os.path.splitext(os.path.basename(status_file))[0]
+            pdf_status = load_json(status_file)
+            rows = []
+            for sha, status in pdf_status.items():
+                # Older status files may be missing some of the fields.
+                status = {**_default_status(sha), **status}
+                rows.append([annotator] + [status[field] for field in STATUS_FIELDS])
+            connection.executemany(query, rows)
+            total += len(pdf_status)
+    connection.close()
+
+    print(
+        f"Imported {total} statuses of {len(status_files)} annotators "
+        f"into {os.path.join(path, STATUS_DB_NAME)}."
+    )
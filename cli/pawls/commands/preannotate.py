@@ -2,13 +2,13 @@ import os
 import json
 import logging
 from glob import glob
-from typing import List, NamedTuple, Union, Dict, Iterable, Any, Optional
+from typing import List, NamedTuple, Union, Dict, Iterable, Any, Optional, Sequence
 
 import click
 from tqdm import tqdm
 
 from pawls.commands.utils import LabelingConfiguration, load_json, AnnotationFolder
-from pawls.preprocessors.model import Page, Block, PageInfo, union_boxes
+from pawls.preprocessors.model import Page, Block, PageInfo
 
 logger = logging.getLogger(__name__)
 
@@ -92,11 +92,11 @@ class ModelPredictions:
         ]
 
 
-def find_token_data(all_token_data: List[Page], index: int) -> Optional[Page]:
+def find_token_data(all_token_data: Sequence[Page], index: int) -> Optional[Page]:
     """Find the token_data with the given page index.
 
     Args:
-        all_token_data (List[Page]):
+        all_token_data (Sequence[Page]):
             A list of Page, contating the token data.
         index (int):
             The index of the target page.
@@ -106,6 +106,11 @@ def find_token_data(all_token_data: List[Page], index: int) -> Optional[Page]:
             Return the Page with the designated index when found.
             Otherwise return None.
     """
+    # Pages are usually stored in order, so try that page before searching,
+    # which would load every page of a lazily loaded pdf_structure.
+    if 0 <= index < len(all_token_data) and all_token_data[index].page.index == index:
+        return all_token_data[index]
+
     for token_data in all_token_data:
         if token_data.page.index == index:
             return token_data
@@ -214,12 +219,12 @@ def preannotate(
 
                     # Rectify the block based on the contained tokens
                     if len(contained_tokens) >= 1:
-                        rectified_block = union_boxes(contained_tokens)
+                        rectified_block = page_tokens.tokens.union(list(token_indices))
                     else:
                         # Sometimes a valid block does not include any tokens (e.g., figure).
                         # So we just use the block itself as the rectified_block.
-                        rectified_block = block.copy()
-                    rectified_block.pad(**PADDING_FOR_RECTIFYING_BLOCK_BOX)
+                        rectified_block = block
+                    rectified_block = rectified_block.padded(**PADDING_FOR_RECTIFYING_BLOCK_BOX)
 
                     annotation_file.add_annotation(
                         page_index=page_index,
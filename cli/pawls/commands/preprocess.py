@@ -1,32 +1,346 @@
 import os
 from pathlib import Path
-import json
+from typing import List, Tuple, Optional, Iterator, Dict, Any
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import traceback
 
 from tqdm import tqdm
 import click
 import glob
 
-from pawls.preprocessors.grobid import process_grobid
+from pawls.preprocessors.grobid import process_grobid, MAX_CONCURRENCY
 from pawls.preprocessors.pdfplumber import process_pdfplumber
-from pawls.preprocessors.tesseract import process_tesseract
+from pawls.preprocessors.tesseract import process_tesseract, DEFAULT_DPI
+from pawls.preprocessors.hybrid import process_hybrid
+from pawls.preprocessors.geometry import read_pdf_page_sizes
+from pawls.preprocessors.storage import (
+    PDF_STRUCTURE_NAME,
+    write_pdf_structure,
+    load_pdf_structure_metadata,
+)
+from pawls.commands.catalog import update_catalog
+from pawls.commands.dataset import hash_pdf
+
+PREPROCESSORS = {
+    "grobid": process_grobid,
+    "pdfplumber": process_pdfplumber,
+    "ocr": process_tesseract,
+    "auto": process_hybrid,
+}
+
+# The preprocessors which can process the pages of a single pdf in parallel.
+PAGE_PARALLEL_PREPROCESSORS = {"pdfplumber", "ocr", "auto"}
+
+# The preprocessors which OCR (some) pages with tesseract.
+OCR_PREPROCESSORS = {"ocr", "auto"}
+
+# The preprocessors which take the page sizes of the pdf, so that they
+# don't read them again after `process_pdf` has.
+PAGE_SIZE_PREPROCESSORS = {"ocr"}
+
+# The preprocessors which spend their time waiting on a service rather than
+# the cpu, so that pdfs are better processed concurrently with threads.
+CONCURRENT_PREPROCESSORS = {"grobid"}
+
+# The version of the output of each preprocessor. Bump it when a change to
+# a preprocessor changes its output, so that `pawls preprocess` re-runs it
+# on pdfs which were processed by the previous version.
+PREPROCESSOR_VERSIONS = {
+    "grobid": "1",
+    "pdfplumber": "1",
+    "ocr": "2",
+    "auto": "2",
+}
+
+# The parameters of each preprocessor which change its output, and their
+# defaults. They are passed to the preprocessor, and recorded in the manifest.
+PREPROCESSOR_PARAMS = {
+    "grobid": {},
+    "pdfplumber": {},
+    "ocr": {"dpi": DEFAULT_DPI, "scores": False},
+    "auto": {"dpi": DEFAULT_DPI, "scores": False},
+}
+
+# The result of preprocessing a pdf: its path, and the traceback
+# of the error which occurred, or None if it was processed successfully.
+Result = Tuple[str, Optional[str]]
+
+
+def create_manifest(
+    preprocessor: str, pdf: str, params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Record the pdf and the preprocessor which an output is produced from.
+
+    The size and modification time of the pdf are recorded as well, so that
+    unchanged pdfs can be recognized without hashing them again.
+    """
+    stat = os.stat(pdf)
+    return {
+        "pdf_sha256": hash_pdf(pdf),
+        "pdf_size": stat.st_size,
+        "pdf_mtime_ns": stat.st_mtime_ns,
+        "preprocessor": preprocessor,
+        "version": PREPROCESSOR_VERSIONS[preprocessor],
+        "params": params,
+    }
+
+
+def is_up_to_date(preprocessor: str, pdf: str, params: Dict[str, Any]) -> bool:
+    """Check whether the token information of a pdf was produced by the current
+    version of a preprocessor, from the current content of the pdf."""
+    pdf_directory = os.path.dirname(pdf)
+    manifest = load_pdf_structure_metadata(pdf_directory).get("manifest")
+    if manifest is None or not os.path.exists(
+        os.path.join(pdf_directory, PDF_STRUCTURE_NAME)
+    ):
+        return False
+
+    if (manifest["preprocessor"], manifest["version"], manifest["params"]) != (
+        preprocessor,
+        PREPROCESSOR_VERSIONS[preprocessor],
+        params,
+    ):
+        return False
+
+    stat = os.stat(pdf)
+    if (stat.st_size, stat.st_mtime_ns) == (manifest["pdf_size"], manifest["pdf_mtime_ns"]):
+        return True
+
+    # The pdf was touched, but its content may still be the same.
+    return hash_pdf(pdf) == manifest["pdf_sha256"]
+
+
+def process_pdf(
+    preprocessor: str,
+    pdf: str,
+    page_workers: int = 1,
+    params: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Run a preprocessor on a pdf, and write the token information
+    next to it, along with the size of its pages."""
+    path = Path(pdf)
+    params = params or {}
+    manifest = create_manifest(preprocessor, str(path), params)
+    page_sizes = read_pdf_page_sizes(str(path))
+    kwargs = dict(params)
+    if page_workers > 1:
+        kwargs["workers"] = page_workers
+    if preprocessor in PAGE_SIZE_PREPROCESSORS:
+        kwargs["page_sizes"] = page_sizes
+    data = PREPROCESSORS[preprocessor](str(path), **kwargs)
+    write_pdf_structure(data, str(path.parent), manifest, page_sizes)
+
+
+def process_chunk(
+    preprocessor: str,
+    pdfs: List[str],
+    page_workers: int = 1,
+    params: Optional[Dict[str, Any]] = None,
+) -> List[Result]:
+    """Process a chunk of pdfs, in a worker process. Errors are reported
+    per pdf, so that one bad pdf doesn't fail the rest of its chunk."""
+    results = []
+    for pdf in pdfs:
+        try:
+            process_pdf(preprocessor, pdf, page_workers, params)
+            results.append((pdf, None))
+        except Exception:
+            results.append((pdf, traceback.format_exc()))
+    return results
+
+
+def process_isolated(
+    preprocessor: str,
+    pdf: str,
+    page_workers: int = 1,
+    params: Optional[Dict[str, Any]] = None,
+) -> Result:
+    """Process a single pdf in a process of its own, so that
+    if the process crashes, only this pdf fails."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            future = executor.submit(
+                process_chunk, preprocessor, [pdf], page_workers, params
+            )
+            return future.result()[0]
+        except BrokenProcessPool:
+            return pdf, "The worker process crashed while processing this pdf.\n"
+
+
+def process_in_parallel(
+    preprocessor: str,
+    pdfs: List[str],
+    workers: int,
+    chunk_size: int,
+    page_workers: int = 1,
+    params: Optional[Dict[str, Any]] = None,
+) -> Iterator[Result]:
+    """Process pdfs with a pool of worker processes, yielding the result
+    of each pdf as soon as its chunk has been processed."""
+    chunks = [pdfs[i : i + chunk_size] for i in range(0, len(pdfs), chunk_size)]
+
+    crashed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                process_chunk, preprocessor, chunk, page_workers, params
+            ): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except BrokenProcessPool:
+                crashed.extend(futures[future])
+
+    # A worker which crashes (rather than raising an exception) breaks the whole
+    # pool, so the pdfs which weren't finished are retried one per process.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(
+            lambda pdf: process_isolated(preprocessor, pdf, page_workers, params),
+            crashed,
+        )
+
+
+def process_concurrently(
+    preprocessor: str,
+    pdfs: List[str],
+    concurrency: int,
+    params: Optional[Dict[str, Any]] = None,
+) -> Iterator[Result]:
+    """Process pdfs with a pool of threads, keeping up to `concurrency` pdfs
+    in flight at once, and yielding the result of each pdf as soon as it's done."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(process_chunk, preprocessor, [pdf], 1, params)
+            for pdf in pdfs
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
 
 @click.command(context_settings={"help_option_names": ["--help", "-h"]})
-@click.argument("preprocessor", type=str)
+@click.argument("preprocessor", type=click.Choice(list(PREPROCESSORS)))
 @click.argument("path", type=click.Path(exists=True, file_okay=True, dir_okay=True))
-def preprocess(preprocessor: str, path: click.Path):
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes to preprocess pdfs with.",
+)
+@click.option(
+    "--page-workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes to process the pages of each pdf with "
+    "(pdfplumber, ocr and auto only).",
+)
+@click.option(
+    "--concurrency",
+    "-c",
+    type=click.IntRange(min=1, max=MAX_CONCURRENCY),
+    default=1,
+    help="The number of requests to have in flight at once (grobid only).",
+)
+@click.option(
+    "--dpi",
+    type=click.IntRange(min=1),
+    default=None,
+    help=f"The resolution to rasterize pages at for OCR (default {DEFAULT_DPI}).",
+)
+@click.option(
+    "--scores",
+    is_flag=True,
+    help="Record the confidence of tesseract in each OCRed token (ocr and auto only).",
+)
+@click.option(
+    "--force",
+    "-f",
+    is_flag=True,
+    help="Re-process pdfs which are already up to date.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The number of pdfs sent to a worker process at a time. "
+    "By default, each worker gets about four chunks.",
+)
+def preprocess(
+    preprocessor: str,
+    path: click.Path,
+    workers: int,
+    page_workers: int,
+    concurrency: int,
+    dpi: int,
+    scores: bool,
+    force: bool,
+    chunk_size: int,
+):
     """
     Run a pre-processor on a pdf/directory of pawls pdfs and
     write the resulting token information to the pdf location.
 
-    Current preprocessor options are: "grobid".
+    Current preprocessor options are: "grobid", "pdfplumber", "ocr" and "auto".
+    The "auto" preprocessor uses pdfplumber, and OCRs only the pages which have
+    no usable text layer, such as scanned pages.
 
     To send all pawls structured pdfs in the current directory for processing:
 
         `pawls preprocess grobid ./`
+
+    To process pdfs in parallel, with 8 worker processes:
+
+        `pawls preprocess pdfplumber ./ --workers 8`
+
+    A few large pdfs are better split by page, with each of their pages
+    sharded across worker processes:
+
+        `pawls preprocess ocr ./report.pdf --page-workers 8`
+
+    Grobid does the work of the grobid preprocessor, so rather than with worker
+    processes, pdfs are sent to it several at a time:
+
+        `pawls preprocess grobid ./ --concurrency 8`
+
+    A pdf which fails to process doesn't stop the others from being processed;
+    the failures are listed at the end.
+
+    The pdf and preprocessor which produced the token information of each pdf
+    are recorded in its pdf_structure.meta.json. Pdfs which haven't changed since
+    they were processed by the same version of the preprocessor are skipped, so an
+    interrupted run can be resumed by running the same command again. Use
+    `--force` to process every pdf regardless.
     """
+    if page_workers > 1 and preprocessor not in PAGE_PARALLEL_PREPROCESSORS:
+        raise click.UsageError(
+            f"The {preprocessor} preprocessor can't process pages in parallel."
+        )
+    if concurrency > 1 and preprocessor not in CONCURRENT_PREPROCESSORS:
+        raise click.UsageError(
+            f"--concurrency doesn't apply to the {preprocessor} preprocessor."
+        )
+    if concurrency > 1 and workers > 1:
+        raise click.UsageError("Use either --concurrency or --workers, not both.")
+    if dpi is not None and preprocessor not in OCR_PREPROCESSORS:
+        raise click.UsageError("--dpi only applies to the ocr and auto preprocessors.")
+    if scores and preprocessor not in OCR_PREPROCESSORS:
+        raise click.UsageError("--scores only applies to the ocr and auto preprocessors.")
+
+    params = dict(PREPROCESSOR_PARAMS[preprocessor])
+    if dpi is not None:
+        params["dpi"] = dpi
+    if scores:
+        params["scores"] = True
+
     print(f"Processing using the {preprocessor} preprocessor...")
-    if preprocessor == "ocr":
-        print("The ocr preprocessor may take several minutes to process each PDF.")
+    if preprocessor in OCR_PREPROCESSORS:
+        print(
+            f"The {preprocessor} preprocessor may take several minutes "
+            "to process each PDF."
+        )
     if os.path.isdir(path):
         in_glob = os.path.join(path, "*/*.pdf")
         pdfs = glob.glob(in_glob)
@@ -35,20 +349,46 @@ def preprocess(preprocessor: str, path: click.Path):
             raise ValueError("Path is not a directory, but also not a pdf.")
         pdfs = [str(path)]
 
-    pbar = tqdm(pdfs)
+    if not force:
+        num_pdfs = len(pdfs)
+        pdfs = [pdf for pdf in pdfs if not is_up_to_date(preprocessor, pdf, params)]
+        if len(pdfs) < num_pdfs:
+            print(
+                f"Skipping {num_pdfs - len(pdfs)} pdfs which are up to date. "
+                "Use --force to process them again."
+            )
+
+    if concurrency > 1 and len(pdfs) > 1:
+        results = process_concurrently(preprocessor, pdfs, concurrency, params)
+    elif workers > 1 and len(pdfs) > 1:
+        if chunk_size is None:
+            chunk_size = max(1, len(pdfs) // (workers * 4))
+        results = process_in_parallel(
+            preprocessor, pdfs, workers, chunk_size, page_workers, params
+        )
+    else:
+        results = (
+            process_chunk(preprocessor, [pdf], page_workers, params)[0]
+            for pdf in pdfs
+        )
 
-    for p in pbar:
-        path = Path(p)
-        sha = path.name.strip(".pdf")
-        pbar.set_description(f"Processing {sha[:10]}...")
-        if preprocessor == "grobid":
-            data = process_grobid(str(path))
-        elif preprocessor == "pdfplumber":
-            data = process_pdfplumber(str(path))
-        elif preprocessor == "ocr":
-            # Currently there's only a OCR preprocessor. 
-            data = process_tesseract(str(path))
-        with open(path.parent / "pdf_structure.json", "w+") as f:
+    processed = {}
+    failed = []
+    with tqdm(total=len(pdfs)) as pbar:
+        for pdf, error in results:
+            path = Path(pdf)
+            pbar.update(1)
+            pbar.set_description(f"Processed {path.parent.name[:10]}...")
+            if error is not None:
+                tqdm.write(f"Failed to process {pdf}:\n{error}")
+                failed.append(pdf)
+                continue
+            processed.setdefault(str(path.parent.parent), []).append(path.parent.name)
 
-            json.dump(data, f)
+    for labeling_folder, shas in processed.items():
+        update_catalog(labeling_folder, shas)
 
+    if failed:
+        raise click.ClickException(
+            f"Failed to process {len(failed)} of {len(pdfs)} pdfs:\n" + "\n".join(failed)
+        )
@@ -1,29 +1,28 @@
-import os
-from glob import glob
 import click
 from typing import Tuple
 
 import pandas as pd
 from tabulate import tabulate
 
-from pawls.commands.utils import load_json, get_pdf_pages_and_sizes
+from pawls.commands.utils import load_all_annotator_status, get_pdf_pages_and_sizes
+from pawls.commands.catalog import load_catalog
 
 
 def get_labeling_status(target_dir: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
-    all_json_records = glob(f"{target_dir}/status/*.json")
-
     all_record = []
-    for record in all_json_records:
-        name = os.path.splitext(os.path.basename(record))[0]
-        all_annotations = load_json(record)
+    for name, all_annotations in load_all_annotator_status(target_dir).items():
         cur_record = pd.DataFrame(all_annotations).T
         cur_record["annotator"] = name
         all_record.append(cur_record)
 
     all_record = pd.concat(all_record)
+    # The page counts are recorded in the catalog,
+    # so pdfs only need to be read if they are missing from it.
+    catalog = load_catalog(target_dir)
     pdf_pages = {
-        sha: get_pdf_pages_and_sizes(f"{target_dir}/{sha}/{sha}.pdf")[0]
+        sha: catalog.get(sha, {}).get("pages")
+        or get_pdf_pages_and_sizes(f"{target_dir}/{sha}/{sha}.pdf")[0]
         for sha in set(all_record.index)
     }
     all_record = all_record.reset_index()
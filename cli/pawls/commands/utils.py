@@ -1,43 +1,236 @@
 import json
-from typing import List, Dict, Iterable
+from typing import List, Dict, Iterable, Optional, Any
 from glob import glob
 import os
 import uuid
+import sqlite3
 
 import click
-from pdfminer.pdfparser import PDFParser
-from pdfminer.pdfdocument import PDFDocument
-from pdfminer.pdfpage import PDFPage
-from pdfminer.pdfinterp import resolve1
-
-from pawls.preprocessors.model import load_tokens_from_file
+from pawls.preprocessors.storage import PdfStructure
+from pawls.preprocessors.geometry import get_pdf_page_sizes
+from pawls.commands.catalog import load_catalog
 
 
 DEVELOPMENT_USER = "development_user@example.com"
 
+# The SQLite status store used by the API when its `status_backend` is "sqlite".
+# When this database exists in a labeling folder, it is the source of truth
+# for the annotation status, rather than the status/<annotator>.json files.
+STATUS_DB_NAME = "status.db"
+STATUS_FIELDS = [
+    "sha",
+    "name",
+    "annotations",
+    "relations",
+    "finished",
+    "junk",
+    "comments",
+    "completedAt",
+]
+
+# Must match STATUS_DB_SCHEMA in api/app/status.py, which creates the same database
+# (test_status_db_schema_matches_cli checks that they do).
+STATUS_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS status (
+    user TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    name TEXT NOT NULL,
+    annotations INTEGER NOT NULL DEFAULT 0,
+    relations INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    junk INTEGER NOT NULL DEFAULT 0,
+    comments TEXT NOT NULL DEFAULT '',
+    completedAt TEXT,
+    PRIMARY KEY (user, sha)
+)
+"""
+
 
 def load_json(filename: str):
     with open(filename, "r") as fp:
         return json.load(fp)
 
 
+def _apply_annotation_delta(pdf_annotations: Dict[str, List], delta: Dict[str, Any]):
+    """Apply a change saved by the API to the annotations of a pdf in place.
+
+    This must stay in sync with `apply_delta` in api/app/journal.py, which the
+    cli can't import. Both are tested against the journal in
+    test/fixtures/journal, which was written by the API.
+    """
+    annotations = pdf_annotations["annotations"]
+    annotation_changes = delta.get("annotations", {})
+    positions = {annotation["id"]: i for i, annotation in enumerate(annotations)}
+    for annotation in annotation_changes.get("added", []) + annotation_changes.get(
+        "updated", []
+    ):
+        position = positions.get(annotation["id"])
+        if position is None:
+            positions[annotation["id"]] = len(annotations)
+            annotations.append(annotation)
+        else:
+            annotations[position] = annotation
+
+    deleted = set(annotation_changes.get("deleted", []))
+    if deleted:
+        annotations[:] = [a for a in annotations if a["id"] not in deleted]
+
+    relations = pdf_annotations["relations"]
+    relation_changes = delta.get("relations", {})
+    relations.extend(relation_changes.get("added", []))
+    for relation in relation_changes.get("deleted", []):
+        if relation in relations:
+            relations.remove(relation)
+
+
+def get_annotation_journal_path(annotation_path: str) -> str:
+    return os.path.splitext(annotation_path)[0] + ".journal"
+
+
+def load_annotations(annotation_path: str) -> Dict[str, List]:
+    """Load a `<annotator>_annotations.json` file, including the changes
+    which the API has saved to its journal but not compacted into it yet.
+    """
+    pdf_annotations = {"annotations": [], "relations": []}
+    if os.path.exists(annotation_path):
+        pdf_annotations = load_json(annotation_path)
+
+    journal_path = get_annotation_journal_path(annotation_path)
+    if os.path.exists(journal_path):
+        with open(journal_path, "r") as fp:
+            for line in fp:
+                if not line.endswith("\n"):
+                    break
+                _apply_annotation_delta(pdf_annotations, json.loads(line))
+
+    return pdf_annotations
+
+
 def get_pdf_pages_and_sizes(filename: str):
-    """Ref https://stackoverflow.com/a/47686921"""
-    with open(filename, "rb") as fp:
-        parser = PDFParser(fp)
-        document = PDFDocument(parser)
-        num_pages = resolve1(document.catalog["Pages"])["Count"]
-        page_sizes = [
-            (int(page.mediabox[2]), int(page.mediabox[3]))
-            for page in PDFPage.create_pages(document)
-        ]
-        return num_pages, page_sizes
+    """The number of pages of a pdf and the size of each of them. They are read
+    from the cache written by `pawls preprocess`, and only read from the pdf
+    itself if it hasn't been preprocessed (see `pawls.preprocessors.geometry`)."""
+    page_sizes = get_pdf_page_sizes(filename)
+    return len(page_sizes), page_sizes
 
 
 def get_pdf_sha(pdf_file_name: str) -> str:
     return os.path.basename(pdf_file_name).replace(".pdf", "")
 
 
+def connect_status_db(labeling_folder: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        os.path.join(labeling_folder, STATUS_DB_NAME), timeout=30
+    )
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    with connection:
+        connection.execute(STATUS_DB_SCHEMA)
+    return connection
+
+
+def has_status_db(labeling_folder: str) -> bool:
+    return os.path.exists(os.path.join(labeling_folder, STATUS_DB_NAME))
+
+
+def _status_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    status = {field: row[field] for field in STATUS_FIELDS}
+    status["finished"] = bool(status["finished"])
+    status["junk"] = bool(status["junk"])
+    return status
+
+
+def list_annotators(labeling_folder: str) -> List[str]:
+    """List the annotators which have been assigned pdfs in a labeling folder."""
+    if has_status_db(labeling_folder):
+        connection = connect_status_db(labeling_folder)
+        annotators = [
+            row["user"] for row in connection.execute("SELECT DISTINCT user FROM status")
+        ]
+        connection.close()
+        return annotators
+
+    return [
+        os.path.splitext(e)[0] for e in os.listdir(f"{labeling_folder}/status")
+    ]
+
+
+def load_all_annotator_status(labeling_folder: str) -> Dict[str, Dict[str, Dict]]:
+    """Load the status of the assigned pdfs of every annotator in a labeling folder.
+
+    Returns:
+        Dict[str, Dict[str, Dict]]:
+            A dictionary of annotator to their status, which maps each assigned
+            pdf sha to its status.
+    """
+    all_status = {}
+    if has_status_db(labeling_folder):
+        connection = connect_status_db(labeling_folder)
+        for row in connection.execute("SELECT * FROM status ORDER BY user, sha"):
+            all_status.setdefault(row["user"], {})[row["sha"]] = _status_from_row(row)
+        connection.close()
+    else:
+        for record in glob(f"{labeling_folder}/status/*.json"):
+            annotator = os.path.splitext(os.path.basename(record))[0]
+            all_status[annotator] = load_json(record)
+    return all_status
+
+
+def load_annotator_status(labeling_folder: str, annotator: str) -> Optional[Dict[str, Dict]]:
+    """Load the status of the pdfs assigned to an annotator.
+
+    Returns:
+        Optional[Dict[str, Dict]]:
+            A dictionary mapping each assigned pdf sha to its status,
+            or None if the annotator has not been assigned any pdfs.
+    """
+    if has_status_db(labeling_folder):
+        connection = connect_status_db(labeling_folder)
+        rows = connection.execute(
+            "SELECT * FROM status WHERE user = ? ORDER BY sha", (annotator,)
+        ).fetchall()
+        connection.close()
+        if len(rows) == 0:
+            return None
+        return {row["sha"]: _status_from_row(row) for row in rows}
+
+    status_path = f"{labeling_folder}/status/{annotator}.json"
+    if not os.path.exists(status_path):
+        return None
+    return load_json(status_path)
+
+
+def add_annotator_status(
+    labeling_folder: str, annotator: str, pdf_status: Dict[str, Dict]
+) -> None:
+    """Store the status of pdfs assigned to an annotator.
+    The status of pdfs which were already assigned to the annotator is not modified.
+    """
+    if has_status_db(labeling_folder):
+        connection = connect_status_db(labeling_folder)
+        with connection:
+            connection.executemany(
+                f"INSERT OR IGNORE INTO status (user, {', '.join(STATUS_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' * len(STATUS_FIELDS))})",
+                [
+                    [annotator] + [status[field] for field in STATUS_FIELDS]
+                    for status in pdf_status.values()
+                ],
+            )
+        connection.close()
+        return
+
+    status_dir = os.path.join(labeling_folder, "status")
+    os.makedirs(status_dir, exist_ok=True)
+    status_path = os.path.join(status_dir, f"{annotator}.json")
+
+    all_status = load_annotator_status(labeling_folder, annotator) or {}
+    for sha, status in pdf_status.items():
+        all_status.setdefault(sha, status)
+    with open(status_path, "w+") as out:
+        json.dump(all_status, out)
+
+
 class LabelingConfiguration:
     def __init__(self, config: str):
         """LabelingConfiguration handles parsing the configuration file.
@@ -66,7 +259,9 @@ class AnnotationFolder:
     DEFAULT_PDF_STRUCTURE_NAME = "pdf_structure.json"
 
     def __init__(self, path:str, pdf_structure_name:str=None, pdf_shas: List[str] = None):
-        """
+        """The pdfs of an annotation folder are listed from its document catalog,
+        see `pawls.commands.catalog`.
+
         Args:
             path (str): path to the annotation folder.
             pdf_structure_name (str, optional):
@@ -80,11 +275,14 @@ class AnnotationFolder:
         self.path = path
         self.pdf_structure_name = pdf_structure_name or self.DEFAULT_PDF_STRUCTURE_NAME
 
-        self.all_pdf_paths = [pdf_path for pdf_path in glob(f"{self.path}/*/*.pdf")]
+        self.catalog = load_catalog(self.path)
         if pdf_shas is not None:
-            self.all_pdf_paths = [
-                ele for ele in self.all_pdf_paths if ele.split("/")[-2] in pdf_shas
-            ]
+            self.catalog = {
+                sha: document
+                for sha, document in self.catalog.items()
+                if sha in pdf_shas
+            }
+        self.all_pdf_paths = [f"{self.path}/{sha}/{sha}.pdf" for sha in self.catalog]
         self.all_pdfs = [os.path.basename(pdf_path) for pdf_path in self.all_pdf_paths]
 
     @property
@@ -93,12 +291,12 @@ class AnnotationFolder:
         including the default DEVELOPMENT_USER.
         """
 
-        return set([DEVELOPMENT_USER] + [
-            os.path.splitext(e)[0] for e in os.listdir(f"{self.path}/status")
-        ]) # The DEVELOPMENT_USER annotator might be duplicated 
+        return set([DEVELOPMENT_USER] + list_annotators(self.path))
+        # The DEVELOPMENT_USER annotator might be duplicated
 
-    def get_pdf_tokens(self, pdf_name: str) -> List["Page"]:
-        """Get the pdf tokens for a pdf name by loading from the corresponding pdf_structure file.
+    def get_pdf_tokens(self, pdf_name: str) -> PdfStructure:
+        """Get the pdf tokens for a pdf name from the corresponding pdf_structure file.
+        The pages are loaded lazily, when they are accessed.
 
         Args:
             pdf_name (str): the name of the pdf file, e.g., xxx.pdf
@@ -108,14 +306,14 @@ class AnnotationFolder:
                 When the pdf_structure is not found for this pdf_name, raise a FileNotFoundError.
 
         Returns:
-            str: the pdf_structure file path for this pdf file.
+            PdfStructure: the lazily loaded pages of the pdf_structure file.
         """
 
         sha = get_pdf_sha(pdf_name)
         pdf_structure_path = f"{self.path}/{sha}/{self.pdf_structure_name}"
 
         if os.path.exists(pdf_structure_path):
-            return load_tokens_from_file(pdf_structure_path)
+            return PdfStructure(pdf_structure_path)
         else:
             raise FileNotFoundError(
                 f"pdf_structure is not found for {sha}.Did you forget run the following command?\n    pawls preprocess <processor-name> {self.path}/{sha}/{pdf_name}"
@@ -197,6 +395,11 @@ class AnnotationFile:
         with open(self.filepath, "w") as fp:
             json.dump(self.data, fp)
 
+        # The saved annotations replace any changes journaled by the API.
+        journal_path = get_annotation_journal_path(self.filepath)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
 
 class AnnotationFiles:
     def __init__(
@@ -251,15 +454,14 @@ class AnnotationFiles:
 
     def get_finished_annotation_files(self) -> List[str]:
 
-        user_assignment_file = f"{self.labeling_folder}/status/{self.annotator}.json"
-        if not os.path.exists(user_assignment_file):
+        user_assignment = load_annotator_status(self.labeling_folder, self.annotator)
+        if user_assignment is None:
             print(
                 "Warning:",
-                f"The user annotation file does not exist: {user_assignment_file}",
+                f"The user annotation status does not exist for {self.annotator}",
             )
             return self.get_all_annotation_files()
 
-        user_assignment = load_json(user_assignment_file)
         return [
             f"{self.labeling_folder}/{pdf_sha}/{self.annotator}_annotations.json"
             for pdf_sha, assignment in user_assignment.items()
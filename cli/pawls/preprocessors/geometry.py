@@ -0,0 +1,78 @@
+import os
+from typing import List, Tuple, Optional
+
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
+
+from pawls.preprocessors.storage import load_pdf_structure_metadata
+
+# The size of each page of a pdf, as the (truncated) right and top of its MediaBox.
+PageSizes = List[Tuple[int, int]]
+
+
+def _walk_page_tree(document: PDFDocument) -> PageSizes:
+    # Reads nothing but the /Kids and /MediaBox of the nodes of the page tree,
+    # rather than every attribute of each page like PDFPage.create_pages.
+    page_sizes = []
+    stack = [(document.catalog["Pages"], None)]
+    visited = set()
+    while stack:
+        node_ref, mediabox = stack.pop()
+        node = resolve1(node_ref)
+        if id(node) in visited:
+            raise ValueError("The page tree has a cycle.")
+        visited.add(id(node))
+
+        mediabox = resolve1(node.get("MediaBox", mediabox))
+        kids = resolve1(node.get("Kids"))
+        if kids is None:
+            page_sizes.append((int(resolve1(mediabox[2])), int(resolve1(mediabox[3]))))
+        else:
+            stack.extend((kid, mediabox) for kid in reversed(kids))
+    return page_sizes
+
+
+def read_pdf_page_sizes(pdf_path: str) -> PageSizes:
+    """Read the size of every page of a pdf from its page tree.
+
+    Only the cross-reference table and the page tree are read. If the page tree
+    is broken, the pages are found the slower way pdfminer does.
+    """
+    with open(pdf_path, "rb") as fp:
+        document = PDFDocument(PDFParser(fp))
+        try:
+            return _walk_page_tree(document)
+        except Exception:
+            return [
+                (int(page.mediabox[2]), int(page.mediabox[3]))
+                for page in PDFPage.create_pages(document)
+            ]
+
+
+def load_cached_page_sizes(pdf_path: str) -> Optional[PageSizes]:
+    """Load the page sizes recorded when a pdf was preprocessed.
+
+    Returns None if the pdf hasn't been preprocessed since page sizes were
+    recorded, or if it has changed since.
+    """
+    metadata = load_pdf_structure_metadata(os.path.dirname(pdf_path))
+    page_sizes = metadata.get("page_sizes")
+    manifest = metadata.get("manifest")
+    if page_sizes is None or manifest is None:
+        return None
+
+    stat = os.stat(pdf_path)
+    if (stat.st_size, stat.st_mtime_ns) != (manifest["pdf_size"], manifest["pdf_mtime_ns"]):
+        return None
+    return [(width, height) for width, height in page_sizes]
+
+
+def get_pdf_page_sizes(pdf_path: str) -> PageSizes:
+    """The size of every page of a pdf, from the cache written by
+    `pawls preprocess` if it's current, or else read from the pdf."""
+    page_sizes = load_cached_page_sizes(pdf_path)
+    if page_sizes is None:
+        page_sizes = read_pdf_page_sizes(pdf_path)
+    return page_sizes
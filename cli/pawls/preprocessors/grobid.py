@@ -1,16 +1,77 @@
 import json
-from typing import List
+import time
+import random
+import threading
+from typing import List, Optional
 import requests
+from requests.adapters import HTTPAdapter
 
 from pawls.preprocessors.model import Page
 
+DEFAULT_GROBID_HOST = "http://localhost:8070"
 
-def fetch_grobid_structure(pdf_file: str, grobid_host: str = "http://localhost:8070"):
-    files = {
-        "input": (pdf_file, open(pdf_file, "rb"), "application/pdf", {"Expires": "0"})
-    }
+# The maximum number of requests kept in flight to grobid at once, each from
+# its own thread.
+MAX_CONCURRENCY = 32
+
+# Grobid responds with 503 when its queue of requests is full, in which case the
+# request is retried up to GROBID_RETRIES times. The delay before the n-th retry
+# is GROBID_BACKOFF * 2 ** n seconds (with jitter), unless grobid sends a
+# Retry-After header. Either way, it is at most MAX_RETRY_DELAY seconds.
+GROBID_RETRIES = 5
+GROBID_BACKOFF = 0.5
+MAX_RETRY_DELAY = 30.0
+
+
+_sessions = threading.local()
+
+
+def get_session() -> requests.Session:
+    """The HTTP session used by every request to grobid from the current
+    thread, so that its connection is re-used rather than opened for each pdf.
+    requests doesn't guarantee that a session can be used by several threads
+    at once, so each thread has its own."""
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        # A thread only has one request in flight at a time.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions.session = session
+    return session
+
+
+def retry_delay(response: requests.Response, retry: int, backoff: float) -> float:
+    """The number of seconds to wait before the retry-th retry of a request."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        delay = float(retry_after)
+    else:
+        delay = backoff * 2 ** retry * random.uniform(0.5, 1.0)
+    return min(delay, MAX_RETRY_DELAY)
+
+
+def fetch_grobid_structure(
+    pdf_file: str,
+    grobid_host: str = DEFAULT_GROBID_HOST,
+    retries: int = GROBID_RETRIES,
+    backoff: float = GROBID_BACKOFF,
+    session: Optional[requests.Session] = None,
+):
+    session = session or get_session()
+    # The pdf is read once, so that the same body can be sent again on retry.
+    with open(pdf_file, "rb") as f:
+        pdf = f.read()
     url = "{}/api/processPdfStructure".format(grobid_host)
-    resp = requests.post(url, files=files)
+
+    for retry in range(retries + 1):
+        files = {"input": (pdf_file, pdf, "application/pdf", {"Expires": "0"})}
+        resp = session.post(url, files=files)
+        if resp.status_code != 503 or retry == retries:
+            break
+        time.sleep(retry_delay(resp, retry, backoff))
+
     if resp.status_code == 200:
         return json.loads(resp.text)
     else:
@@ -43,15 +104,18 @@ def parse_annotations(grobid_structure) -> List[Page]:
 
     return pages
 
-def process_grobid(
-    pdf_file: str,
-    grobid_host: str = "http://localhost:8070"
-):
+
+def process_grobid(pdf_file: str, grobid_host: str = DEFAULT_GROBID_HOST):
     """
     Integration for importing annotations from grobid.
     Depends on a grobid API built from our fork https://github.com/allenai/grobid.
     Fetches a PDF by sha, sends it to the Grobid API and returns them.
 
+    Each thread re-uses its connection to grobid, and requests are retried with
+    exponential backoff while grobid is too busy to accept them (503), so this
+    can be called from several threads at once to keep several requests in
+    flight.
+
     pdf_file: str
         The path to the pdf file to process.
     grobid_host: str (optional, default="http://localhost:8070")
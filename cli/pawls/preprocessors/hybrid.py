@@ -0,0 +1,179 @@
+from typing import List, Dict, Optional, Tuple
+import re
+import functools
+import unicodedata
+
+import pdfplumber
+
+from pawls.preprocessors.model import Page
+from pawls.preprocessors.parallel import map_page_shards
+from pawls.preprocessors.pdfplumber import process_pdfplumber
+from pawls.preprocessors.tesseract import DEFAULT_DPI, ocr_page_range
+
+# A page whose text layer has fewer letters and digits than this is treated as
+# having none, e.g. a scanned page with only a stamped header or page number.
+# Such a page is only OCRed if images cover at least MIN_SCANNED_COVERAGE of it,
+# so that sparse born-digital pages (titles, figures, blank pages) are not.
+MIN_TEXT_CHARACTERS = 10
+MIN_SCANNED_COVERAGE = 0.5
+
+# The text layer of a page is treated as garbage if more than this fraction of its
+# characters are glyphs which the pdf doesn't map to unicode, or if fewer than
+# MIN_ALPHANUMERIC_RATIO of them are letters or digits, as happens with fonts
+# which use a custom encoding. Math symbols are left out of the ratio, so that
+# pages of equations aren't mistaken for garbage.
+MAX_UNMAPPED_RATIO = 0.1
+MIN_ALPHANUMERIC_RATIO = 0.5
+
+# pdfminer writes glyphs without a unicode mapping as "(cid:<glyph id>)".
+UNMAPPED_GLYPH = re.compile(r"\(cid:\d+\)")
+UNMAPPED_CATEGORIES = {"Co", "Cn", "Cc"}
+MATH_CATEGORY = "Sm"
+
+
+def text_layer_problem(tokens: List[Dict]) -> Optional[str]:
+    """Check whether the text layer extracted from a page is usable.
+
+    Args:
+        tokens (List[Dict]):
+            The tokens extracted from the page by pdfplumber.
+
+    Returns:
+        Optional[str]:
+            Why the page should be OCRed instead ("empty" or "garbage"),
+            or None if its text layer is usable.
+    """
+    characters = unmapped = alphanumeric = 0
+    for token in tokens:
+        text = token["text"]
+        num_glyphs = len(UNMAPPED_GLYPH.findall(text))
+        if num_glyphs:
+            text = UNMAPPED_GLYPH.sub("", text)
+        characters += num_glyphs + len(text)
+        unmapped += num_glyphs
+        for char in text:
+            if char.isalnum():
+                alphanumeric += 1
+                continue
+            category = unicodedata.category(char)
+            if category == MATH_CATEGORY:
+                characters -= 1
+            elif char == "\ufffd" or category in UNMAPPED_CATEGORIES:
+                unmapped += 1
+
+    if alphanumeric < MIN_TEXT_CHARACTERS and unmapped == 0:
+        return "empty"
+    if (
+        unmapped > MAX_UNMAPPED_RATIO * characters
+        or alphanumeric < MIN_ALPHANUMERIC_RATIO * characters
+    ):
+        return "garbage"
+    return None
+
+
+def image_coverage(pdf_file: str, page_ids: List[int]) -> Dict[int, float]:
+    """The fraction of the area of each of the given pages which is covered by
+    images (at most 1), as for a scanned page."""
+    coverage = {}
+    with pdfplumber.open(pdf_file) as pdf:
+        for page_id in page_ids:
+            page = pdf.pages[page_id]
+            x0, top, x1, bottom = page.bbox
+            area = 0.0
+            for image in page.images:
+                width = min(image["x1"], x1) - max(image["x0"], x0)
+                height = min(image["bottom"], bottom) - max(image["top"], top)
+                area += max(width, 0) * max(height, 0)
+            coverage[page_id] = min(area / ((x1 - x0) * (bottom - top)), 1.0)
+    return coverage
+
+
+def contiguous_ranges(page_ids: List[int]) -> List[range]:
+    """Group sorted page ids into ranges of consecutive pages,
+    which can each be rasterized in one go."""
+    ranges = []
+    for page_id in page_ids:
+        if ranges and ranges[-1].stop == page_id:
+            ranges[-1] = range(ranges[-1].start, page_id + 1)
+        else:
+            ranges.append(range(page_id, page_id + 1))
+    return ranges
+
+
+def _ocr_pages(
+    pdf_file: str,
+    shard: range,
+    page_ids: List[int],
+    pdf_sizes: List[Tuple[float, float]],
+    dpi: int = DEFAULT_DPI,
+    scores: bool = False,
+) -> List[Page]:
+    # OCRs a shard of the (not necessarily consecutive) pages in page_ids.
+    pages = []
+    for page_range in contiguous_ranges(page_ids[shard.start : shard.stop]):
+        pages.extend(ocr_page_range(pdf_file, page_range, pdf_sizes, dpi, scores))
+    return pages
+
+
+def process_hybrid(
+    pdf_file: str, workers: int = 1, dpi: int = DEFAULT_DPI, scores: bool = False
+):
+    """
+    Integration for importing annotations from pdfplumber, falling back to OCR
+    with tesseract for the pages which have no usable text layer, such as
+    scanned pages.
+
+    Pages are OCRed if their text layer is garbage, or if they have (almost) no
+    text and are mostly covered by images. The preprocessor of each page is
+    recorded in its "provenance", along with the reason why it was OCRed.
+
+    pdf_file: str
+        The path to the pdf file to process.
+    workers: int
+        The number of processes to process the pages of the pdf with.
+    dpi: int
+        The resolution to rasterize the pages which are OCRed at.
+    scores: bool
+        Whether to record the confidence of tesseract in each OCRed token as its "score".
+    """
+    pages = process_pdfplumber(pdf_file, workers=workers)
+
+    problems = [text_layer_problem(page["tokens"]) for page in pages]
+    empty_page_ids = [i for i, problem in enumerate(problems) if problem == "empty"]
+    if empty_page_ids:
+        coverage = image_coverage(pdf_file, empty_page_ids)
+        for page_id in empty_page_ids:
+            if coverage[page_id] < MIN_SCANNED_COVERAGE:
+                # A page with little text, which isn't scanned either.
+                problems[page_id] = None
+
+    ocr_page_ids = []
+    for page, problem in zip(pages, problems):
+        if problem is None:
+            page["provenance"] = {"preprocessor": "pdfplumber"}
+        else:
+            page["provenance"] = {"preprocessor": "ocr", "reason": problem}
+            ocr_page_ids.append(page["page"]["index"])
+
+    if len(ocr_page_ids) == 0:
+        return pages
+
+    # The OCRed tokens are scaled to the page sizes found by pdfplumber,
+    # so that every page of the merged output is measured the same way.
+    pdf_sizes = [(page["page"]["width"], page["page"]["height"]) for page in pages]
+    ocr_pages = map_page_shards(
+        functools.partial(
+            _ocr_pages,
+            page_ids=ocr_page_ids,
+            pdf_sizes=pdf_sizes,
+            dpi=dpi,
+            scores=scores,
+        ),
+        pdf_file,
+        len(ocr_page_ids),
+        workers,
+    )
+    for page_id, ocr_page in zip(ocr_page_ids, ocr_pages):
+        pages[page_id]["tokens"] = ocr_page["tokens"]
+
+    return pages
@@ -1,6 +1,29 @@
 import json
-from dataclasses import dataclass  # enables inheritance
-from typing import NamedTuple, List, Tuple, Dict, Union
+from operator import attrgetter
+from dataclasses import dataclass, field, fields  # enables inheritance
+from typing import NamedTuple, List, Tuple, Dict, Union, Optional, Sequence, Iterator
+
+import numpy as np
+
+
+def _slotted(cls):
+    """Re-create a dataclass with `__slots__` for the fields it declares, so
+    that its instances have no `__dict__` (like `dataclass(slots=True)`, which
+    needs python 3.10). Every class in the hierarchy has to be slotted for the
+    instances of the subclasses to be slotted too."""
+    own_fields = cls.__dict__.get("__annotations__", {})
+    names = tuple(f.name for f in fields(cls) if f.name in own_fields)
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = names
+    for name in names:
+        # The defaults are kept by the generated __init__.
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    slotted = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    # Not a method, so it's called as self._field_values(self).
+    slotted._field_values = attrgetter(*(f.name for f in fields(cls)))
+    return slotted
 
 
 def union_boxes(boxes: List["Box"]) -> "Box":
@@ -23,6 +46,7 @@ def union_boxes(boxes: List["Box"]) -> "Box":
     return Box(left, top, right - left, bottom - top)
 
 
+@_slotted
 @dataclass
 class Box:
 
@@ -53,12 +77,11 @@ class Box:
                 the outside box (other) by the coordinates.
                 Defaults to {}.
         """
-        other = other.copy()
-
         x, y = self.center
         if soft_margin is not None:
-            other.pad(**soft_margin)
-        xa, ya, xb, yb = other.coordinates
+            xa, ya, xb, yb = other.padded_coordinates(**soft_margin)
+        else:
+            xa, ya, xb, yb = other.coordinates
 
         return xa <= x <= xb and ya <= y <= yb
 
@@ -70,9 +93,24 @@ class Box:
         self.width += left + right
         self.height += top + bottom
 
+    def padded_coordinates(
+        self, left=0, top=0, bottom=0, right=0
+    ) -> Tuple[float, float, float, float]:
+        """Returns the left, top, right, bottom coordinates of the box padded
+        as by `pad`, without changing the box."""
+        x = self.x - left
+        y = self.y - top
+        return (x, y, x + (self.width + (left + right)), y + (self.height + (top + bottom)))
+
+    def padded(self, left=0, top=0, bottom=0, right=0) -> "Box":
+        """Create a box with the boundary positions of this box padded as by `pad`."""
+        x = self.x - left
+        y = self.y - top
+        return Box(x, y, self.width + (left + right), self.height + (top + bottom))
+
     def copy(self):
         """Create a copy of the box"""
-        return self.__class__(**vars(self))
+        return self.__class__(*self._field_values(self))
 
     def scale(self, scale_factor: Union[float, Tuple[float, float]]):
         """Scale the box according to the given scale factor.
@@ -118,11 +156,15 @@ class Box:
         )
 
 
+@_slotted
 @dataclass
 class Token(Box):
     text: str
+    # The confidence of the preprocessor in the token, if it records one.
+    score: Optional[float] = None
 
 
+@_slotted
 @dataclass
 class Block(Box):
     label: str
@@ -140,6 +182,202 @@ class Block(Box):
         )
 
 
+def _coordinate_property(column: int) -> property:
+    def get(self) -> float:
+        return float(self._tokens.coordinates[self._index, column])
+
+    def set(self, value: float):
+        self._tokens.coordinates[self._index, column] = value
+
+    return property(get, set)
+
+
+class TokenView(Token):
+    """A token of a `PageTokens`. Its coordinates are read from, and written to,
+    the arrays of the page, so that a view costs nothing until it's used."""
+
+    __slots__ = ("_tokens", "_index")
+
+    x = _coordinate_property(0)
+    y = _coordinate_property(1)
+    width = _coordinate_property(2)
+    height = _coordinate_property(3)
+
+    def __init__(self, tokens: "PageTokens", index: int):
+        self._tokens = tokens
+        self._index = index
+
+    @property
+    def text(self) -> str:
+        return self._tokens.texts[self._index]
+
+    @text.setter
+    def text(self, value: str):
+        self._tokens.texts[self._index] = value
+
+    @property
+    def score(self) -> Optional[float]:
+        if self._tokens.scores is None:
+            return None
+        return self._tokens.scores[self._index]
+
+    def _astuple(self) -> Tuple:
+        return (self.x, self.y, self.width, self.height, self.text, self.score)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self._astuple() == (
+            other.x,
+            other.y,
+            other.width,
+            other.height,
+            other.text,
+            other.score,
+        )
+
+    def __repr__(self) -> str:
+        return "TokenView(x={!r}, y={!r}, width={!r}, height={!r}, text={!r})".format(
+            self.x, self.y, self.width, self.height, self.text
+        )
+
+    def copy(self) -> Token:
+        """Create a copy of the token, which is independent of the page."""
+        return Token(*self._astuple())
+
+
+class PageTokens(Sequence[Token]):
+    def __init__(
+        self,
+        coordinates: np.ndarray,
+        texts: Sequence[str],
+        scores: Optional[Sequence[Optional[float]]] = None,
+    ):
+        """The tokens of a page, stored as an (n, 4) array of their x, y, width
+        and height, and an array of their text, so that the geometry of all
+        the tokens can be computed at once.
+
+        It is a sequence of `TokenView` objects, which can be used like any
+        `Token`.
+
+        Args:
+            coordinates (np.ndarray): The (n, 4) x, y, width and height of the tokens.
+            texts (Sequence[str]): The text of the tokens.
+            scores (Sequence[Optional[float]], optional):
+                The score of each token, if the preprocessor recorded one.
+        """
+        self.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 4)
+        self.texts = np.empty(len(texts), dtype=object)
+        self.texts[:] = list(texts)
+        self.scores = None if scores is None else list(scores)
+
+    @classmethod
+    def from_tokens(cls, tokens: Sequence[Union[Token, Dict]]) -> "PageTokens":
+        """Create the page tokens from Token objects, or from the token
+        dictionaries of pdf_structure.json."""
+        tokens = [
+            (token.x, token.y, token.width, token.height, token.text, token.score)
+            if isinstance(token, Token)
+            else (
+                token["x"],
+                token["y"],
+                token["width"],
+                token["height"],
+                token["text"],
+                token.get("score"),
+            )
+            for token in tokens
+        ]
+        scores = [token[5] for token in tokens]
+        return cls(
+            np.array([token[:4] for token in tokens], dtype=float).reshape(-1, 4),
+            [token[4] for token in tokens],
+            scores if any(score is not None for score in scores) else None,
+        )
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self) -> Iterator[Token]:
+        return (TokenView(self, index) for index in range(len(self)))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PageTokens):
+            return (
+                np.array_equal(self.coordinates, other.coordinates)
+                and self.texts.tolist() == other.texts.tolist()
+                and self.scores == other.scores
+            )
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"PageTokens({len(self)} tokens)"
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """The (n, 4) left, top, right, bottom coordinates of the tokens."""
+        x, y, width, height = self.coordinates.T
+        return np.stack([x, y, x + width, y + height], axis=1)
+
+    @property
+    def centers(self) -> np.ndarray:
+        """The (n, 2) centers of the tokens."""
+        x, y, width, height = self.coordinates.T
+        return np.stack([x + width / 2, y + height / 2], axis=1)
+
+    def scale(self, scale_factor: Union[float, Tuple[float, float]]):
+        """Scale every token at once, like `Box.scale`."""
+        if isinstance(scale_factor, float):
+            self.coordinates *= scale_factor
+        elif isinstance(scale_factor, tuple):
+            scale_x, scale_y = scale_factor
+            self.coordinates *= np.array([scale_x, scale_y, scale_x, scale_y])
+
+    def contained_in(self, box: Box, soft_margin: Dict = None) -> np.ndarray:
+        """The indices of the tokens whose center is inside the box, like `Box.is_in`."""
+        if soft_margin is not None:
+            left, top, right, bottom = box.padded_coordinates(**soft_margin)
+        else:
+            left, top, right, bottom = box.coordinates
+        center_x, center_y = self.centers.T
+        inside_x = (left <= center_x) & (center_x <= right)
+        inside_y = (top <= center_y) & (center_y <= bottom)
+        return np.flatnonzero(inside_x & inside_y)
+
+    def union(self, indices: Optional[Sequence[int]] = None) -> Box:
+        """The outside boundary of the tokens (or of some of them), like `union_boxes`."""
+        bounds = self.bounds
+        if indices is not None:
+            bounds = bounds[np.asarray(indices, dtype=int)]
+        left, top = bounds[:, :2].min(axis=0)
+        right, bottom = bounds[:, 2:].max(axis=0)
+        return Box(float(left), float(top), float(right - left), float(bottom - top))
+
+    def iou(self, box: Box) -> np.ndarray:
+        """The intersection over union of each token with the box."""
+        left, top, right, bottom = box.coordinates
+        bounds = self.bounds
+        width = np.minimum(bounds[:, 2], right) - np.maximum(bounds[:, 0], left)
+        height = np.minimum(bounds[:, 3], bottom) - np.maximum(bounds[:, 1], top)
+        intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+        areas = self.coordinates[:, 2] * self.coordinates[:, 3]
+        union = areas + box.width * box.height - intersection
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(union > 0, intersection / union, 0.0)
+
+
+@_slotted
 @dataclass
 class PageInfo:
     width: float
@@ -165,10 +403,44 @@ class PageInfo:
             self.height *= scale_y
 
 
+class TokenIndex:
+    def __init__(self, tokens: Sequence[Box]):
+        """A spatial index of the centers of the tokens of a page.
+
+        The centers are sorted by y, so that a query only looks at the
+        horizontal strip of tokens which the box spans, found by binary
+        search, rather than at every token on the page.
+
+        Args:
+            tokens (Sequence[Box]): The tokens of the page.
+        """
+        if isinstance(tokens, PageTokens):
+            centers = tokens.centers
+        else:
+            centers = np.array([token.center for token in tokens], dtype=float)
+            centers = centers.reshape(-1, 2)
+        self.order = np.argsort(centers[:, 1], kind="stable")
+        self.center_x = centers[self.order, 0]
+        self.center_y = centers[self.order, 1]
+
+    def query(self, left: float, top: float, right: float, bottom: float) -> List[int]:
+        """The indices of the tokens whose center is inside the bounds, in order."""
+        start = np.searchsorted(self.center_y, top, side="left")
+        end = np.searchsorted(self.center_y, bottom, side="right")
+        center_x = self.center_x[start:end]
+        inside = self.order[start:end][(left <= center_x) & (center_x <= right)]
+        return np.sort(inside).tolist()
+
+
 @dataclass
 class Page:
     page: PageInfo
-    tokens: List[Union[Token, Block]]
+    # Either a list of tokens (or blocks), or the array-backed PageTokens.
+    tokens: Sequence[Union[Token, Block]]
+    # Built on the first call to filter_tokens_by.
+    _index: Optional[TokenIndex] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def scale(self, scale_factor: Union[float, Tuple[float, float]]):
         """Scale the page according to the given scale factor.
@@ -180,8 +452,12 @@ class Page:
                 scaling factor, respectively.
         """
         self.page.scale(scale_factor)
-        for token in self.tokens:
-            token.scale(scale_factor)
+        if isinstance(self.tokens, PageTokens):
+            self.tokens.scale(scale_factor)
+        else:
+            for token in self.tokens:
+                token.scale(scale_factor)
+        self._index = None
 
     def scale_like(self, other: "Page"):
         """Scale the page based on the other page."""
@@ -192,17 +468,37 @@ class Page:
         self.scale((scale_x, scale_y))
 
     def filter_tokens_by(self, box: Box, soft_margin: Dict = None) -> Dict[int, Token]:
-        """Select tokens in the Page that inside the input box"""
-        return {
-            idx: token
-            for idx, token in enumerate(self.tokens)
-            if token.is_in(box, soft_margin)
-        }
+        """Select tokens in the Page that inside the input box.
+
+        The tokens are looked up in a spatial index of the page, which is built
+        on the first call and re-built when the page is scaled. Tokens which are
+        modified otherwise aren't seen by the index.
+        """
+        if self._index is None or len(self._index.order) != len(self.tokens):
+            self._index = TokenIndex(self.tokens)
+
+        # The box is padded exactly as in Box.is_in.
+        if soft_margin is not None:
+            bounds = box.padded_coordinates(**soft_margin)
+        else:
+            bounds = box.coordinates
+        return {idx: self.tokens[idx] for idx in self._index.query(*bounds)}
+
+
+def load_page(page_data: Dict) -> Page:
+    """Load a page of a tokens file into the data model."""
+    return Page(
+        page=PageInfo(**page_data["page"]),
+        tokens=PageTokens.from_tokens(page_data["tokens"]),
+    )
 
 
 def load_tokens_from_file(filename: str) -> List[Page]:
     """Load tokens files into the data model
 
+    This parses the whole file at once; see `pawls.preprocessors.storage.PdfStructure`
+    for loading the pages lazily.
+
     Returns:
         List[Page]:
             A list of `Page` object for eac page.
@@ -211,10 +507,4 @@ def load_tokens_from_file(filename: str) -> List[Page]:
     with open(filename, "r") as fp:
         source_data = json.load(fp)
 
-    return [
-        Page(
-            page=PageInfo(**page_data["page"]),
-            tokens=[Token(**token) for token in page_data["tokens"]],
-        )
-        for page_data in source_data
-    ]
\ No newline at end of file
+    return [load_page(page_data) for page_data in source_data]
\ No newline at end of file
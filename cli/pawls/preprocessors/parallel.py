@@ -0,0 +1,52 @@
+from typing import Callable, List, TypeVar
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+T = TypeVar("T")
+
+# Each worker gets about this many shards of pages, so that a worker which
+# gets slow pages (e.g. dense scans for OCR) doesn't hold up the others.
+SHARDS_PER_WORKER = 4
+
+
+def shard_pages(num_pages: int, num_shards: int) -> List[range]:
+    """Split the pages of a pdf into at most num_shards contiguous ranges
+    of (almost) equal size."""
+    num_shards = max(1, min(num_shards, num_pages))
+    size, remainder = divmod(num_pages, num_shards)
+    shards = []
+    start = 0
+    for shard in range(num_shards):
+        end = start + size + (1 if shard < remainder else 0)
+        shards.append(range(start, end))
+        start = end
+    return shards
+
+
+def map_page_shards(
+    process_pages: Callable[[str, range], List[T]],
+    pdf_file: str,
+    num_pages: int,
+    workers: int,
+) -> List[T]:
+    """Process the pages of a single pdf with a pool of worker processes.
+
+    Args:
+        process_pages (Callable[[str, range], List[T]]):
+            A picklable function which opens the pdf and processes a range of its
+            pages, returning one result per page. Each worker opens the pdf itself,
+            so that nothing but the results are sent between processes.
+        pdf_file (str): The path to the pdf file.
+        num_pages (int): The number of pages of the pdf.
+        workers (int): The number of worker processes.
+
+    Returns:
+        List[T]: The result of every page, in page order.
+    """
+    shards = shard_pages(num_pages, workers * SHARDS_PER_WORKER)
+    if workers <= 1 or len(shards) <= 1:
+        return [result for shard in shards for result in process_pages(pdf_file, shard)]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        results = executor.map(process_pages, repeat(pdf_file), shards)
+        return [result for shard_results in results for result in shard_results]
@@ -1,38 +1,38 @@
 from typing import List
 
-import pandas as pd
+import numpy as np
 import pdfplumber
 
 from pawls.preprocessors.model import Page, Token
+from pawls.preprocessors.parallel import map_page_shards
 
 
 class PDFPlumberTokenExtractor:
 
-    @staticmethod
-    def convert_to_pagetoken(row: pd.Series) -> Token:
-        """Convert a row in a DataFrame to pagetoken"""
-        return dict(
-            text=row["text"],
-            x=row["x0"],
-            width=row["width"],
-            y=row["top"],
-            height=row["height"],
-        )
-
-    def extract(self, pdf_path: str) -> List[Page]:
+    def extract(self, pdf_path: str, workers: int = 1) -> List[Page]:
         """Extracts token text, positions, and style information from a PDF file.
 
         Args:
             pdf_path (str): the path to the pdf file.
-            include_lines (bool, optional): Whether to include line tokens. Defaults to False.
+            workers (int, optional):
+                The number of processes to extract the pages with. Defaults to 1.
 
         Returns:
             PdfAnnotations: A `PdfAnnotations` containing all the paper token information.
         """
-        plumber_pdf_object = pdfplumber.open(pdf_path)
+        with pdfplumber.open(pdf_path) as plumber_pdf_object:
+            num_pages = len(plumber_pdf_object.pages)
+            if workers <= 1:
+                return self.extract_pages(plumber_pdf_object, range(num_pages))
 
+        return map_page_shards(_extract_page_range, pdf_path, num_pages, workers)
+
+    def extract_pages(
+        self, plumber_pdf_object: pdfplumber.PDF, page_ids: range
+    ) -> List[Page]:
+        """Extracts the tokens of a range of pages of an opened PDF file."""
         pages = []
-        for page_id in range(len(plumber_pdf_object.pages)):
+        for page_id in page_ids:
             cur_page = plumber_pdf_object.pages[page_id]
 
             tokens = self.obtain_word_tokens(cur_page)
@@ -70,31 +70,48 @@ class PDFPlumberTokenExtractor:
         )
         if len(words) == 0:
             return []
-            
-        df = pd.DataFrame(words)
 
-        # Avoid boxes outside the page
-        df[["x0", "x1"]] = (
-            df[["x0", "x1"]].clip(lower=0, upper=int(cur_page.width)).astype("float")
-        )
-        df[["top", "bottom"]] = (
-            df[["top", "bottom"]].clip(lower=0, upper=int(cur_page.height)).astype("float")
+        # The coordinates are converted column by column,
+        # rather than token by token.
+        x0, x1, top, bottom = (
+            np.array([word[key] for word in words], dtype=float)
+            for key in ["x0", "x1", "top", "bottom"]
         )
 
-        df["height"] = df["bottom"] - df["top"]
-        df["width"] = df["x1"] - df["x0"]
+        # Avoid boxes outside the page
+        page_width = int(cur_page.width)
+        page_height = int(cur_page.height)
+        np.clip(x0, 0, page_width, out=x0)
+        np.clip(x1, 0, page_width, out=x1)
+        np.clip(top, 0, page_height, out=top)
+        np.clip(bottom, 0, page_height, out=bottom)
+
+        width = x1 - x0
+        height = bottom - top
+
+        return [
+            dict(text=word["text"], x=x, width=w, y=y, height=h)
+            for word, x, w, y, h in zip(
+                words, x0.tolist(), width.tolist(), top.tolist(), height.tolist()
+            )
+        ]
+
 
-        word_tokens = df.apply(self.convert_to_pagetoken, axis=1).tolist()
-        return word_tokens
+def _extract_page_range(pdf_path: str, page_ids: range) -> List[Page]:
+    # Runs in a worker process, which opens the pdf itself.
+    with pdfplumber.open(pdf_path) as plumber_pdf_object:
+        return PDFPlumberTokenExtractor().extract_pages(plumber_pdf_object, page_ids)
 
 
-def process_pdfplumber(pdf_file: str):
+def process_pdfplumber(pdf_file: str, workers: int = 1):
     """
     Integration for importing annotations from pdfplumber.
     pdf_file: str
         The path to the pdf file to process.
+    workers: int
+        The number of processes to extract the pages of the pdf with.
     """
     pdf_extractors = PDFPlumberTokenExtractor()
-    annotations = pdf_extractors.extract(pdf_file)
+    annotations = pdf_extractors.extract(pdf_file, workers=workers)
 
     return annotations
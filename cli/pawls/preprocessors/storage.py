@@ -0,0 +1,408 @@
+import os
+import json
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Iterator, TextIO
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from pawls.preprocessors.model import Page, PageInfo, PageTokens, load_page
+
+PDF_STRUCTURE_NAME = "pdf_structure.json"
+PDF_STRUCTURE_METADATA_NAME = "pdf_structure.meta.json"
+TOKEN_STORE_NAME = "pdf_structure.tokens"
+
+# Pre-encoded copies of pdf_structure.json, which the API sends as they are
+# to clients which accept the corresponding Content-Encoding.
+GZIP_PDF_STRUCTURE_NAME = "pdf_structure.json.gz"
+BROTLI_PDF_STRUCTURE_NAME = "pdf_structure.json.br"
+
+# The token store is a columnar, little-endian binary file laid out as:
+#
+#   header       magic (8 bytes), num_pages (u4), num_tokens (u4), text_size (u8)
+#   pages        num_pages records of PAGE_DTYPE
+#   coordinates  num_tokens x 4 float32 values (x, y, width, height)
+#   offsets      num_tokens + 1 uint64 byte offsets into the text blob
+#   text         the utf-8 encoded token text, concatenated
+#
+# Every section starts at a multiple of 8 bytes, so that each of them can be
+# memory-mapped directly as a numpy array without copying.
+TOKEN_STORE_MAGIC = b"PAWLSTK1"
+HEADER_DTYPE = np.dtype(
+    [("magic", "S8"), ("num_pages", "<u4"), ("num_tokens", "<u4"), ("text_size", "<u8")]
+)
+PAGE_DTYPE = np.dtype(
+    [
+        ("width", "<f4"),
+        ("height", "<f4"),
+        ("index", "<u4"),
+        ("token_start", "<u4"),
+    ]
+)
+COORDINATE_DTYPE = np.dtype("<f4")
+OFFSET_DTYPE = np.dtype("<u8")
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def _write_atomic(filename: str, data: bytes) -> None:
+    """Write a file so that readers, such as the API, never see it partially
+    written, and an interrupted run never leaves a truncated file behind."""
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filename, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def write_token_store(pages: List[Dict[str, Any]], filename: str) -> None:
+    """Write the pages produced by a preprocessor to a columnar token store.
+
+    Args:
+        pages (List[Dict[str, Any]]):
+            The preprocessor output, in the same format as pdf_structure.json.
+        filename (str):
+            The path of the token store file.
+    """
+    page_table = np.zeros(len(pages), dtype=PAGE_DTYPE)
+    coordinates = []
+    texts = []
+    for page_id, page_data in enumerate(pages):
+        page_table[page_id] = (
+            page_data["page"]["width"],
+            page_data["page"]["height"],
+            page_data["page"]["index"],
+            len(texts),
+        )
+        for token in page_data["tokens"]:
+            coordinates.append(
+                (token["x"], token["y"], token["width"], token["height"])
+            )
+            texts.append(token["text"].encode("utf-8"))
+
+    coordinates = np.array(coordinates, dtype=COORDINATE_DTYPE).reshape(-1, 4)
+    offsets = np.zeros(len(texts) + 1, dtype=OFFSET_DTYPE)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+    text_blob = b"".join(texts)
+
+    header = np.array(
+        [(TOKEN_STORE_MAGIC, len(pages), len(texts), len(text_blob))],
+        dtype=HEADER_DTYPE,
+    )
+
+    sections = []
+    for section in [header, page_table, coordinates, offsets]:
+        data = section.tobytes()
+        sections.append(data)
+        sections.append(b"\0" * (_aligned(len(data)) - len(data)))
+    sections.append(text_blob)
+
+    _write_atomic(filename, b"".join(sections))
+
+
+class TokenStore:
+    def __init__(self, filename: str):
+        """A read-only, memory-mapped view of a columnar token store.
+
+        Nothing but the header is read when the store is opened; the token
+        coordinates and text of a page are only paged in from disk when
+        that page is accessed.
+
+        Args:
+            filename (str): The path of the token store file.
+        """
+        self.filename = filename
+        self._buffer = np.memmap(filename, dtype=np.uint8, mode="r")
+
+        header = self._buffer[: HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header["magic"] != TOKEN_STORE_MAGIC:
+            raise ValueError(f"{filename} is not a pawls token store.")
+
+        num_pages = int(header["num_pages"])
+        num_tokens = int(header["num_tokens"])
+
+        offset = _aligned(HEADER_DTYPE.itemsize)
+        self.pages = self._section(offset, PAGE_DTYPE, num_pages)
+        offset += _aligned(PAGE_DTYPE.itemsize * num_pages)
+        self.coordinates = self._section(
+            offset, COORDINATE_DTYPE, num_tokens * 4
+        ).reshape(-1, 4)
+        offset += _aligned(COORDINATE_DTYPE.itemsize * num_tokens * 4)
+        self.offsets = self._section(offset, OFFSET_DTYPE, num_tokens + 1)
+        offset += _aligned(OFFSET_DTYPE.itemsize * (num_tokens + 1))
+        self.text = self._buffer[offset : offset + int(header["text_size"])]
+
+    def _section(self, offset: int, dtype: np.dtype, count: int) -> np.ndarray:
+        return self._buffer[offset : offset + dtype.itemsize * count].view(dtype)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def token_range(self, page_id: int) -> slice:
+        """The slice of the token arrays covered by the page_id-th page."""
+        start = int(self.pages[page_id]["token_start"])
+        if page_id + 1 < len(self.pages):
+            end = int(self.pages[page_id + 1]["token_start"])
+        else:
+            end = len(self.coordinates)
+        return slice(start, end)
+
+    def page_info(self, page_id: int) -> PageInfo:
+        record = self.pages[page_id]
+        return PageInfo(
+            width=float(record["width"]),
+            height=float(record["height"]),
+            index=int(record["index"]),
+        )
+
+    def page_texts(self, page_id: int) -> List[str]:
+        token_range = self.token_range(page_id)
+        offsets = self.offsets[token_range.start : token_range.stop + 1]
+        start = int(offsets[0])
+        blob = self.text[start : int(offsets[-1])].tobytes()
+        return [
+            blob[int(begin) - start : int(end) - start].decode("utf-8")
+            for begin, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def page(self, page_id: int) -> Page:
+        """Load the page_id-th page of the store into the data model."""
+        return Page(
+            page=self.page_info(page_id),
+            tokens=PageTokens(
+                self.coordinates[self.token_range(page_id)], self.page_texts(page_id)
+            ),
+        )
+
+    def load_pages(self) -> List[Page]:
+        return [self.page(page_id) for page_id in range(len(self))]
+
+
+def write_pdf_structure(
+    pages: List[Dict[str, Any]],
+    directory: str,
+    manifest: Optional[Dict[str, Any]] = None,
+    page_sizes: Optional[List[Tuple[int, int]]] = None,
+) -> None:
+    """Write the preprocessor output for a pdf into its pawls directory.
+
+    This writes the pdf_structure.json file used by the annotation UI,
+    gzip (and, if the brotli package is installed, brotli) compressed copies
+    of it, a columnar token store, and a metadata file which records the
+    content hash of pdf_structure.json and where each page starts in it, so
+    that single pages can be read without parsing the whole file. Each file
+    is replaced atomically.
+
+    Args:
+        pages (List[Dict[str, Any]]):
+            The token information for each page, as returned by a preprocessor.
+        directory (str):
+            The directory of the pdf, i.e. `<labeling_folder>/<sha>`.
+        manifest (Dict[str, Any], optional):
+            A record of how the pages were produced, which is stored in the
+            metadata file. The metadata file is written last, so a manifest is
+            only ever recorded for complete outputs.
+        page_sizes (List[Tuple[int, int]], optional):
+            The size of each page of the pdf, which is stored in the metadata
+            file so that commands don't need to parse the pdf for it
+            (see `pawls.preprocessors.geometry`).
+    """
+    # Serializing page by page produces exactly the same bytes as
+    # json.dump(pages), but lets us keep track of the page offsets.
+    page_blobs = [json.dumps(page).encode("utf-8") for page in pages]
+    page_offsets = []
+    offset = 1  # The opening bracket
+    for blob in page_blobs:
+        page_offsets.append([offset, len(blob)])
+        offset += len(blob) + 2  # The ", " separator
+
+    structure = b"[" + b", ".join(page_blobs) + b"]"
+
+    _write_atomic(os.path.join(directory, PDF_STRUCTURE_NAME), structure)
+
+    # mtime=0 keeps the compressed bytes identical across runs.
+    _write_atomic(
+        os.path.join(directory, GZIP_PDF_STRUCTURE_NAME),
+        gzip.compress(structure, compresslevel=9, mtime=0),
+    )
+
+    brotli_path = os.path.join(directory, BROTLI_PDF_STRUCTURE_NAME)
+    if brotli is not None:
+        _write_atomic(brotli_path, brotli.compress(structure))
+    elif os.path.exists(brotli_path):
+        # Never leave an encoding of a previous version of the structure around.
+        os.remove(brotli_path)
+
+    write_token_store(pages, os.path.join(directory, TOKEN_STORE_NAME))
+
+    metadata = {
+        "sha256": hashlib.sha256(structure).hexdigest(),
+        "pages": page_offsets,
+    }
+    if manifest is not None:
+        metadata["manifest"] = manifest
+    if page_sizes is not None:
+        metadata["page_sizes"] = page_sizes
+    _write_atomic(
+        os.path.join(directory, PDF_STRUCTURE_METADATA_NAME),
+        json.dumps(metadata).encode("utf-8"),
+    )
+
+
+def load_pdf_structure_metadata(directory: str) -> Dict[str, Any]:
+    """Load the metadata written by `write_pdf_structure` for a pdf directory.
+
+    Returns an empty dictionary for pdfs which were preprocessed before
+    the metadata file existed.
+    """
+    filename = os.path.join(directory, PDF_STRUCTURE_METADATA_NAME)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def _scan_json_array(
+    fp: TextIO, chunk_size: int = 1 << 20
+) -> Iterator[Tuple[Any, int, int]]:
+    """Parse the items of a json array from a file one at a time, yielding each
+    item with the position and length of its text in the file."""
+    decoder = json.JSONDecoder()
+    buffer = fp.read(chunk_size)
+    stripped = buffer.lstrip()
+    if not stripped.startswith("["):
+        raise ValueError(f"{fp.name} is not a json array.")
+    # The position in the file of the start of the buffer.
+    position = len(buffer) - len(stripped) + 1
+    buffer = stripped[1:]
+
+    while True:
+        stripped = buffer.lstrip()
+        position += len(buffer) - len(stripped)
+        buffer = stripped
+        if buffer.startswith("]"):
+            return
+        if buffer.startswith(","):
+            buffer = buffer[1:]
+            position += 1
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # The item continues past the end of the buffer. Reading at least
+            # as much again as is buffered keeps re-parsing a large item linear.
+            chunk = fp.read(max(chunk_size, len(buffer)))
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield item, position, end
+        buffer = buffer[end:]
+        position += end
+
+
+def iter_json_array(fp: TextIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Parse the items of a json array from a file one at a time, so that only
+    the current item, rather than the whole array, is held in memory."""
+    for item, _, _ in _scan_json_array(fp, chunk_size):
+        yield item
+
+
+def find_json_array_offsets(filename: str) -> List[Tuple[int, int]]:
+    """Find the byte offset and length of each item of a json array file, in a
+    single pass which only holds one item in memory at a time."""
+    # Decoding the bytes as latin-1 makes every position a byte offset. The
+    # bytes of multi-byte utf-8 characters are never json syntax, so they
+    # don't change where the items start and end.
+    with open(filename, "r", encoding="latin-1") as fp:
+        return [(position, length) for _, position, length in _scan_json_array(fp)]
+
+
+class PdfStructure(Sequence[Page]):
+    def __init__(self, filename: str, cache_size: int = 8):
+        """A lazily loaded pdf_structure.json file.
+
+        Pages are only parsed when they are accessed, by reading them directly
+        from their offset in the file. The offsets are recorded in the metadata
+        file by `write_pdf_structure`; for files written otherwise, they are
+        found once, in a single pass over the file, on first access. Either
+        way, only the `cache_size` most recently used pages are kept in memory.
+
+        Args:
+            filename (str): The path of the pdf_structure.json file.
+            cache_size (int, optional): The number of parsed pages to keep.
+        """
+        self.filename = filename
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, Page]" = OrderedDict()
+        self.page_offsets = self._load_page_offsets()
+
+    def _load_page_offsets(self) -> Optional[List[Tuple[int, int]]]:
+        if os.path.basename(self.filename) != PDF_STRUCTURE_NAME:
+            return None
+        page_offsets = load_pdf_structure_metadata(os.path.dirname(self.filename)).get(
+            "pages"
+        )
+        if page_offsets is None:
+            return None
+
+        # Never trust the offsets of a file which was replaced since.
+        end = page_offsets[-1][0] + page_offsets[-1][1] if page_offsets else 1
+        if os.path.getsize(self.filename) != end + 1:
+            return None
+        return page_offsets
+
+    def _find_page_offsets(self) -> List[Tuple[int, int]]:
+        if self.page_offsets is None:
+            self.page_offsets = find_json_array_offsets(self.filename)
+        return self.page_offsets
+
+    def __len__(self) -> int:
+        return len(self._find_page_offsets())
+
+    def _read_page(self, page_id: int) -> Dict[str, Any]:
+        offset, length = self._find_page_offsets()[page_id]
+        with open(self.filename, "rb") as fp:
+            fp.seek(offset)
+            return json.loads(fp.read(length))
+
+    def __getitem__(self, page_id: int) -> Page:
+        if page_id < 0:
+            page_id += len(self)
+        if not 0 <= page_id < len(self):
+            raise IndexError("page index out of range")
+
+        if page_id in self._cache:
+            self._cache.move_to_end(page_id)
+            return self._cache[page_id]
+
+        page = load_page(self._read_page(page_id))
+        self._cache[page_id] = page
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return page
+
+    def __iter__(self) -> Iterator[Page]:
+        """Iterate over the pages, reading the file once, a page at a time.
+        The pages aren't cached, so a full pass doesn't evict the cache."""
+        if self.page_offsets is not None:
+            with open(self.filename, "rb") as fp:
+                for offset, length in self.page_offsets:
+                    fp.seek(offset)
+                    yield load_page(json.loads(fp.read(length)))
+            return
+
+        with open(self.filename, "r") as fp:
+            for page_data in iter_json_array(fp):
+                yield load_page(page_data)
@@ -1,13 +1,15 @@
-from typing import List, Tuple, Dict
-import csv
-import io
+from typing import TYPE_CHECKING, List, Tuple, Dict, Iterator, Optional
+import functools
 
 import pytesseract
-import pandas as pd
 from pdf2image import convert_from_path
 
 from pawls.preprocessors.model import Token, PageInfo, Page
-from pawls.commands.utils import get_pdf_pages_and_sizes
+from pawls.preprocessors.parallel import map_page_shards
+from pawls.preprocessors.geometry import PageSizes, get_pdf_page_sizes
+
+if TYPE_CHECKING:
+    import PIL.Image
 
 
 def calculate_image_scale_factor(pdf_size, image_size):
@@ -17,67 +19,111 @@ def calculate_image_scale_factor(pdf_size, image_size):
     return scale_w, scale_h
 
 
+def parse_page_tokens(
+    tsv: str, scale: Tuple[float, float], include_score: bool = False
+) -> List[Dict]:
+    """Convert the TSV output of tesseract into tokens.
+
+    Tesseract writes one row per page, block, paragraph, line and word, and only
+    the word rows have text, so each row with text is already a token. Rows are
+    split as they are, without any quoting, like `pd.read_csv(quoting=QUOTE_NONE)`.
+
+    This differs from parsing the TSV with pandas, as the preprocessor used to,
+    in two ways. Words which are only whitespace are dropped. Words which pandas
+    reads as missing values, such as "nan", "NA" or "null", are kept as they are,
+    and numbers keep their text (pandas turned "42" into "42.0" on some pages).
+
+    Args:
+        tsv (str):
+            The output of `pytesseract.image_to_data`.
+        scale (Tuple[float, float]):
+            The factors to scale the x and y coordinates by, from the image to the pdf.
+        include_score (bool, optional):
+            Whether to add the confidence of tesseract in each word (0-100)
+            to its token as "score". Defaults to False.
+
+    Returns:
+        List[Dict]: The tokens, in the reading order of tesseract.
+    """
+    scale_w, scale_h = scale
+    lines = tsv.splitlines()
+    if not lines:
+        return []
+
+    columns = {name: index for index, name in enumerate(lines[0].split("\t"))}
+    left, top = columns["left"], columns["top"]
+    width, height = columns["width"], columns["height"]
+    conf, text = columns["conf"], columns["text"]
+
+    tokens = []
+    for line in lines[1:]:
+        row = line.split("\t", text)
+        if len(row) <= text or not row[text].strip():
+            continue
+        token = {
+            "x": int(row[left]) * scale_w,
+            "y": int(row[top]) * scale_h,
+            "width": int(row[width]) * scale_w,
+            "height": int(row[height]) * scale_h,
+            "text": row[text],
+        }
+        if include_score:
+            token["score"] = float(row[conf])
+        tokens.append(token)
+
+    return tokens
+
+
 def extract_page_tokens(
-    pdf_image: "PIL.Image", pdf_size=Tuple[float, float], language="eng"
+    pdf_image: "PIL.Image",
+    pdf_size: Tuple[float, float],
+    language: str = "eng",
+    include_score: bool = False,
 ) -> List[Dict]:
 
-    _data = pytesseract.image_to_data(pdf_image, lang=language)
+    tsv = pytesseract.image_to_data(pdf_image, lang=language)
+    scale = calculate_image_scale_factor(pdf_size, pdf_image.size)
+    return parse_page_tokens(tsv, scale, include_score)
 
-    scale_w, scale_h = calculate_image_scale_factor(pdf_size, pdf_image.size)
 
-    res = pd.read_csv(
-        io.StringIO(_data), quoting=csv.QUOTE_NONE, encoding="utf-8", sep="\t"
-    )
-    # An implementation adopted from https://github.com/Layout-Parser/layout-parser/blob/20de8e7adb0a7d7740aed23484fa8b943126f881/src/layoutparser/ocr.py#L475
-    tokens = (
-        res[~res.text.isna()]
-        .groupby(["page_num", "block_num", "par_num", "line_num", "word_num"])
-        .apply(
-            lambda gp: pd.Series(
-                [
-                    gp["left"].min(),
-                    gp["top"].min(),
-                    gp["width"].max(),
-                    gp["height"].max(),
-                    gp["conf"].mean(),
-                    gp["text"].astype(str).str.cat(sep=" "),
-                ]
-            )
-        )
-        .reset_index(drop=True)
-        .reset_index()
-        .rename(
-            columns={
-                0: "x",
-                1: "y",
-                2: "width",
-                3: "height",
-                4: "score",
-                5: "text",
-                "index": "id",
-            }
-        )
-        .drop(columns=["score", "id"])
-        .assign(
-            x=lambda df: df.x * scale_w,
-            y=lambda df: df.y * scale_h,
-            width=lambda df: df.width * scale_w,
-            height=lambda df: df.height * scale_h,
-        )
-        .apply(lambda row: row.to_dict(), axis=1)
-        .tolist()
-    )
+# The resolution which pages are rasterized at for OCR, as in pdf2image.
+DEFAULT_DPI = 200
 
-    return tokens
+# The number of pages rasterized at a time. Only this many page images
+# are held in memory, however many pages the pdf has.
+RASTERIZE_WINDOW = 1
 
 
-def parse_annotations(pdf_file: str) -> List[Page]:
+def rasterize_pages(
+    pdf_file: str, page_ids: range, dpi: int = DEFAULT_DPI, window: int = RASTERIZE_WINDOW
+) -> Iterator[Tuple[int, "PIL.Image"]]:
+    """Rasterize a range of pages of a pdf, a window of pages at a time.
 
-    pdf_images = convert_from_path(pdf_file)
-    _, pdf_sizes = get_pdf_pages_and_sizes(pdf_file)
+    Yields the index of each page and its image. The images of a window are
+    only rendered once the previous window has been consumed.
+    """
+    for start in range(page_ids.start, page_ids.stop, window):
+        end = min(start + window, page_ids.stop)
+        # Pages are numbered from 1 by pdf2image.
+        pdf_images = convert_from_path(
+            pdf_file, dpi=dpi, first_page=start + 1, last_page=end
+        )
+        for page_index, pdf_image in zip(range(start, end), pdf_images):
+            yield page_index, pdf_image
+            pdf_image.close()
+
+
+def ocr_page_range(
+    pdf_file: str,
+    page_ids: range,
+    pdf_sizes: List[Tuple[float, float]],
+    dpi: int = DEFAULT_DPI,
+    scores: bool = False,
+) -> List[Page]:
     pages = []
-    for page_index, (pdf_image, pdf_size) in enumerate(zip(pdf_images, pdf_sizes)):
-        tokens = extract_page_tokens(pdf_image, pdf_size)
+    for page_index, pdf_image in rasterize_pages(pdf_file, page_ids, dpi):
+        pdf_size = pdf_sizes[page_index]
+        tokens = extract_page_tokens(pdf_image, pdf_size, include_score=scores)
         w, h = pdf_size
         page = dict(
             page=dict(
@@ -92,12 +138,48 @@ def parse_annotations(pdf_file: str) -> List[Page]:
     return pages
 
 
-def process_tesseract(pdf_file: str):
+def parse_annotations(
+    pdf_file: str,
+    workers: int = 1,
+    dpi: int = DEFAULT_DPI,
+    scores: bool = False,
+    page_sizes: Optional[PageSizes] = None,
+) -> List[Page]:
+
+    pdf_sizes = page_sizes if page_sizes is not None else get_pdf_page_sizes(pdf_file)
+    return map_page_shards(
+        functools.partial(
+            ocr_page_range, pdf_sizes=pdf_sizes, dpi=dpi, scores=scores
+        ),
+        pdf_file,
+        len(pdf_sizes),
+        workers,
+    )
+
+
+def process_tesseract(
+    pdf_file: str,
+    workers: int = 1,
+    dpi: int = DEFAULT_DPI,
+    scores: bool = False,
+    page_sizes: Optional[PageSizes] = None,
+):
     """
     Integration for importing annotations from pdfplumber.
     pdf_file: str
         The path to the pdf file to process.
+    workers: int
+        The number of processes to OCR the pages of the pdf with.
+    dpi: int
+        The resolution to rasterize the pages at. Pages are rasterized
+        one at a time, so memory use doesn't grow with the number of pages.
+    scores: bool
+        Whether to record the confidence of tesseract in each token as its "score".
+    page_sizes: PageSizes
+        The size of each page of the pdf, if it was already read.
     """
-    annotations = parse_annotations(pdf_file)
+    annotations = parse_annotations(
+        pdf_file, workers=workers, dpi=dpi, scores=scores, page_sizes=page_sizes
+    )
 
     return annotations
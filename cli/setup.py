@@ -31,6 +31,7 @@ setup(
         "pdf2image==1.14.0",
         "pdfminer",
         "pandas",
+        "numpy",
         "pdfplumber",
         "pytesseract",
         "tabulate",
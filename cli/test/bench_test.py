@@ -0,0 +1,72 @@
+import os
+import json
+import random
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from pawls.commands import bench
+from pawls.commands.bench import random_words, write_synthetic_pdf
+from pawls.preprocessors.pdfplumber import process_pdfplumber
+from pawls.preprocessors.geometry import read_pdf_page_sizes
+
+
+class TestBench(unittest.TestCase):
+    def test_write_synthetic_pdf(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf = os.path.join(tempdir, "synthetic.pdf")
+            write_synthetic_pdf(pdf, 3, 500, {1}, random.Random(0))
+
+            assert read_pdf_page_sizes(pdf) == [(612, 792)] * 3
+            pages = process_pdfplumber(pdf)
+
+        # The pages are generated from the same sequence of random words.
+        rng = random.Random(0)
+        words = [random_words(rng, 500) for _ in range(3)]
+        assert [token["text"] for token in pages[0]["tokens"]] == words[0]
+        # Scanned pages have no text layer.
+        assert pages[1]["tokens"] == []
+        assert [token["text"] for token in pages[2]["tokens"]] == words[2]
+        for token in pages[0]["tokens"] + pages[2]["tokens"]:
+            assert 0 <= token["x"] and token["x"] + token["width"] <= 612
+            assert 0 <= token["y"] and token["y"] + token["height"] <= 792
+
+    def test_bench_preprocess(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            output = os.path.join(tempdir, "bench.json")
+            corpus = os.path.join(tempdir, "corpus")
+            result = runner.invoke(
+                bench,
+                [
+                    "preprocess",
+                    "--pdfs",
+                    "2",
+                    "--pages",
+                    "4",
+                    "--tokens",
+                    "100",
+                    "--scanned",
+                    "0.25",
+                    "--corpus",
+                    corpus,
+                    "-o",
+                    output,
+                ],
+            )
+            assert result.exit_code == 0, result.output
+            assert len(os.listdir(corpus)) == 2
+
+            with open(output) as fp:
+                report = json.load(fp)
+
+        assert report["corpus"]["scanned"] == 0.25
+        (pdfplumber,) = report["results"]
+        assert pdfplumber["preprocessor"] == "pdfplumber"
+        assert (pdfplumber["pdfs"], pdfplumber["failed"]) == (2, 0)
+        assert pdfplumber["pages"] == 8
+        # One of the four pages of each pdf is scanned.
+        assert pdfplumber["tokens"] == 2 * 3 * 100
+        assert pdfplumber["pages_per_second"] > 0
+        assert pdfplumber["peak_rss_mb"] > 0
@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from pawls.commands import catalog, add
+from pawls.commands.catalog import load_catalog, get_catalog_path
+from pawls.commands.utils import AnnotationFolder
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.TEST_ANNO_DIR = "test/fixtures/pawls/"
+        self.TEST_PDF = (
+            "test/fixtures/pawls/34f25a8704614163c4095b3ee2fc969b60de4698/"
+            "34f25a8704614163c4095b3ee2fc969b60de4698.pdf"
+        )
+        self.shas = sorted(
+            sha
+            for sha in os.listdir(self.TEST_ANNO_DIR)
+            if os.path.exists(os.path.join(self.TEST_ANNO_DIR, sha, f"{sha}.pdf"))
+        )
+
+    def test_build_catalog(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            labeling_folder = os.path.join(tempdir, "pdfs")
+            shutil.copytree(self.TEST_ANNO_DIR, labeling_folder)
+
+            result = runner.invoke(catalog, [labeling_folder])
+            assert result.exit_code == 0
+
+            with open(get_catalog_path(labeling_folder)) as f:
+                documents = json.load(f)
+            assert list(documents) == self.shas
+
+            sha = self.shas[0]
+            pdf_path = os.path.join(labeling_folder, sha, f"{sha}.pdf")
+            assert documents[sha]["name"] == sha
+            assert documents[sha]["size"] == os.path.getsize(pdf_path)
+            assert documents[sha]["structure"]
+            assert documents[sha]["pages"] > 0
+
+    def test_catalog_reconciles_folder(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            labeling_folder = os.path.join(tempdir, "pdfs")
+            shutil.copytree(self.TEST_ANNO_DIR, labeling_folder)
+            CliRunner().invoke(catalog, [labeling_folder])
+
+            # Pdfs which were copied in or removed without updating the catalog.
+            shutil.rmtree(os.path.join(labeling_folder, self.shas[0]))
+            os.makedirs(os.path.join(labeling_folder, "new_pdf"))
+            shutil.copy(self.TEST_PDF, os.path.join(labeling_folder, "new_pdf", "new_pdf.pdf"))
+
+            documents = load_catalog(labeling_folder)
+            assert list(documents) == sorted(self.shas[1:] + ["new_pdf"])
+            assert not documents["new_pdf"]["structure"]
+            # Listing the folder doesn't parse the pdfs missing from the catalog.
+            assert documents["new_pdf"]["pages"] is None
+
+            annotation_folder = AnnotationFolder(labeling_folder)
+            assert annotation_folder.all_pdfs == [f"{sha}.pdf" for sha in documents]
+
+    def test_add_updates_catalog(self):
+        runner = CliRunner()
+        pdf_path = os.path.abspath(self.TEST_PDF)
+        with runner.isolated_filesystem():
+            result = runner.invoke(add, [pdf_path, "--no-hash"])
+            assert result.exit_code == 0
+
+            labeling_folder = "skiff_files/apps/pawls/papers"
+            with open(get_catalog_path(labeling_folder)) as f:
+                documents = json.load(f)
+
+            sha = "34f25a8704614163c4095b3ee2fc969b60de4698"
+            assert list(documents) == [sha]
+            assert documents[sha]["name"] == sha
+            assert not documents[sha]["structure"]
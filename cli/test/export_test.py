@@ -1,12 +1,15 @@
 import os
 import unittest
+import unittest.mock
 import tempfile
 import json
 
 import pandas as pd
+from PIL import Image
 from click.testing import CliRunner
 
 from pawls.commands import export
+from pawls.commands.utils import load_annotations
 
 """
 Details of annotations in test/fixtures/pawls/
@@ -186,6 +189,46 @@ class TestExportCOCO(unittest.TestCase):
             assert len(paper_shas) == 2
             assert self.PDF_SHAS[2] not in paper_shas
 
+    def test_export_renders_only_missing_images(self):
+        def convert_from_path(pdf_path, first_page, last_page, size):
+            assert first_page == last_page
+            return [Image.new("RGB", size)]
+
+        runner = CliRunner()
+        args = [self.TEST_ANNO_DIR, self.TEST_CONFIG_FILE]
+        options = ["coco", "--pdf-shas", self.PDF_SHAS[1]]
+        with tempfile.TemporaryDirectory() as tempdir, unittest.mock.patch(
+            "pawls.commands.export.convert_from_path", side_effect=convert_from_path
+        ) as convert:
+            result = runner.invoke(export, args + [tempdir] + options)
+            assert result.exit_code == 0, result.output
+
+            coco = _load_json(os.path.join(tempdir, self.DEFAULT_USER + ".json"))
+            assert convert.call_count == len(coco["images"])
+            assert sorted(os.listdir(os.path.join(tempdir, "images"))) == sorted(
+                image["file_name"] for image in coco["images"]
+            )
+            for image in coco["images"]:
+                with Image.open(os.path.join(tempdir, "images", image["file_name"])) as rendered:
+                    assert rendered.format == "JPEG"
+                    assert rendered.size == (image["width"], image["height"])
+
+            # Images which already exist are not rendered again.
+            convert.reset_mock()
+            result = runner.invoke(export, args + [tempdir] + options)
+            assert result.exit_code == 0, result.output
+            assert convert.call_count == 0
+
+        with tempfile.TemporaryDirectory() as tempdir, unittest.mock.patch(
+            "pawls.commands.export.convert_from_path", side_effect=convert_from_path
+        ) as convert:
+            result = runner.invoke(
+                export, args + [tempdir] + options + ["--no-export-images"]
+            )
+            assert result.exit_code == 0, result.output
+            assert convert.call_count == 0
+            assert os.listdir(os.path.join(tempdir, "images")) == []
+
 
 class TestExportToken(TestExportCOCO):
     def test_export_annotation_from_all_annotators(self):
@@ -285,3 +328,15 @@ class TestExportToken(TestExportCOCO):
 
 if __name__ == "__main__":
     unittest.main()
+
+
+class TestLoadAnnotations(unittest.TestCase):
+    def test_load_annotations_replays_the_api_journal(self):
+        # The journal was written by the API (see api/app/journal.py), and ends
+        # with an append which hadn't finished yet.
+        fixtures = "test/fixtures/journal"
+        annotations = load_annotations(
+            os.path.join(fixtures, "markn@example.com_annotations.json")
+        )
+        expected = _load_json(os.path.join(fixtures, "expected_annotations.json"))
+        assert annotations == expected
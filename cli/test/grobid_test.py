@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pawls.commands.preprocess import process_concurrently, process_chunk
+from pawls.preprocessors.grobid import (
+    MAX_RETRY_DELAY,
+    fetch_grobid_structure,
+    get_session,
+    process_grobid,
+    retry_delay,
+)
+
+GROBID_STRUCTURE = {
+    "tokens": {
+        "pages": [
+            {
+                "page": {"width": 612.0, "height": 792.0, "pageNumber": 1},
+                "tokens": [
+                    {"text": "Hello", "x": 10.0, "y": 20.0, "width": 30.0, "height": 8.0}
+                ],
+            }
+        ]
+    }
+}
+
+
+class StubGrobid:
+    """A local stand-in for the grobid API, which answers each request after
+    `delay` seconds, and is busy (503) for the first `busy` requests.
+
+    If `wait_for` is set, requests are held until that many are in flight at
+    once (or a timeout passes), so that concurrency doesn't depend on timing.
+    """
+
+    def __init__(self, delay: float = 0.0, busy: int = 0, wait_for: int = 0):
+        self.delay = delay
+        self.busy = busy
+        self.wait_for = wait_for
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Condition()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                with stub.lock:
+                    stub.requests += 1
+                    busy = stub.requests <= stub.busy
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    stub.lock.notify_all()
+                    stub.lock.wait_for(
+                        lambda: stub.max_in_flight >= stub.wait_for, timeout=10
+                    )
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.in_flight -= 1
+
+                body = b"" if busy else json.dumps(GROBID_STRUCTURE).encode()
+                self.send_response(503 if busy else 200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestGrobid(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.TEST_ANNO_DIR = "test/fixtures/pawls/"
+        self.PDF_SHA = "553c58a05e25f794d24e8db8c2b8fdb9603e6a29"
+        self.pdf = os.path.join(self.TEST_ANNO_DIR, self.PDF_SHA, f"{self.PDF_SHA}.pdf")
+
+    def create_pdfs(self, tempdir: str, num_pdfs: int):
+        pdfs = []
+        for i in range(num_pdfs):
+            sha = f"pdf{i:03d}"
+            os.makedirs(os.path.join(tempdir, sha))
+            pdf = os.path.join(tempdir, sha, f"{sha}.pdf")
+            shutil.copy(self.pdf, pdf)
+            pdfs.append(pdf)
+        return pdfs
+
+    def test_process_grobid(self):
+        with StubGrobid() as grobid:
+            pages = process_grobid(self.pdf, grobid.host)
+
+        assert pages == [
+            {
+                "page": {"width": 612.0, "height": 792.0, "index": 0},
+                "tokens": [
+                    {"text": "Hello", "x": 10.0, "y": 20.0, "width": 30.0, "height": 8.0}
+                ],
+            }
+        ]
+
+    def test_retries_while_grobid_is_busy(self):
+        with StubGrobid(busy=2) as grobid:
+            structure = fetch_grobid_structure(self.pdf, grobid.host, backoff=0.01)
+            assert structure == GROBID_STRUCTURE
+            assert grobid.requests == 3
+
+        with StubGrobid(busy=3) as grobid:
+            with self.assertRaisesRegex(Exception, "503"):
+                fetch_grobid_structure(self.pdf, grobid.host, retries=2, backoff=0.01)
+            assert grobid.requests == 3
+
+    def test_retry_delay(self):
+        response = unittest.mock.Mock(headers={"Retry-After": "2"})
+        assert retry_delay(response, 0, 0.5) == 2
+        # Whatever grobid asks for, retries aren't put off indefinitely.
+        response = unittest.mock.Mock(headers={"Retry-After": "3600"})
+        assert retry_delay(response, 0, 0.5) == MAX_RETRY_DELAY
+        response = unittest.mock.Mock(headers={})
+        assert 0.25 <= retry_delay(response, 1, 0.25) <= 0.5
+        assert retry_delay(response, 20, 0.5) == MAX_RETRY_DELAY
+
+    def test_sessions_are_per_thread(self):
+        # requests doesn't guarantee that sessions are thread safe.
+        assert get_session() is get_session()
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+        assert sessions[0] is not get_session()
+
+    def test_concurrent_requests(self):
+        num_pdfs = 8
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdfs = self.create_pdfs(tempdir, num_pdfs)
+
+            with StubGrobid() as grobid:
+                stub_grobid = functools.partial(process_grobid, grobid_host=grobid.host)
+                with unittest.mock.patch.dict(
+                    "pawls.commands.preprocess.PREPROCESSORS", {"grobid": stub_grobid}
+                ):
+                    results = [process_chunk("grobid", [pdf])[0] for pdf in pdfs]
+            assert grobid.max_in_flight == 1
+
+            # Every request is held until all of them are in flight.
+            with StubGrobid(wait_for=num_pdfs) as grobid:
+                stub_grobid = functools.partial(process_grobid, grobid_host=grobid.host)
+                with unittest.mock.patch.dict(
+                    "pawls.commands.preprocess.PREPROCESSORS", {"grobid": stub_grobid}
+                ):
+                    results += list(process_concurrently("grobid", pdfs, num_pdfs))
+            assert grobid.max_in_flight == num_pdfs
+
+        assert [error for _, error in results] == [None] * num_pdfs * 2
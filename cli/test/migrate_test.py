@@ -0,0 +1,67 @@
+import os
+import shutil
+import unittest
+import tempfile
+import json
+
+from click.testing import CliRunner
+
+from pawls.commands import migrate_status, assign, status
+from pawls.commands.utils import load_annotator_status, list_annotators
+
+
+def _load_json(filename: str):
+    with open(filename, "r") as fp:
+        return json.load(fp)
+
+
+class TestMigrateStatus(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.TEST_ANNO_DIR = "test/fixtures/pawls/"
+        self.USERS = ["markn@example.com", "shannons@example.com"]
+        self.PDF_SHA = "553c58a05e25f794d24e8db8c2b8fdb9603e6a29"
+
+    def test_migrate_status(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            sub_temp_dir = os.path.join(tempdir, "pawls")
+            shutil.copytree(self.TEST_ANNO_DIR, sub_temp_dir)
+
+            result = runner.invoke(migrate_status, [sub_temp_dir])
+            assert result.exit_code == 0
+            assert os.path.exists(os.path.join(sub_temp_dir, "status.db"))
+
+            assert sorted(list_annotators(sub_temp_dir)) == self.USERS
+            for user in self.USERS:
+                user_status = load_annotator_status(sub_temp_dir, user)
+                json_status = _load_json(
+                    os.path.join(sub_temp_dir, "status", f"{user}.json")
+                )
+                assert user_status.keys() == json_status.keys()
+                for sha, paper_status in json_status.items():
+                    assert user_status[sha]["finished"] == paper_status["finished"]
+                    assert user_status[sha]["junk"] == paper_status["junk"]
+
+            result = runner.invoke(status, [sub_temp_dir])
+            assert result.exit_code == 0
+
+    def test_assign_after_migration(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            sub_temp_dir = os.path.join(tempdir, "pawls")
+            shutil.copytree(self.TEST_ANNO_DIR, sub_temp_dir)
+            runner.invoke(migrate_status, [sub_temp_dir])
+
+            result = runner.invoke(
+                assign, [sub_temp_dir, self.USERS[0], self.PDF_SHA]
+            )
+            assert result.exit_code == 0
+
+            # The assignment is stored in the database, not the json file.
+            user_status = load_annotator_status(sub_temp_dir, self.USERS[0])
+            assert self.PDF_SHA in user_status
+            assert len(user_status) == 3
+            assert self.PDF_SHA not in _load_json(
+                os.path.join(sub_temp_dir, "status", f"{self.USERS[0]}.json")
+            )
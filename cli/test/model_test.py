@@ -0,0 +1,174 @@
+import random
+import unittest
+
+import numpy as np
+
+from pawls.preprocessors.model import (
+    Block,
+    Box,
+    Token,
+    Page,
+    PageInfo,
+    PageTokens,
+    union_boxes,
+)
+
+
+def _random_page(rng: random.Random, num_tokens: int) -> Page:
+    tokens = [
+        Token(
+            x=float(rng.randint(0, 600)),
+            y=float(rng.randint(0, 780)),
+            width=float(rng.randint(1, 40)),
+            height=float(rng.randint(1, 12)),
+            text=str(i),
+        )
+        for i in range(num_tokens)
+    ]
+    return Page(page=PageInfo(width=612, height=792, index=0), tokens=tokens)
+
+
+class TestModel(unittest.TestCase):
+    def test_filter_tokens_by(self):
+        rng = random.Random(0)
+        page = _random_page(rng, 2000)
+        for _ in range(200):
+            box = Box(
+                x=float(rng.randint(0, 600)),
+                y=float(rng.randint(0, 780)),
+                width=float(rng.randint(0, 300)),
+                height=float(rng.randint(0, 200)),
+            )
+            soft_margin = rng.choice([None, dict(left=2, top=2, bottom=2, right=2)])
+            expected = {
+                idx: token
+                for idx, token in enumerate(page.tokens)
+                if token.is_in(box, soft_margin)
+            }
+            filtered = page.filter_tokens_by(box, soft_margin)
+            assert list(filtered.items()) == list(expected.items())
+
+    def test_filter_tokens_by_on_the_boundary(self):
+        tokens = [
+            Token(x=0, y=0, width=10, height=10, text="corner"),
+            Token(x=10, y=10, width=10, height=10, text="edge"),
+            Token(x=10.5, y=10, width=10, height=10, text="outside"),
+        ]
+        page = Page(page=PageInfo(width=100, height=100, index=0), tokens=tokens)
+        # The centers are at (5, 5), (15, 15) and (15.5, 15).
+        assert list(page.filter_tokens_by(Box(5, 5, 10, 10))) == [0, 1]
+        assert list(page.filter_tokens_by(Box(6, 6, 8, 8))) == []
+        assert list(page.filter_tokens_by(Box(6, 6, 8, 8), dict(right=1, bottom=1))) == [1]
+        assert page.filter_tokens_by(Box(0, 0, 0, 0)) == {}
+
+        empty = Page(page=PageInfo(width=100, height=100, index=0), tokens=[])
+        assert empty.filter_tokens_by(Box(0, 0, 100, 100)) == {}
+
+    def test_filter_tokens_by_after_scaling(self):
+        page = _random_page(random.Random(1), 500)
+        box = Box(100, 100, 200, 300)
+        before = list(page.filter_tokens_by(box))
+
+        page.scale((2.0, 0.5))
+        scaled_box = box.copy()
+        scaled_box.scale((2.0, 0.5))
+        assert list(page.filter_tokens_by(scaled_box)) == before
+
+    def test_page_tokens(self):
+        tokens = _random_page(random.Random(2), 300).tokens
+        page_tokens = PageTokens.from_tokens(tokens)
+
+        assert len(page_tokens) == 300
+        assert list(page_tokens) == tokens
+        assert page_tokens[-1] == tokens[-1]
+        assert page_tokens[10:12] == tokens[10:12]
+        assert page_tokens.scores is None
+        assert page_tokens[0].copy() == tokens[0]
+
+        for box in [Box(100, 100, 200, 300), Box(0, 0, 612, 792), Box(5, 5, 0, 0)]:
+            for soft_margin in [None, dict(left=2, top=2, bottom=2, right=2)]:
+                expected = [
+                    idx for idx, token in enumerate(tokens) if token.is_in(box, soft_margin)
+                ]
+                assert page_tokens.contained_in(box, soft_margin).tolist() == expected
+
+        assert page_tokens.union() == union_boxes(tokens)
+        assert page_tokens.union([3, 1, 4]) == union_boxes([tokens[1], tokens[3], tokens[4]])
+
+        page_tokens.scale((2.0, 0.5))
+        for token in tokens:
+            token.scale((2.0, 0.5))
+        assert list(page_tokens) == tokens
+
+    def test_page_tokens_views(self):
+        page_tokens = PageTokens.from_tokens(
+            [{"x": 0, "y": 0, "width": 10, "height": 10, "text": "a", "score": 0.5}]
+        )
+        token = page_tokens[0]
+        assert token == Token(0.0, 0.0, 10.0, 10.0, "a", 0.5)
+        assert token.center == (5, 5)
+
+        # Changes to the view are changes to the page, and vice versa.
+        token.pad(left=1, right=1)
+        token.text = "b"
+        assert page_tokens.coordinates.tolist() == [[-1, 0, 12, 10]]
+        assert page_tokens[0].text == "b"
+        page_tokens.scale(2.0)
+        assert token.coordinates == (-2, 0, 22, 20)
+
+    def test_page_tokens_iou(self):
+        page_tokens = PageTokens.from_tokens(
+            [
+                Token(0, 0, 10, 10, "same"),
+                Token(5, 0, 10, 10, "half"),
+                Token(20, 20, 10, 10, "apart"),
+                Token(0, 0, 0, 0, "empty"),
+            ]
+        )
+        iou = page_tokens.iou(Box(0, 0, 10, 10))
+        np.testing.assert_allclose(iou, [1, 50 / 150, 0, 0])
+
+    def test_filter_tokens_by_page_tokens(self):
+        page = _random_page(random.Random(3), 1000)
+        array_page = Page(page=page.page, tokens=PageTokens.from_tokens(page.tokens))
+        box = Box(100, 100, 200, 300)
+        soft_margin = dict(left=2, top=2, bottom=2, right=2)
+        assert array_page.filter_tokens_by(box, soft_margin) == page.filter_tokens_by(
+            box, soft_margin
+        )
+
+    def test_slotted_boxes(self):
+        token = Token(x=1, y=2, width=3, height=4, text="a", score=0.5)
+        block = Block(x=1, y=2, width=3, height=4, label="Title")
+        assert not hasattr(PageInfo(1, 2, 3), "__dict__")
+        for box in [token, block, Box(1, 2, 3, 4)]:
+            assert not hasattr(box, "__dict__")
+            copied = box.copy()
+            assert copied == box and copied is not box
+
+        assert Token(1, 2, 3, 4, "a").score is None
+        with self.assertRaises(AttributeError):
+            token.label = "Title"
+
+    def test_padded(self):
+        rng = random.Random(4)
+        for _ in range(100):
+            box = Block(
+                x=rng.uniform(0, 600),
+                y=rng.uniform(0, 780),
+                width=rng.uniform(0, 300),
+                height=rng.uniform(0, 200),
+                label="Title",
+            )
+            padding = dict(left=rng.uniform(0, 5), top=2, bottom=rng.uniform(0, 5), right=1)
+            original = box.copy()
+            padded = box.copy()
+            padded.pad(**padding)
+
+            assert box.padded_coordinates(**padding) == padded.coordinates
+            assert box.padded(**padding) == Box(
+                padded.x, padded.y, padded.width, padded.height
+            )
+            # Neither changes the box, nor does looking for a token inside it.
+            Token(0, 0, 1, 1, "a").is_in(box, padding)
+            assert box == original
@@ -0,0 +1,519 @@
+import os
+import gzip
+import hashlib
+import shutil
+import unittest
+import unittest.mock
+import tempfile
+import json
+import glob
+import random
+
+from click.testing import CliRunner
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+
+from pawls.commands import preprocess
+from pawls.commands.dataset import hash_pdf
+from pawls.preprocessors.pdfplumber import PDFPlumberTokenExtractor, process_pdfplumber
+from pawls.preprocessors.parallel import shard_pages
+from pawls.preprocessors.geometry import (
+    read_pdf_page_sizes,
+    load_cached_page_sizes,
+    get_pdf_page_sizes,
+)
+from pawls.preprocessors.hybrid import (
+    text_layer_problem,
+    contiguous_ranges,
+    image_coverage,
+    process_hybrid,
+)
+from pawls.commands.bench import write_synthetic_pdf
+from pawls.preprocessors.tesseract import rasterize_pages, parse_page_tokens
+from pawls.commands.preprocess import (
+    PREPROCESSORS,
+    PREPROCESSOR_PARAMS,
+    PREPROCESSOR_VERSIONS,
+    process_in_parallel,
+    process_pdf,
+)
+from pawls.preprocessors.model import load_tokens_from_file
+from pawls.preprocessors.storage import (
+    PdfStructure,
+    TokenStore,
+    iter_json_array,
+    find_json_array_offsets,
+    load_pdf_structure_metadata,
+    write_pdf_structure,
+)
+
+
+def _load_json(filename: str):
+    with open(filename, "r") as fp:
+        return json.load(fp)
+
+
+def _crash_on_bad_pdf(pdf_file: str):
+    if "bad" in pdf_file:
+        # A hard crash, like a segfault in a native library, rather than an exception.
+        os._exit(1)
+    return []
+
+
+class TestPreprocess(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.TEST_ANNO_DIR = "test/fixtures/pawls/"
+        self.PDF_SHA = "34f25a8704614163c4095b3ee2fc969b60de4698"
+        self.PDF_SHA_256 = hash_pdf(
+            os.path.join(self.TEST_ANNO_DIR, self.PDF_SHA, f"{self.PDF_SHA}.pdf")
+        )
+
+    def copy_pdf(self, tempdir: str) -> str:
+        pdf_dir = os.path.join(tempdir, self.PDF_SHA)
+        os.makedirs(pdf_dir)
+        shutil.copy(
+            os.path.join(self.TEST_ANNO_DIR, self.PDF_SHA, f"{self.PDF_SHA}.pdf"),
+            pdf_dir,
+        )
+        return pdf_dir
+
+    def test_preprocess_pdfplumber(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+
+            structure = _load_json(os.path.join(pdf_dir, "pdf_structure.json"))
+            assert len(structure) > 0
+            assert all(len(page["tokens"]) > 0 for page in structure)
+
+            # The token store holds the same tokens as the json.
+            token_store = TokenStore(os.path.join(pdf_dir, "pdf_structure.tokens"))
+            assert len(token_store) == len(structure)
+            for page_id, page_data in enumerate(structure):
+                page = token_store.page(page_id)
+                assert page.page.index == page_data["page"]["index"]
+                assert [token.text for token in page.tokens] == [
+                    token["text"] for token in page_data["tokens"]
+                ]
+                for token, token_data in zip(page.tokens, page_data["tokens"]):
+                    assert abs(token.x - token_data["x"]) < 1e-3
+                    assert abs(token.height - token_data["height"]) < 1e-3
+
+    def test_preprocess_writes_page_offsets(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+
+            structure_path = os.path.join(pdf_dir, "pdf_structure.json")
+            structure = _load_json(structure_path)
+            metadata = load_pdf_structure_metadata(pdf_dir)
+            assert len(metadata["pages"]) == len(structure)
+
+            with open(structure_path, "rb") as fp:
+                data = fp.read()
+            for (offset, length), page_data in zip(metadata["pages"], structure):
+                assert json.loads(data[offset : offset + length]) == page_data
+
+    def test_pdf_structure_loads_pages_lazily(self):
+        fixture = os.path.join(self.TEST_ANNO_DIR, self.PDF_SHA, "pdf_structure.json")
+        expected = load_tokens_from_file(fixture)
+        with open(fixture) as fp:
+            assert list(iter_json_array(fp, chunk_size=100)) == _load_json(fixture)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            write_pdf_structure(_load_json(fixture), tempdir)
+            structure_path = os.path.join(tempdir, "pdf_structure.json")
+            structure = PdfStructure(structure_path, cache_size=1)
+            assert structure.page_offsets is not None
+            assert len(structure) == len(expected)
+            assert list(structure) == expected
+            assert structure[-1] == expected[-1]
+            # Cached pages are returned as they are.
+            assert structure[-1] is structure[-1]
+            with self.assertRaises(IndexError):
+                structure[len(expected)]
+
+            # The offsets of a file which was replaced since are ignored.
+            with open(structure_path, "w") as fp:
+                json.dump(_load_json(fixture), fp, indent=2)
+            structure = PdfStructure(structure_path)
+            assert structure.page_offsets is None
+            assert list(structure) == expected
+            assert structure[1] == expected[1]
+            assert len(structure) == len(expected)
+
+    def test_find_json_array_offsets(self):
+        items = [{"text": "naïve ∑"}, [1, {"a": "]"}], "x, y", {}]
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "array.json")
+            with open(filename, "w", encoding="utf-8") as fp:
+                blobs = [json.dumps(item, ensure_ascii=False) for item in items]
+                fp.write("  [\n" + ",\n  ".join(blobs) + " ]")
+            with open(filename, "rb") as fp:
+                data = fp.read()
+            offsets = find_json_array_offsets(filename)
+        assert [
+            json.loads(data[offset : offset + length]) for offset, length in offsets
+        ] == items
+
+    def test_preprocess_writes_compressed_structure(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+
+            with open(os.path.join(pdf_dir, "pdf_structure.json"), "rb") as fp:
+                data = fp.read()
+            with gzip.open(os.path.join(pdf_dir, "pdf_structure.json.gz"), "rb") as fp:
+                assert fp.read() == data
+
+            metadata = load_pdf_structure_metadata(pdf_dir)
+            assert metadata["sha256"] == hashlib.sha256(data).hexdigest()
+
+    def test_preprocess_with_workers(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dirs = [self.copy_pdf(tempdir)]
+            for sha in ["copy1", "copy2"]:
+                pdf_dir = os.path.join(tempdir, sha)
+                os.makedirs(pdf_dir)
+                shutil.copy(
+                    os.path.join(pdf_dirs[0], f"{self.PDF_SHA}.pdf"),
+                    os.path.join(pdf_dir, f"{sha}.pdf"),
+                )
+                pdf_dirs.append(pdf_dir)
+
+            # One unreadable pdf doesn't stop the others from being processed.
+            os.makedirs(os.path.join(tempdir, "broken"))
+            with open(os.path.join(tempdir, "broken", "broken.pdf"), "w") as fp:
+                fp.write("not a pdf")
+
+            result = runner.invoke(
+                preprocess, ["pdfplumber", tempdir, "--workers", "2", "--chunk-size", "1"]
+            )
+            assert result.exit_code == 1
+            assert "Failed to process 1 of 4 pdfs" in result.output
+            assert "broken.pdf" in result.output
+
+            structures = [
+                _load_json(os.path.join(pdf_dir, "pdf_structure.json"))
+                for pdf_dir in pdf_dirs
+            ]
+            assert structures[0] == structures[1] == structures[2]
+            assert not os.path.exists(
+                os.path.join(tempdir, "broken", "pdf_structure.json")
+            )
+            # No temporary files are left behind by the atomic writes.
+            assert not [f for f in os.listdir(pdf_dirs[0]) if f.endswith(".tmp")]
+
+    def test_process_in_parallel_isolates_crashes(self):
+        pdfs = ["good1.pdf", "bad.pdf", "good2.pdf", "good3.pdf"]
+        with unittest.mock.patch.dict(
+            PREPROCESSORS, {"crash": _crash_on_bad_pdf}
+        ), unittest.mock.patch.dict(
+            PREPROCESSOR_VERSIONS, {"crash": "1"}
+        ), unittest.mock.patch(
+            "pawls.commands.preprocess.create_manifest"
+        ), unittest.mock.patch(
+            "pawls.commands.preprocess.read_pdf_page_sizes"
+        ), unittest.mock.patch(
+            "pawls.commands.preprocess.write_pdf_structure"
+        ):
+            results = dict(process_in_parallel("crash", pdfs, 2, 2))
+
+        assert set(results) == set(pdfs)
+        assert "crashed" in results["bad.pdf"]
+        assert all(results[pdf] is None for pdf in pdfs if pdf != "bad.pdf")
+
+    def test_preprocess_skips_up_to_date_pdfs(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            pdf_path = os.path.join(pdf_dir, f"{self.PDF_SHA}.pdf")
+            structure_path = os.path.join(pdf_dir, "pdf_structure.json")
+
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+            manifest = load_pdf_structure_metadata(pdf_dir)["manifest"]
+            assert manifest["preprocessor"] == "pdfplumber"
+            assert manifest["pdf_sha256"] == self.PDF_SHA_256
+            mtime = os.stat(structure_path).st_mtime_ns
+
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+            assert "Skipping 1 pdfs" in result.output
+            assert os.stat(structure_path).st_mtime_ns == mtime
+
+            # Touching the pdf without changing it doesn't invalidate the output.
+            os.utime(pdf_path)
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert "Skipping 1 pdfs" in result.output
+
+            # A different preprocessor, or --force, processes the pdf again.
+            with unittest.mock.patch.dict(PREPROCESSOR_VERSIONS, {"pdfplumber": "2"}):
+                result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert "Skipping" not in result.output
+            assert load_pdf_structure_metadata(pdf_dir)["manifest"]["version"] == "2"
+
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir, "--force"])
+            assert "Skipping" not in result.output
+            assert load_pdf_structure_metadata(pdf_dir)["manifest"]["version"] == "1"
+
+    def test_pdfplumber_tokens_are_clipped_to_page(self):
+        page = unittest.mock.Mock(width=100.5, height=50)
+        page.extract_words.return_value = [
+            {"text": "inside", "x0": 10, "x1": 20, "top": 5, "bottom": 15},
+            {"text": "outside", "x0": -5, "x1": 120, "top": 40, "bottom": 60},
+        ]
+        tokens = PDFPlumberTokenExtractor().obtain_word_tokens(page)
+        assert tokens == [
+            {"text": "inside", "x": 10.0, "width": 10.0, "y": 5.0, "height": 10.0},
+            {"text": "outside", "x": 0.0, "width": 100.0, "y": 40.0, "height": 10.0},
+        ]
+        assert all(type(token["x"]) is float for token in tokens)
+
+    def test_shard_pages(self):
+        assert shard_pages(10, 4) == [range(0, 3), range(3, 6), range(6, 8), range(8, 10)]
+        assert shard_pages(2, 8) == [range(0, 1), range(1, 2)]
+        assert shard_pages(0, 4) == [range(0, 0)]
+
+    def test_pdfplumber_page_workers(self):
+        pdf_path = os.path.join(self.TEST_ANNO_DIR, self.PDF_SHA, f"{self.PDF_SHA}.pdf")
+        sequential = process_pdfplumber(pdf_path)
+        assert process_pdfplumber(pdf_path, workers=3) == sequential
+
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            result = runner.invoke(
+                preprocess,
+                ["pdfplumber", tempdir, "--workers", "2", "--page-workers", "2"],
+            )
+            assert result.exit_code == 0
+            structure = _load_json(os.path.join(pdf_dir, "pdf_structure.json"))
+            assert structure == json.loads(json.dumps(sequential))
+
+            result = runner.invoke(
+                preprocess, ["grobid", tempdir, "--page-workers", "2"]
+            )
+            assert result.exit_code == 2
+
+    def test_rasterize_pages_one_window_at_a_time(self):
+        rendered = []
+
+        def convert_from_path(pdf_file, dpi, first_page, last_page):
+            # Every previously rendered image was closed before the next window.
+            assert all(image.close.called for image in rendered)
+            images = [unittest.mock.Mock() for _ in range(first_page, last_page + 1)]
+            rendered.extend(images)
+            return images
+
+        with unittest.mock.patch(
+            "pawls.preprocessors.tesseract.convert_from_path",
+            side_effect=convert_from_path,
+        ) as convert:
+            pages = [
+                page_index
+                for page_index, _ in rasterize_pages("a.pdf", range(2, 7), dpi=100, window=2)
+            ]
+
+        assert pages == [2, 3, 4, 5, 6]
+        assert [call.kwargs for call in convert.call_args_list] == [
+            {"dpi": 100, "first_page": 3, "last_page": 4},
+            {"dpi": 100, "first_page": 5, "last_page": 6},
+            {"dpi": 100, "first_page": 7, "last_page": 7},
+        ]
+
+    def test_preprocess_dpi_only_applies_to_ocr(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.copy_pdf(tempdir)
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir, "--dpi", "100"])
+            assert result.exit_code == 2
+
+    def test_parse_tesseract_tokens(self):
+        tsv = "\n".join(
+            [
+                "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t"
+                "left\ttop\twidth\theight\tconf\ttext",
+                "1\t1\t0\t0\t0\t0\t0\t0\t200\t100\t-1\t",
+                "4\t1\t1\t1\t1\t0\t10\t20\t60\t10\t-1\t",
+                "5\t1\t1\t1\t1\t1\t10\t20\t30\t10\t96.5\tHello",
+                "5\t1\t1\t1\t1\t2\t50\t20\t20\t10\t91\t\"nan\"",
+                "5\t1\t1\t1\t1\t3\t80\t20\t4\t10\t12\t ",
+                "5\t1\t1\t1\t1\t4\t90\t20\t10\t10\t88\t42",
+            ]
+        )
+        tokens = parse_page_tokens(tsv, (0.5, 2.0))
+        assert tokens == [
+            {"x": 5.0, "y": 40.0, "width": 15.0, "height": 20.0, "text": "Hello"},
+            {"x": 25.0, "y": 40.0, "width": 10.0, "height": 20.0, "text": '"nan"'},
+            {"x": 45.0, "y": 40.0, "width": 5.0, "height": 20.0, "text": "42"},
+        ]
+
+        scores = parse_page_tokens(tsv, (0.5, 2.0), include_score=True)
+        assert [token["score"] for token in scores] == [96.5, 91.0, 88.0]
+        assert parse_page_tokens("", (1.0, 1.0)) == []
+
+    def test_parse_tesseract_tokens_text(self):
+        header = (
+            "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t"
+            "left\ttop\twidth\theight\tconf\ttext"
+        )
+        words = ["nan", "NA", "null", "N/A", "\t", "  ", "007"]
+        rows = [
+            f"5\t1\t1\t1\t1\t{i}\t0\t0\t1\t1\t90\t{word}"
+            for i, word in enumerate(words)
+        ]
+        tsv = "\n".join([header] + rows)
+        # Unlike with pandas, which the preprocessor used before, words which
+        # look like missing values are kept, and whitespace-only words are dropped.
+        tokens = parse_page_tokens(tsv, (1.0, 1.0))
+        assert [token["text"] for token in tokens] == ["nan", "NA", "null", "N/A", "007"]
+
+    def test_text_layer_problem(self):
+        def tokens(*texts):
+            return [{"text": text} for text in texts]
+
+        assert text_layer_problem(tokens()) == "empty"
+        assert text_layer_problem(tokens("12")) == "empty"
+        assert text_layer_problem(tokens("A", "scanned", "page", "title")) is None
+        assert text_layer_problem(tokens("(cid:12)(cid:7)", "a", "scanned")) == "garbage"
+        symbols = tokens("#$%&!", "*()@", "§¶!!", "abcdefghij")
+        assert text_layer_problem(symbols) == "garbage"
+        # Math symbols don't count against pages of equations.
+        equations = tokens(
+            "f(x)", "=", "∑", "(", "a", "+", "b", ")", "≤", "2", "ab", "c=d+e", "×", "yz"
+        )
+        assert text_layer_problem(equations) is None
+        assert text_layer_problem(tokens("\ufffd\ufffd", "abcdefghij")) == "garbage"
+
+    def test_contiguous_ranges(self):
+        assert contiguous_ranges([]) == []
+        assert contiguous_ranges([0, 1, 2, 5, 7, 8]) == [
+            range(0, 3),
+            range(5, 6),
+            range(7, 9),
+        ]
+
+    def test_hybrid_ocrs_only_pages_without_text(self):
+        text = [{"text": "born digital", "x": 1, "y": 1, "width": 1, "height": 1}]
+        ocr_text = [{"text": "scanned", "x": 2, "y": 2, "width": 2, "height": 2}]
+        pages = [
+            {"page": {"width": 100, "height": 200, "index": i}, "tokens": tokens}
+            for i, tokens in enumerate([text, [], [], text, []])
+        ]
+
+        def ocr_page_range(pdf_file, page_ids, pdf_sizes, dpi, scores):
+            assert pdf_sizes == [(100, 200)] * 5
+            return [
+                {"page": {"width": 1, "height": 1, "index": i}, "tokens": ocr_text}
+                for i in page_ids
+            ]
+
+        with unittest.mock.patch(
+            "pawls.preprocessors.hybrid.process_pdfplumber", return_value=pages
+        ), unittest.mock.patch(
+            "pawls.preprocessors.hybrid.image_coverage",
+            side_effect=lambda pdf_file, page_ids: {i: 1.0 for i in page_ids},
+        ), unittest.mock.patch(
+            "pawls.preprocessors.hybrid.ocr_page_range", side_effect=ocr_page_range
+        ) as ocr:
+            result = process_hybrid("a.pdf", dpi=100)
+
+        ocr_pages = [page for call in ocr.call_args_list for page in call.args[1]]
+        assert ocr_pages == [1, 2, 4]
+        assert [page["tokens"] for page in result] == [
+            text,
+            ocr_text,
+            ocr_text,
+            text,
+            ocr_text,
+        ]
+        assert [page["page"] for page in result] == [page["page"] for page in pages]
+        assert [page["provenance"] for page in result] == [
+            {"preprocessor": "pdfplumber"},
+            {"preprocessor": "ocr", "reason": "empty"},
+            {"preprocessor": "ocr", "reason": "empty"},
+            {"preprocessor": "pdfplumber"},
+            {"preprocessor": "ocr", "reason": "empty"},
+        ]
+
+    def test_hybrid_keeps_sparse_born_digital_pages(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf = os.path.join(tempdir, "sparse.pdf")
+            # A page with a handful of words, a scanned page, and a blank page.
+            write_synthetic_pdf(pdf, 3, 2, {1}, random.Random(0))
+            coverage = image_coverage(pdf, [0, 1, 2])
+            assert coverage[0] == coverage[2] == 0
+            assert coverage[1] > 0.9
+
+            def ocr_page_range(pdf_file, page_ids, pdf_sizes, dpi, scores):
+                return [
+                    {"page": {"width": 1, "height": 1, "index": i}, "tokens": []}
+                    for i in page_ids
+                ]
+
+            with unittest.mock.patch(
+                "pawls.preprocessors.hybrid.ocr_page_range", side_effect=ocr_page_range
+            ) as ocr:
+                result = process_hybrid(pdf)
+
+        assert [page for call in ocr.call_args_list for page in call.args[1]] == [1]
+        assert [page["provenance"] for page in result] == [
+            {"preprocessor": "pdfplumber"},
+            {"preprocessor": "ocr", "reason": "empty"},
+            {"preprocessor": "pdfplumber"},
+        ]
+
+    def test_page_sizes_are_cached_by_preprocess(self):
+        for pdf in glob.glob(os.path.join(self.TEST_ANNO_DIR, "*/*.pdf")):
+            with open(pdf, "rb") as fp:
+                document = PDFDocument(PDFParser(fp))
+                assert read_pdf_page_sizes(pdf) == [
+                    (int(page.mediabox[2]), int(page.mediabox[3]))
+                    for page in PDFPage.create_pages(document)
+                ]
+
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf_dir = self.copy_pdf(tempdir)
+            pdf = os.path.join(pdf_dir, f"{self.PDF_SHA}.pdf")
+            page_sizes = read_pdf_page_sizes(pdf)
+            assert load_cached_page_sizes(pdf) is None
+
+            result = runner.invoke(preprocess, ["pdfplumber", tempdir])
+            assert result.exit_code == 0
+            assert load_cached_page_sizes(pdf) == page_sizes
+
+            with unittest.mock.patch(
+                "pawls.preprocessors.geometry.read_pdf_page_sizes"
+            ) as read:
+                assert get_pdf_page_sizes(pdf) == page_sizes
+                assert not read.called
+
+            # The cache is ignored once the pdf changes.
+            os.utime(pdf, ns=(0, 0))
+            assert load_cached_page_sizes(pdf) is None
+            assert get_pdf_page_sizes(pdf) == page_sizes
+
+    def test_ocr_reuses_the_page_sizes_read_by_preprocess(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdf = os.path.join(self.copy_pdf(tempdir), f"{self.PDF_SHA}.pdf")
+            page_sizes = read_pdf_page_sizes(pdf)
+            with unittest.mock.patch(
+                "pawls.preprocessors.tesseract.get_pdf_page_sizes"
+            ) as get_sizes, unittest.mock.patch(
+                "pawls.preprocessors.tesseract.map_page_shards", return_value=[]
+            ) as map_shards:
+                process_pdf("ocr", pdf, params=PREPROCESSOR_PARAMS["ocr"])
+
+            assert not get_sizes.called
+            assert map_shards.call_args.args[0].keywords["pdf_sizes"] == page_sizes
@@ -0,0 +1,106 @@
+"""This script compares the cost of finding the tokens inside blocks on dense
+pages, between testing every token against each block (the implementation of
+`Page.filter_tokens_by` before it used a spatial index) and the current
+`Page.filter_tokens_by`, as called by `pawls preannotate` and `pawls export`.
+
+Each page has `--tokens` tokens laid out in lines, and is queried with `--blocks`
+random blocks of the sizes of paragraphs, figures and columns.
+
+Usage:
+    python benchmark_filter_tokens.py --tokens 5000 --blocks 200
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import time
+import random
+import argparse
+
+from pawls.preprocessors.model import Box, Token, Page, PageInfo
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tokens", type=int, default=5000)
+parser.add_argument("--blocks", type=int, default=200)
+parser.add_argument("--pages", type=int, default=5)
+
+PADDING = dict(left=2, top=2, bottom=2, right=2)
+
+
+def create_page(rng, num_tokens):
+    # Tokens are laid out in lines, like the words of a dense page of text.
+    words_per_line = max(1, int((num_tokens / 3) ** 0.5))
+    num_lines = num_tokens // words_per_line + 1
+    word_width = 540 / words_per_line
+    line_height = 720 / num_lines
+    tokens = [
+        Token(
+            x=36 + (i % words_per_line) * word_width,
+            y=36 + (i // words_per_line) * line_height,
+            width=word_width * rng.uniform(0.5, 0.9),
+            height=line_height * 0.8,
+            text=str(i),
+        )
+        for i in range(num_tokens)
+    ]
+    return Page(page=PageInfo(width=612, height=792, index=0), tokens=tokens)
+
+
+def create_blocks(rng, num_blocks):
+    return [
+        Box(
+            x=rng.uniform(0, 500),
+            y=rng.uniform(0, 700),
+            width=rng.uniform(50, 540),
+            height=rng.uniform(10, 300),
+        )
+        for _ in range(num_blocks)
+    ]
+
+
+def filter_by_scanning(page, box, soft_margin):
+    """The implementation of filter_tokens_by before the spatial index."""
+    return {
+        idx: token
+        for idx, token in enumerate(page.tokens)
+        if token.is_in(box, soft_margin)
+    }
+
+
+def filter_by_index(page, box, soft_margin):
+    return page.filter_tokens_by(box, soft_margin)
+
+
+def time_per_block(filter_tokens, pages, blocks):
+    start = time.perf_counter()
+    for page in pages:
+        for block in blocks:
+            filter_tokens(page, block, PADDING)
+    return (time.perf_counter() - start) / (len(pages) * len(blocks))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rng = random.Random(0)
+    pages = [create_page(rng, args.tokens) for _ in range(args.pages)]
+    blocks = create_blocks(rng, args.blocks)
+
+    for page in pages:
+        for block in blocks:
+            assert filter_by_scanning(page, block, PADDING) == filter_by_index(
+                page, block, PADDING
+            )
+
+    # The indexes were built by the check above, so time building them separately.
+    fresh_pages = [create_page(random.Random(0), args.tokens) for _ in range(args.pages)]
+    start = time.perf_counter()
+    for page in fresh_pages:
+        page.filter_tokens_by(blocks[0])
+    build = (time.perf_counter() - start) / len(fresh_pages)
+
+    print(f"{args.tokens} tokens per page, {args.blocks} blocks per page")
+    scanning = time_per_block(filter_by_scanning, pages, blocks)
+    index = time_per_block(filter_by_index, pages, blocks)
+    print(f"scanning every token: {scanning * 1000:8.3f} ms/block")
+    print(f"spatial index:        {index * 1000:8.3f} ms/block")
+    print(f"building the index:   {build * 1000:8.3f} ms/page")
+    print(f"speedup:              {scanning / index:8.1f}x")
@@ -0,0 +1,88 @@
+"""This script compares the geometry of the tokens of a page, between a list of
+`Token` objects (the representation of `Page.tokens` before `PageTokens`) and
+the array-backed `PageTokens`, for the operations used by `pawls preannotate`
+and `pawls export`: scaling a page to the size of another, finding the tokens
+inside a box, and the union of the tokens.
+
+Usage:
+    python benchmark_page_tokens.py --tokens 30000 --repeats 20
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import time
+import random
+import argparse
+
+from pawls.preprocessors.model import Box, Token, PageTokens, union_boxes
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tokens", type=int, default=30000)
+parser.add_argument("--repeats", type=int, default=20)
+
+PADDING = dict(left=2, top=2, bottom=2, right=2)
+
+
+def create_tokens(rng, num_tokens):
+    return [
+        Token(
+            x=rng.uniform(0, 600),
+            y=rng.uniform(0, 780),
+            width=rng.uniform(1, 40),
+            height=rng.uniform(1, 12),
+            text=str(i),
+        )
+        for i in range(num_tokens)
+    ]
+
+
+def scale_list(tokens):
+    for token in tokens:
+        token.scale((1.0001, 0.9999))
+
+
+def scale_array(tokens):
+    tokens.scale((1.0001, 0.9999))
+
+
+def contained_list(tokens, box):
+    return [idx for idx, token in enumerate(tokens) if token.is_in(box, PADDING)]
+
+
+def contained_array(tokens, box):
+    return tokens.contained_in(box, PADDING).tolist()
+
+
+def timed(function, *args, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    tokens = create_tokens(random.Random(0), args.tokens)
+
+    start = time.perf_counter()
+    page_tokens = PageTokens.from_tokens(tokens)
+    build = time.perf_counter() - start
+
+    box = Box(100, 100, 300, 400)
+    assert contained_list(tokens, box) == contained_array(page_tokens, box)
+    assert union_boxes(tokens) == page_tokens.union()
+
+    print(f"{args.tokens} tokens per page")
+    print(f"building PageTokens: {build * 1000:8.3f} ms")
+    rows = [
+        ("scale", (scale_list, tokens), (scale_array, page_tokens)),
+        ("contained in box", (contained_list, tokens, box), (contained_array, page_tokens, box)),
+        ("union", (union_boxes, tokens), (PageTokens.union, page_tokens)),
+    ]
+    for name, (listed, *list_args), (array, *array_args) in rows:
+        list_time = timed(listed, *list_args, repeats=args.repeats)
+        array_time = timed(array, *array_args, repeats=args.repeats)
+        print(
+            f"{name:<17} list: {list_time * 1000:8.3f} ms  "
+            f"array: {array_time * 1000:8.3f} ms  speedup: {list_time / array_time:6.1f}x"
+        )
@@ -0,0 +1,94 @@
+"""This script compares the per-page cost of converting pdfplumber words into
+pawls tokens, between the previous DataFrame.apply implementation and the
+current numpy implementation of `PDFPlumberTokenExtractor.obtain_word_tokens`.
+
+Words are extracted from each page once, so only the conversion is timed.
+
+Usage:
+    python benchmark_pdfplumber_tokens.py --repeats 20
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import os
+import time
+import argparse
+from glob import glob
+from unittest import mock
+
+import pandas as pd
+import pdfplumber
+
+from pawls.preprocessors.pdfplumber import PDFPlumberTokenExtractor
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "../cli/test/fixtures/pawls")
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--pdf", type=str, nargs="+", required=False)
+parser.add_argument("--repeats", type=int, default=10)
+
+
+def convert_with_dataframe(words, page):
+    """The implementation of obtain_word_tokens before it was vectorized."""
+    df = pd.DataFrame(words)
+    df[["x0", "x1"]] = df[["x0", "x1"]].clip(lower=0, upper=int(page.width)).astype("float")
+    df[["top", "bottom"]] = (
+        df[["top", "bottom"]].clip(lower=0, upper=int(page.height)).astype("float")
+    )
+    df["height"] = df["bottom"] - df["top"]
+    df["width"] = df["x1"] - df["x0"]
+    return df.apply(
+        lambda row: dict(
+            text=row["text"],
+            x=row["x0"],
+            width=row["width"],
+            y=row["top"],
+            height=row["height"],
+        ),
+        axis=1,
+    ).tolist()
+
+
+def convert_with_numpy(words, page):
+    extractor = PDFPlumberTokenExtractor()
+    with mock.patch.object(page, "extract_words", return_value=words):
+        return extractor.obtain_word_tokens(page)
+
+
+def time_per_page(convert, pages, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for words, page in pages:
+            convert(words, page)
+    return (time.perf_counter() - start) / (repeats * len(pages))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    pdfs = args.pdf or sorted(glob(os.path.join(FIXTURES, "*/*.pdf")))
+
+    pages = []
+    for pdf in pdfs:
+        for page in pdfplumber.open(pdf).pages:
+            words = page.extract_words(
+                x_tolerance=1.5,
+                y_tolerance=3,
+                keep_blank_chars=False,
+                use_text_flow=True,
+                horizontal_ltr=True,
+                vertical_ttb=True,
+                extra_attrs=["fontname", "size"],
+            )
+            if words:
+                pages.append((words, page))
+
+    for words, page in pages:
+        assert convert_with_dataframe(words, page) == convert_with_numpy(words, page)
+
+    num_words = sum(len(words) for words, _ in pages)
+    print(f"{len(pages)} pages, {num_words / len(pages):.0f} words per page")
+    dataframe = time_per_page(convert_with_dataframe, pages, args.repeats)
+    numpy = time_per_page(convert_with_numpy, pages, args.repeats)
+    print(f"DataFrame.apply: {dataframe * 1000:8.3f} ms/page")
+    print(f"numpy:           {numpy * 1000:8.3f} ms/page")
+    print(f"speedup:         {dataframe / numpy:8.1f}x")
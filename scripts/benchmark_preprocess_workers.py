@@ -0,0 +1,75 @@
+"""This script measures how `pawls preprocess --workers N` scales with the
+number of worker processes.
+
+The pdfs in the cli test fixtures are copied into a temporary labeling folder
+until it has `--num_pdfs` pdfs, which are then preprocessed with each number of
+workers in turn.
+
+Usage:
+    python benchmark_preprocess_workers.py --preprocessor pdfplumber --num_pdfs 64 --workers 1 2 4 8
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from glob import glob
+
+from pawls.commands.preprocess import process_chunk, process_in_parallel
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "../cli/test/fixtures/pawls")
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--preprocessor", type=str, default="pdfplumber")
+parser.add_argument("--num_pdfs", type=int, default=32)
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+parser.add_argument("--chunk_size", type=int, required=False)
+
+
+def create_corpus(labeling_folder: str, num_pdfs: int):
+    sources = sorted(glob(os.path.join(FIXTURES, "*/*.pdf")))
+    pdfs = []
+    for i in range(num_pdfs):
+        sha = f"pdf{i:05d}"
+        os.makedirs(os.path.join(labeling_folder, sha))
+        pdf = os.path.join(labeling_folder, sha, f"{sha}.pdf")
+        shutil.copy(sources[i % len(sources)], pdf)
+        pdfs.append(pdf)
+    return pdfs
+
+
+def run(preprocessor, pdfs, workers, chunk_size):
+    start = time.perf_counter()
+    if workers == 1:
+        results = [process_chunk(preprocessor, [pdf])[0] for pdf in pdfs]
+    else:
+        chunk_size = chunk_size or max(1, len(pdfs) // (workers * 4))
+        results = list(process_in_parallel(preprocessor, pdfs, workers, chunk_size))
+    elapsed = time.perf_counter() - start
+
+    failed = [pdf for pdf, error in results if error is not None]
+    if failed:
+        raise RuntimeError(f"Failed to process {failed}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        pdfs = create_corpus(tempdir, args.num_pdfs)
+        print(f"{os.cpu_count()} cpus, {len(pdfs)} pdfs, {args.preprocessor}")
+        print(f"{'workers':>8} {'seconds':>10} {'pdfs/s':>10} {'speedup':>10}")
+
+        baseline = None
+        for workers in args.workers:
+            elapsed = run(args.preprocessor, pdfs, workers, args.chunk_size)
+            # Relative to the first number of workers.
+            baseline = baseline or elapsed
+            print(
+                f"{workers:>8} {elapsed:>10.2f} {len(pdfs) / elapsed:>10.2f} "
+                f"{baseline / elapsed:>10.2f}"
+            )
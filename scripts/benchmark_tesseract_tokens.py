@@ -0,0 +1,137 @@
+"""This script compares the per-page cost of converting the TSV output of tesseract
+into pawls tokens, between the previous pandas groupby/apply implementation and
+the current `parse_page_tokens`.
+
+Tesseract isn't run: a synthetic page with `--words` words, laid out in lines and
+blocks like the real output of `pytesseract.image_to_data`, is parsed instead, so
+only the conversion is timed.
+
+Usage:
+    python benchmark_tesseract_tokens.py --words 500 --repeats 20
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import io
+import csv
+import time
+import random
+import argparse
+
+import pandas as pd
+
+from pawls.preprocessors.tesseract import parse_page_tokens
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--words", type=int, default=500)
+parser.add_argument("--words_per_line", type=int, default=12)
+parser.add_argument("--lines_per_block", type=int, default=10)
+parser.add_argument("--repeats", type=int, default=20)
+
+HEADER = [
+    "level",
+    "page_num",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+    "text",
+]
+
+
+def create_tsv(num_words, words_per_line, lines_per_block):
+    rnd = random.Random(0)
+    rows = [HEADER, [1, 1, 0, 0, 0, 0, 0, 0, 1700, 2200, -1, ""]]
+    block = line = None
+    for i in range(num_words):
+        line_id, word_id = divmod(i, words_per_line)
+        block_id = line_id // lines_per_block + 1
+        top = 100 + line_id * 30
+        if block != block_id:
+            block = block_id
+            rows.append([2, 1, block_id, 0, 0, 0, 100, top, 1500, 300, -1, ""])
+            rows.append([3, 1, block_id, 1, 0, 0, 100, top, 1500, 300, -1, ""])
+        if line != line_id:
+            line = line_id
+            rows.append([4, 1, block_id, 1, line_id + 1, 0, 100, top, 1500, 25, -1, ""])
+        word = "".join(rnd.choice("abcdefghij") for _ in range(rnd.randint(1, 10)))
+        conf = round(rnd.uniform(30, 97), 6)
+        left = 100 + word_id * 120
+        rows.append(
+            [5, 1, block_id, 1, line_id + 1, word_id + 1, left, top, 100, 25, conf, word]
+        )
+    return "\n".join("\t".join(str(value) for value in row) for row in rows) + "\n"
+
+
+def parse_with_pandas(tsv, scale):
+    """The implementation of extract_page_tokens before it parsed the TSV directly."""
+    scale_w, scale_h = scale
+    res = pd.read_csv(
+        io.StringIO(tsv), quoting=csv.QUOTE_NONE, encoding="utf-8", sep="\t"
+    )
+    return (
+        res[~res.text.isna()]
+        .groupby(["page_num", "block_num", "par_num", "line_num", "word_num"])
+        .apply(
+            lambda gp: pd.Series(
+                [
+                    gp["left"].min(),
+                    gp["top"].min(),
+                    gp["width"].max(),
+                    gp["height"].max(),
+                    gp["conf"].mean(),
+                    gp["text"].astype(str).str.cat(sep=" "),
+                ]
+            )
+        )
+        .reset_index(drop=True)
+        .reset_index()
+        .rename(
+            columns={
+                0: "x",
+                1: "y",
+                2: "width",
+                3: "height",
+                4: "score",
+                5: "text",
+                "index": "id",
+            }
+        )
+        .drop(columns=["score", "id"])
+        .assign(
+            x=lambda df: df.x * scale_w,
+            y=lambda df: df.y * scale_h,
+            width=lambda df: df.width * scale_w,
+            height=lambda df: df.height * scale_h,
+        )
+        .apply(lambda row: row.to_dict(), axis=1)
+        .tolist()
+    )
+
+
+def time_per_page(parse, tsv, scale, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parse(tsv, scale)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    tsv = create_tsv(args.words, args.words_per_line, args.lines_per_block)
+    # The scale from a page rasterized at 200 dpi back to pdf points.
+    scale = (72 / 200, 72 / 200)
+
+    assert parse_with_pandas(tsv, scale) == parse_page_tokens(tsv, scale)
+
+    print(f"{args.words} words per page")
+    pandas = time_per_page(parse_with_pandas, tsv, scale, args.repeats)
+    direct = time_per_page(parse_page_tokens, tsv, scale, args.repeats)
+    print(f"pandas groupby/apply: {pandas * 1000:8.3f} ms/page")
+    print(f"direct TSV parser:    {direct * 1000:8.3f} ms/page")
+    print(f"speedup:              {pandas / direct:8.1f}x")
@@ -0,0 +1,135 @@
+"""This script compares the memory and throughput of the `Token` and `Box`
+classes of the pawls cli, between the dataclasses with a per-instance
+`__dict__` (the implementation before they were slotted, copied below) and the
+current slotted classes, for the operations used by `pawls export` and
+`pawls preannotate`: creating tokens, copying them, testing whether they are
+inside a padded box, and padding a box.
+
+Usage:
+    python benchmark_token_classes.py --tokens 1000000
+
+Requires the pawls cli to be installed (see cli/readme.md).
+"""
+
+import time
+import random
+import argparse
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from pawls.preprocessors.model import Box, Token
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tokens", type=int, default=1000000)
+
+PADDING = dict(left=2, top=2, bottom=2, right=2)
+
+
+@dataclass
+class DictBox:
+    """Box before it was slotted."""
+
+    x: float
+    y: float
+    width: float
+    height: float
+
+    @property
+    def center(self):
+        return self.x + self.width / 2, self.y + self.height / 2
+
+    @property
+    def coordinates(self):
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+    def is_in(self, other: "DictBox", soft_margin: Dict = None) -> bool:
+        other = other.copy()
+
+        x, y = self.center
+        if soft_margin is not None:
+            other.pad(**soft_margin)
+        xa, ya, xb, yb = other.coordinates
+
+        return xa <= x <= xb and ya <= y <= yb
+
+    def pad(self, left=0, top=0, bottom=0, right=0):
+        self.x -= left
+        self.y -= top
+        self.width += left + right
+        self.height += top + bottom
+
+    def copy(self):
+        return self.__class__(**vars(self))
+
+
+@dataclass
+class DictToken(DictBox):
+    """Token before it was slotted."""
+
+    text: str
+    score: Optional[float] = None
+
+
+def create_tokens(token_class, values):
+    return [token_class(x, y, width, height, text) for x, y, width, height, text in values]
+
+
+def measure(token_class, box_class, values, box):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tokens = create_tokens(token_class, values)
+    create = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    inside = sum(token.is_in(box, PADDING) for token in tokens)
+    is_in = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for token in tokens:
+        token.copy()
+    copy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if box_class is Box:
+        for token in tokens:
+            token.padded(**PADDING)
+    else:
+        for token in tokens:
+            token.copy().pad(**PADDING)
+    pad = time.perf_counter() - start
+
+    return {
+        "bytes/token": memory / len(tokens),
+        "create (M/s)": len(tokens) / create / 1e6,
+        "is_in (M/s)": len(tokens) / is_in / 1e6,
+        "copy (M/s)": len(tokens) / copy / 1e6,
+        "padded copy (M/s)": len(tokens) / pad / 1e6,
+    }, inside
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rng = random.Random(0)
+    values = [
+        (
+            rng.uniform(0, 600),
+            rng.uniform(0, 780),
+            rng.uniform(1, 40),
+            rng.uniform(1, 12),
+            str(i % 1000),
+        )
+        for i in range(args.tokens)
+    ]
+
+    before, inside_before = measure(DictToken, DictBox, values, DictBox(100, 100, 300, 400))
+    after, inside_after = measure(Token, Box, values, Box(100, 100, 300, 400))
+    assert inside_before == inside_after
+
+    print(f"{args.tokens} tokens")
+    print(f"{'':<18} {'dataclass':>10} {'slotted':>10} {'ratio':>8}")
+    for name in before:
+        ratio = before[name] / after[name] if name == "bytes/token" else after[name] / before[name]
+        print(f"{name:<18} {before[name]:10.2f} {after[name]:10.2f} {ratio:7.2f}x")
@@ -7,6 +7,7 @@ export interface Token {
     height: number;
     width: number;
     text: string;
+    score?: number;
 }
 
 interface Page {
@@ -32,6 +33,18 @@ export async function getTokens(sha: string): Promise<PageTokens[]> {
     return axios.get(`${docURL(sha)}/tokens`).then((r) => r.data);
 }
 
+/**
+ * Fetches the tokens for the pages in the range [start, end) only, so that
+ * pages can be loaded as they're needed rather than all at once.
+ */
+export async function getPageRangeTokens(
+    sha: string,
+    start: number,
+    end: number
+): Promise<PageTokens[]> {
+    return axios.get(`${docURL(sha)}/tokens/${start}/${end}`).then((r) => r.data);
+}
+
 export interface Label {
     text: string;
     color: string;
@@ -59,6 +72,24 @@ export interface PaperStatus {
 export interface Allocation {
     papers: PaperStatus[];
     hasAllocatedPapers: boolean;
+    total: number;
+}
+
+export interface AllocationQuery {
+    finished?: boolean;
+    junk?: boolean;
+    has_annotations?: boolean;
+    sort?: string;
+    offset?: number;
+    limit?: number;
+}
+
+export interface AllocationSummary {
+    hasAllocatedPapers: boolean;
+    total: number;
+    finished: number;
+    junk: number;
+    annotated: number;
 }
 
 export async function setPdfComment(sha: string, comments: string) {
@@ -73,8 +104,16 @@ export async function setPdfJunk(sha: string, junk: boolean) {
     return axios.post(`/api/doc/${sha}/junk`, junk);
 }
 
-export async function getAllocatedPaperStatus(): Promise<Allocation> {
-    return axios.get('/api/annotation/allocation/info').then((r) => r.data);
+export async function getAllocatedPaperStatus(query?: AllocationQuery): Promise<Allocation> {
+    return axios.get('/api/annotation/allocation/info', { params: query }).then((r) => r.data);
+}
+
+export async function getPdfTitles(shas: string[]): Promise<{ [sha: string]: string | null }> {
+    return axios.post('/api/doc/titles', shas).then((r) => r.data);
+}
+
+export async function getAllocationSummary(): Promise<AllocationSummary> {
+    return axios.get('/api/annotation/allocation/summary').then((r) => r.data);
 }
 
 export function saveAnnotations(sha: string, pdfAnnotations: PdfAnnotations): Promise<any> {
@@ -84,6 +123,26 @@ export function saveAnnotations(sha: string, pdfAnnotations: PdfAnnotations): Pr
     });
 }
 
+export interface AnnotationChanges {
+    annotations: {
+        added?: Annotation[];
+        updated?: Annotation[];
+        deleted?: string[];
+    };
+    relations: {
+        added?: RelationGroup[];
+        deleted?: RelationGroup[];
+    };
+}
+
+/**
+ * Saves only the annotations and relations which changed since the last save,
+ * rather than all of them.
+ */
+export function saveAnnotationChanges(sha: string, changes: AnnotationChanges): Promise<any> {
+    return axios.patch(`/api/doc/${sha}/annotations`, changes);
+}
+
 export async function getAnnotations(sha: string): Promise<PdfAnnotations> {
     return axios.get(`/api/doc/${sha}/annotations`).then((response) => {
         const ann: PdfAnnotations = response.data;